@@ -58,6 +58,19 @@ class ProblemImageAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(ProblemImageFileId)
+class ProblemImageFileIdAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "problem_image",
+        "bot",
+        "file_id",
+        "file_name",
+        "file_size",
+        "file_mtime",
+    )
+
+
 @admin.register(GroupType)
 class GroupTypeAdmin(admin.ModelAdmin):
     list_display = (
@@ -248,6 +261,26 @@ class BotBindingAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(BotLease)
+class BotLeaseAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "bot",
+        "owner",
+        "expires",
+        "fencing_token",
+    )
+
+
+@admin.register(LeaseNode)
+class LeaseNodeAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "owner",
+        "expires",
+    )
+
+
 @admin.register(Answer)
 class AnswerAdmin(admin.ModelAdmin):
     list_display = (
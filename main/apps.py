@@ -3,3 +3,16 @@ from django.apps import AppConfig
 
 class MainConfig(AppConfig):
     name = 'main'
+
+    def ready(self):
+        from django.db.models.signals import post_delete
+        from main.models import Answer
+        from main.data_managers import (identity_cache, score_thresholds_index, leaderboard_ranks,
+                                         problem_payloads, subject_sequences, answer_tallies)
+        identity_cache.connect_signals()
+        score_thresholds_index.connect_signals()
+        leaderboard_ranks.connect_signals()
+        problem_payloads.connect_signals()
+        subject_sequences.connect_signals()
+        answer_tallies.connect_signals()
+        post_delete.connect(Answer.on_delete, sender=Answer)  # Keeping the answer counters of the participants
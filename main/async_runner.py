@@ -0,0 +1,99 @@
+"""
+Asyncio based update engine - is used by runner.py in the --async mode.
+All bots' getUpdates long-polls are multiplexed over a single event loop with aiohttp,
+while the handlers (which are synchronous and are using Django ORM) are executed in a bounded thread pool,
+so that one slow handler can't stall the long-polls of the other bots.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from django.db import close_old_connections
+
+from main.worker import Worker
+from main.program_settings import ASYNC_HANDLERS_POOL_SIZE
+
+LONG_POLLING_TIMEOUT = 60
+RESTART_CHECK_INTERVAL = 1  # seconds
+
+
+async def fetch_updates(session: aiohttp.ClientSession, worker: Worker, *, timeout=LONG_POLLING_TIMEOUT) -> list:
+    """ Will long-poll getUpdates of the worker's bot, returns [] on failures """
+    try:
+        async with session.get(
+                worker.bot.base_url + 'getUpdates',
+                params={
+                    'offset': worker.bot.offset or '',
+                    'timeout': timeout
+                },
+                timeout=aiohttp.ClientTimeout(total=timeout * 1.5)) as resp:
+            data = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.info("Trying to reconnect [{}]: {}".format(worker.bot.name, e))
+        await asyncio.sleep(2)
+        return []
+    if not data.get('ok'):
+        print(data)
+        await asyncio.sleep(1)
+        return []
+    return data.get('result') or []
+
+
+def handle_updates_batch(worker: Worker, updates: list):
+    """ Is running in the executor - will process the updates with the worker """
+    close_old_connections()
+    try:
+        worker.checkpointer.touch()
+        worker.process_updates(updates)
+        worker.do_checks()
+    finally:
+        close_old_connections()
+
+
+async def poll_bot(session: aiohttp.ClientSession, worker: Worker, executor: ThreadPoolExecutor):
+    """ Will continuously get the bot's updates and give them to the executor """
+    loop = asyncio.get_event_loop()
+    while True:
+        updates = await fetch_updates(session, worker)
+        # Waiting for the batch to be handled before the next long-poll, because the offset is changed there
+        await loop.run_in_executor(executor, handle_updates_batch, worker, updates)
+
+
+async def watch_for_restart(check_for_restart):
+    """ Will return when check_for_restart returns True """
+    loop = asyncio.get_event_loop()
+    while not await loop.run_in_executor(None, check_for_restart):
+        await asyncio.sleep(RESTART_CHECK_INTERVAL)
+
+
+async def run_bots(bots, *, check_for_restart=None):
+    """ Will run polling tasks for all bots until check_for_restart returns True """
+    executor = ThreadPoolExecutor(max_workers=ASYNC_HANDLERS_POOL_SIZE)
+    workers = [Worker(bot) for bot in bots]
+    try:
+        async with aiohttp.ClientSession() as session:
+            tasks = [asyncio.ensure_future(poll_bot(session, worker, executor)) for worker in workers]
+            if check_for_restart:
+                tasks.append(asyncio.ensure_future(watch_for_restart(check_for_restart)))
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()  # Raising exceptions of the polling tasks
+    finally:
+        executor.shutdown(wait=True)  # Letting the already started handlers to finish
+        for worker in workers:
+            worker.shutdown()
+
+
+def run(bots, *, check_for_restart=None):
+    """ Will run the event loop """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run_bots(bots, check_for_restart=check_for_restart))
+    finally:
+        loop.close()
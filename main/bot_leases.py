@@ -0,0 +1,180 @@
+"""
+Database-lease coordination of the runner nodes - is used by runner.py with --lease
+- Every bot has a BotLease row, a node owns the bot while it's renewing the lease (heartbeat) before it expires
+- Leases are claimed and renewed with conditional UPDATEs, so only one node can win a bot,
+  this works the same on PostgreSQL and SQLite
+- The expired leases (orphaned bots of stopped or stuck nodes) are claimed by the other nodes,
+  every node is claiming up to its fair share of the bots (bots / alive nodes)
+- Every node renews its LeaseNode row with the heartbeat, so the alive nodes are counted even before they own
+  a bot - a node above its fair share hands over one bot per heartbeat (see Lease.handover)
+- The fencing token is incremented on every claim and the offset is saved only with the current token,
+  so a stale owner can't move the offset back (see OffsetCheckpointer)
+The times are taken from the database clock, so the clocks of the nodes don't have to be in sync.
+"""
+
+import os
+import math
+import random
+import socket
+import time
+import threading
+from datetime import timedelta
+from django.db.models import F, Q, Value, DateTimeField, DurationField, ExpressionWrapper
+from django.db.models.functions import Now
+
+from main.models import Bot, BotLease, LeaseNode
+from main.program_settings import LEASE_TTL, LEASE_HEARTBEAT_INTERVAL, LEASE_MAX_BOTS
+
+
+class LeaseLost(Exception):
+    """ Is raised when the node doesn't own the bot anymore """
+
+    def __init__(self, lease):
+        super().__init__('Lease of bot {} is lost (fencing token {})'.format(lease.bot_id, lease.fencing_token))
+        self.lease = lease
+
+
+class Lease:
+    """ Lease owned by this node """
+
+    def __init__(self, bot_id, owner: str, fencing_token: int, *, ttl=LEASE_TTL,
+                 heartbeat_interval=LEASE_HEARTBEAT_INTERVAL):
+        self.bot_id = bot_id
+        self.owner = owner
+        self.fencing_token = fencing_token
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.lost = threading.Event()
+        self.handover = threading.Event()  # Is set when the bot has to be stopped and released for other nodes
+        self.valid_until = 0
+        self.extend(time.monotonic())
+
+    def extend(self, renewed_at: float):
+        # Not trusting the lease for the last heartbeat interval, another node can claim it right after expiring
+        self.valid_until = renewed_at + self.ttl - self.heartbeat_interval
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.lost.is_set() and time.monotonic() < self.valid_until
+
+
+def get_node_name() -> str:
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _expires(ttl):
+    """ Database time after ttl seconds """
+    return ExpressionWrapper(Now() + Value(timedelta(seconds=ttl), output_field=DurationField()),
+                             output_field=DateTimeField())
+
+
+class LeaseManager:
+    """ Will claim, renew and release the leases of the node """
+
+    def __init__(self, owner=None, *, ttl=LEASE_TTL, heartbeat_interval=LEASE_HEARTBEAT_INTERVAL,
+                 max_bots=LEASE_MAX_BOTS):
+        self.owner = owner or get_node_name()
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.max_bots = max_bots
+        self.leases = {}  # {bot_id: Lease}
+
+    def ensure_rows(self, bot_ids):
+        """ Will create missing lease rows """
+        existing = set(BotLease.objects.filter(bot_id__in=bot_ids).values_list('bot_id', flat=True))
+        BotLease.objects.bulk_create(
+            [BotLease(bot_id=bot_id) for bot_id in bot_ids if bot_id not in existing], ignore_conflicts=True)
+
+    def try_claim(self, bot_id) -> Lease or None:
+        """ Will claim the bot if its lease is free or expired """
+        started = time.monotonic()
+        claimed = BotLease.objects.filter(bot_id=bot_id).filter(Q(owner='') | Q(expires__lt=Now())).update(
+            owner=self.owner, expires=_expires(self.ttl), fencing_token=F('fencing_token') + 1)
+        if not claimed:
+            return None
+        fencing_token = BotLease.objects.filter(bot_id=bot_id, owner=self.owner).values_list(
+            'fencing_token', flat=True).first()
+        if fencing_token is None:
+            return None
+        lease = Lease(bot_id, self.owner, fencing_token, ttl=self.ttl, heartbeat_interval=self.heartbeat_interval)
+        lease.extend(started)
+        self.leases[bot_id] = lease
+        return lease
+
+    def renew(self, lease: Lease) -> bool:
+        """ Will extend the lease - returns False and marks it as lost if another node has claimed it """
+        started = time.monotonic()
+        renewed = BotLease.objects.filter(
+            bot_id=lease.bot_id, owner=lease.owner, fencing_token=lease.fencing_token).update(
+            expires=_expires(self.ttl))
+        if renewed:
+            lease.extend(started)
+            return True
+        lease.lost.set()
+        self.leases.pop(lease.bot_id, None)
+        return False
+
+    def release(self, lease: Lease):
+        """ Will free the lease, so that other nodes don't have to wait for its expiration """
+        BotLease.objects.filter(bot_id=lease.bot_id, owner=lease.owner, fencing_token=lease.fencing_token).update(
+            owner='', expires=Now())
+        lease.lost.set()
+        self.leases.pop(lease.bot_id, None)
+
+    def release_all(self):
+        for lease in list(self.leases.values()):
+            self.release(lease)
+        LeaseNode.objects.filter(owner=self.owner).delete()  # The other nodes can take the share right away
+
+    def renew_node(self):
+        """ Will mark the node as alive for ttl seconds and remove the rows of long dead nodes """
+        if not LeaseNode.objects.filter(owner=self.owner).update(expires=_expires(self.ttl)):
+            LeaseNode.objects.bulk_create([LeaseNode(owner=self.owner, expires=_expires(self.ttl))],
+                                          ignore_conflicts=True)
+        LeaseNode.objects.filter(expires__lt=Now()).delete()
+
+    def get_fair_share(self, bots_count: int) -> int:
+        """ Will return the count of bots this node has to own """
+        other_nodes = LeaseNode.objects.filter(expires__gte=Now()).exclude(owner=self.owner).count()
+        share = math.ceil(bots_count / (other_nodes + 1))
+        return min(share, self.max_bots) if self.max_bots else share
+
+    def hand_over_excess(self, share: int) -> Lease or None:
+        """ Will mark one lease above the share for the handover - the owner of the lease has to stop the bot
+        (flushing its offset) and release it, the other nodes will claim it """
+        if len(self.leases) <= share or any(lease.handover.is_set() for lease in self.leases.values()):
+            return None  # One bot per heartbeat, so the bots aren't stopped all at once
+        lease = random.choice(list(self.leases.values()))
+        lease.handover.set()
+        return lease
+
+    def heartbeat(self, bot_ids) -> (list, list, list):
+        """ Will renew the node and the owned leases, claim orphaned bots and hand over the bots above
+        the fair share - returns (claimed leases, lost leases, leases to hand over) """
+        bot_ids = list(bot_ids)
+        self.renew_node()
+        lost = [lease for lease in list(self.leases.values()) if not self.renew(lease)]
+        for lease in list(self.leases.values()):
+            if lease.bot_id not in bot_ids:  # The bot is removed or is not in this mode anymore
+                self.release(lease)
+                lost.append(lease)
+        self.ensure_rows(bot_ids)
+        free = [bot_id for bot_id in bot_ids if bot_id not in self.leases]
+        random.shuffle(free)  # The nodes started at the same time won't compete for the same bots
+        claimed = []
+        share = self.get_fair_share(len(bot_ids))
+        for bot_id in free:
+            if len(self.leases) >= share:
+                break
+            lease = self.try_claim(bot_id)
+            if lease:
+                claimed.append(lease)
+        handover = self.hand_over_excess(share)
+        return claimed, lost, [handover] if handover else []
+
+
+def save_offset(bot: Bot, lease: Lease) -> bool:
+    """ Will save offset and last_updated of the bot only if the lease is still current (fenced write) """
+    return bool(Bot.objects.filter(
+        id=bot.id, botlease__owner=lease.owner, botlease__fencing_token=lease.fencing_token).update(
+        offset=bot.offset, last_updated=bot.last_updated))
@@ -0,0 +1,71 @@
+"""
+Per-chat ordered parallel dispatch of the updates of one bot - is used by Worker.process_updates
+- A batch is split by chat id, different chats are handled concurrently in a thread pool
+  and the updates of one chat are handled strictly in order
+- The offset is advanced only past the contiguous prefix of the completed updates, so after a crash
+  the not handled updates are received again (the handled ones are skipped with the checkpointer's journal)
+- When an update fails, the rest of its chat's updates are not handled and the exception is raised
+  after the other chats are finished
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.db import close_old_connections
+
+from main.program_settings import CHAT_DISPATCH_WORKERS
+
+
+def get_chat_id(update: dict):
+    """ Will return the chat id of the update or None """
+    message = update.get('message')
+    return message['chat']['id'] if message and message.get('chat') else None
+
+
+class ChatDispatcher:
+    """ Will dispatch the batches of updates to the thread pool """
+
+    def __init__(self, *, workers=CHAT_DISPATCH_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-dispatch')
+
+    def dispatch(self, updates: list, handle, complete):
+        """ Will handle the updates and wait for them
+        :param handle: callable(update) - is handling one update, is called in the pool threads
+        :param complete: callable(update) - is called in order for every update of the completed prefix
+        """
+        chats = OrderedDict()
+        for index, update in enumerate(updates):
+            chats.setdefault(get_chat_id(update), []).append(index)
+        if len(chats) <= 1:  # Nothing to parallelize
+            for update in updates:
+                handle(update)
+                complete(update)
+            return
+        done = set()
+        lock = threading.Lock()
+        prefix = 0
+
+        def mark_done(index):
+            nonlocal prefix
+            with lock:
+                done.add(index)
+                while prefix < len(updates) and prefix in done:
+                    complete(updates[prefix])
+                    prefix += 1
+
+        def handle_chat(indexes):
+            close_old_connections()
+            try:
+                for index in indexes:
+                    handle(updates[index])
+                    mark_done(index)
+            finally:
+                close_old_connections()
+
+        futures = [self.executor.submit(handle_chat, indexes) for indexes in chats.values()]
+        wait(futures)
+        for future in futures:
+            future.result()  # Raising the exceptions of the chats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -1,8 +1,10 @@
 import logging
-from main.models import Problem, MessageInstance, ActionType
+from main.models import Problem
 from main.dynamic_telegraph_page_creator import DynamicTelegraphPageCreator
 from datetime import datetime
 from django.utils import timezone
+from main.outbound_scheduler import PRIORITY_PROBLEM
+from main.data_managers import problem_payloads, message_instance_recorder
 
 
 def answer_problem(worker):
@@ -18,8 +20,8 @@ def answer_problem(worker):
 
     # Registering message instance
     if worker.source.command == 'answer':
-        MessageInstance.objects.create(
-            action_type=ActionType.objects.get(value='problem_command'),
+        message_instance_recorder.record(
+            action_type='problem_command',
             date=datetime.fromtimestamp(
                 worker['message']["date"], tz=timezone.get_current_timezone()),
             message_id=worker.source.message['message_id'],
@@ -39,18 +41,18 @@ def answer_problem(worker):
             return
         elif not problem or index < problem.index:
             try:
-                problem = worker.source.participant_group.activeSubjectGroupBinding.subject.problem_set.get(
+                problem = worker.source.participant_group.activeSubjectGroupBinding.subject.get_problem(
                     index=index)
             except Problem.DoesNotExist:
                 worker.source.bot.send_message(worker.source.participant_group,
                                                "Invalid problem number {}.")
             else:
-                resps = worker.source.bot.send_message(
-                    worker.source.participant_group, problem.get_answer())
+                resps = worker.source.bot.send_message_blocks(
+                    worker.source.participant_group, problem_payloads.get_payload(problem).answer_blocks,
+                    priority=PRIORITY_PROBLEM)
                 for resp in resps:
-                    MessageInstance.objects.create(
-                        action_type=ActionType.objects.get(
-                            value='problem_associated'),
+                    message_instance_recorder.record(
+                        action_type='problem_associated',
                         date=datetime.fromtimestamp(
                             resp["date"], tz=timezone.get_current_timezone()),
                         message_id=resp['message_id'],
@@ -58,44 +60,14 @@ def answer_problem(worker):
                         participant_group=worker.participant_group,
                         text=None,
                         current_problem=problem)
-                for problemimage in sorted(
-                        problem.problemimage_set.filter(for_answer=True),
-                        key=lambda img: img.id):
-                    image = problemimage.image
-                    try:
-                        resp = worker.source.bot.send_image(
-                            worker.source.participant_group,
-                            open(image.path, "rb"),
-                            caption="Image of problem N{}'s answer.".format(
-                                problem.index),
-                        )
-                        worker.unilog(
-                            "Sending image for problem {}'s answer".format(
-                                problem.index))
-                    except Exception as e:
-                        worker.unilog(
-                            "Can't send image {} for problem N{}'s answer.".
-                            format(image, problem.index))
-                        print(e)
-                        logging.info(e)
-                    else:
-                        MessageInstance.objects.create(
-                            action_type=ActionType.objects.get(
-                                value='problem_associated'),
-                            date=datetime.fromtimestamp(
-                                resp["date"],
-                                tz=timezone.get_current_timezone()),
-                            message_id=resp['message_id'],
-                            participant=None,
-                            participant_group=worker.participant_group,
-                            text=None,
-                            current_problem=problem)
+                send_answer_images(worker, problem)
             return
-    resps = worker.source.bot.send_message(worker.source.participant_group,
-                                           problem.get_answer())
+    resps = worker.source.bot.send_message_blocks(worker.source.participant_group,
+                                                  problem_payloads.get_payload(problem).answer_blocks,
+                                                  priority=PRIORITY_PROBLEM)
     for resp in resps:
-        MessageInstance.objects.create(
-            action_type=ActionType.objects.get(value='problem_associated'),
+        message_instance_recorder.record(
+            action_type='problem_associated',
             date=datetime.fromtimestamp(
                 resp["date"], tz=timezone.get_current_timezone()),
             message_id=resp['message_id'],
@@ -104,41 +76,14 @@ def answer_problem(worker):
             text=None,
             current_problem=problem)
 
-    for problemimage in sorted(
-            problem.problemimage_set.filter(for_answer=True),
-            key=lambda img: img.id):
-        image = problemimage.image
-        try:
-            resp = worker.source.bot.send_image(
-                worker.source.participant_group,
-                open(image.path, "rb"),
-                caption="Image of problem N{}'s answer.".format(problem.index),
-            )
-            worker.unilog("Sending image for problem {}'s answer".format(
-                problem.index))
-        except Exception as e:
-            worker.unilog(
-                "Can't send image {} for problem N{}'s answer.".format(
-                    image, problem.index))
-            print(e)
-            logging.info(e)
-        else:
-            MessageInstance.objects.create(
-                action_type=ActionType.objects.get(value='problem_associated'),
-                date=datetime.fromtimestamp(
-                    resp["date"], tz=timezone.get_current_timezone()),
-                message_id=resp['message_id'],
-                participant=None,
-                participant_group=worker.participant_group,
-                text=None,
-                current_problem=problem)
-    old_positions = worker.participant_group.get_participants_positions()
+    send_answer_images(worker, problem)
+    leaderboard, worker.source.position_change = problem.close_with_position_change(
+        worker.source.participant_group)
     resps = worker.source.bot.send_message(
-        worker.source.participant_group,
-        problem.close(worker.source.participant_group))
+        worker.source.participant_group, leaderboard, priority=PRIORITY_PROBLEM)
     for resp in resps:
-        MessageInstance.objects.create(
-            action_type=ActionType.objects.get(value='problem_associated'),
+        message_instance_recorder.record(
+            action_type='problem_associated',
             date=datetime.fromtimestamp(
                 resp["date"], tz=timezone.get_current_timezone()),
             message_id=resp['message_id'],
@@ -146,12 +91,6 @@ def answer_problem(worker):
             participant_group=worker.participant_group,
             text=None,
             current_problem=problem)
-
-    new_positions = worker.participant_group.get_participants_positions()
-    worker.source.position_change = {
-        key: old_positions[key] - new_positions[key]
-        for key in new_positions
-    }
     t_pages = worker.source.participant_group.telegraphpage_set.all()
     if t_pages:  # Create the page manually with DynamicTelegraphPageCreator
         t_page = t_pages[
@@ -164,3 +103,25 @@ def answer_problem(worker):
             content=worker.createGroupLeaderBoardForTelegraph())
     worker.source.participant_group.activeProblem = None
     worker.source.participant_group.save()
+
+
+def send_answer_images(worker, problem):
+    """ Will send images of the problem's answer as albums """
+    problem_images = problem_payloads.get_payload(problem).answer_images
+    if not problem_images:
+        return
+    failed_images = []
+    resps = worker.source.bot.send_problem_images(
+        worker.source.participant_group,
+        problem_images,
+        caption="Image of problem N{}'s answer.".format(problem.index),
+        priority=PRIORITY_PROBLEM,
+        failed=failed_images,
+    )
+    message_instance_recorder.record_bot_messages(resps, worker.participant_group, problem)
+    worker.unilog("Sending {} images for problem {}'s answer".format(
+        len(resps), problem.index))
+    if failed_images:
+        worker.unilog(
+            "Can't send images {} for problem N{}'s answer.".format(
+                ', '.join(str(problemimage.image) for problemimage in failed_images), problem.index))
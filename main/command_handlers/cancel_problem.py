@@ -1,4 +1,5 @@
 from main.models import Answer, MessageInstance
+from main.data_managers import answer_tallies, message_instance_recorder
 
 
 def cancel_problem(worker):
@@ -9,7 +10,9 @@ def cancel_problem(worker):
             problem=worker.source.participant_group.activeProblem)]
         for answer in answers:
             answer.delete()
+        answer_tallies.drop(worker.source.participant_group, worker.source.participant_group.activeProblem)
         
+        message_instance_recorder.flush()  # The problem's messages can be still buffered
         for message_instance in MessageInstance.objects.filter(current_problem=worker.source.participant_group.activeProblem):
             message_instance.remove_message(worker)
             message_instance.delete()
@@ -1,5 +1,5 @@
 from main.command_handlers import send_problem, answer_problem
-from main.models import MessageInstance, ActionType
+from main.data_managers import message_instance_recorder
 from datetime import datetime
 from django.utils import timezone
 
@@ -11,8 +11,8 @@ def cycle(worker):
 
     # Registering message instance - before updating active problem
     if worker.source.command == 'cycle':
-        MessageInstance.objects.create(
-            action_type=ActionType.objects.get(value='problem_command'),
+        message_instance_recorder.record(
+            action_type='problem_command',
             date=datetime.fromtimestamp(
                 worker['message']["date"],
                 tz=timezone.get_current_timezone()),
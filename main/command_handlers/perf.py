@@ -0,0 +1,31 @@
+from main import instrumentation
+from main.universals import get_sessions_stats
+from main.program_settings import INSTRUMENTATION_WINDOW_SECONDS
+
+
+def perf(worker):
+    """ Will send the latencies, DB queries and Bot API calls of the stages and commands to the administrator page """
+    if not instrumentation.ENABLED:
+        worker.answer_to_the_message("The instrumentation is disabled (INSTRUMENTATION_ENABLED).")
+        return
+    lines = ['Last {} seconds - p50/p95/p99 ms, queries p50/max, API calls p50/max'.format(
+        INSTRUMENTATION_WINDOW_SECONDS)]
+    for kind, name, durations, queries, api_calls in instrumentation.get_summary():
+        if not durations.count:
+            continue
+        line = '{} {} x{}: {:.0f}/{:.0f}/{:.0f}'.format(
+            kind, name, durations.count, *(durations.percentile(quantile) * 1000
+                                            for quantile in instrumentation.QUANTILES))
+        if queries.count:
+            line += ', q {:.0f}/{:.0f}, api {:.0f}/{:.0f}'.format(
+                queries.percentile(0.5), queries.max, api_calls.percentile(0.5), api_calls.max)
+        lines.append(line)
+    for session_key, stats in sorted(get_sessions_stats().items()):
+        lines.append('http {}: {} requests, {} new connections'.format(
+            session_key, stats['requests'], stats['new_connections']))
+    if len(lines) == 1:
+        lines.append('Nothing is handled yet.')
+    worker.source.bot.send_message(
+        worker.source.administrator_page,
+        '\n'.join(lines),
+        reply_to_message_id=worker.source.message['message_id'])
@@ -1,7 +1,10 @@
+from main.models import GroupSpecificParticipantData
+
+
 def recalculate_roles(worker):
     """
     Will recalculate roles of all members of the bound participant group
     """
-    for gspd in worker.source.administrator_page.participant_group.groupspecificparticipantdata_set.all():
-        gspd.recalculate_roles()
+    GroupSpecificParticipantData.bulk_recalculate_roles(
+        worker.source.administrator_page.participant_group.groupspecificparticipantdata_set.all())
     worker.unilog("All roles are recalculated, to update the leaderboard run /recreate_leaderboard command.")
@@ -8,4 +8,4 @@ def restart(worker):
         bot's commands are being processed
     """
     worker.unilog("Has to restart")
-    worker.add_to_post_processing_stack(worker.bot, update_and_restart)
+    worker.add_to_post_processing_stack(update_and_restart)
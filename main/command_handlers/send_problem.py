@@ -1,9 +1,10 @@
 import logging
-from main.models import Problem, MessageInstance, ActionType
+from main.models import Problem
 from main.data_managers.user_registry import register_current_participant_group_members_count
-from os import path
+from main.data_managers import problem_payloads, answer_tallies, message_instance_recorder
 from datetime import datetime
 from django.utils import timezone
+from main.outbound_scheduler import PRIORITY_PROBLEM
 
 
 def send_problem(worker) -> None:
@@ -18,7 +19,7 @@ def send_problem(worker) -> None:
     if len(worker.source.raw_text.split()) > 1:
         index = int(worker.source.raw_text.split()[1])
         try:
-            problem: Problem = worker.source.participant_group.activeSubjectGroupBinding.subject.problem_set.get(
+            problem: Problem = worker.source.participant_group.activeSubjectGroupBinding.subject.get_problem(
                 index=index)
         except Problem.DoesNotExist:
             worker.source.bot.send_message(
@@ -40,7 +41,8 @@ def send_problem(worker) -> None:
                 "There was no active problem in this group, so use the command like this - /send 1"
             )
             return
-        problem: Problem = worker.source.participant_group.activeSubjectGroupBinding.last_problem.next
+        problem: Problem = problem_payloads.get_next_problem(
+            worker.source.participant_group.activeSubjectGroupBinding.last_problem)
         if not problem:
             worker.source.bot.send_message(
                 worker.source.participant_group,
@@ -51,8 +53,8 @@ def send_problem(worker) -> None:
 
     # Registering message instance with updated active problem
     if worker.source.command == 'send':
-        MessageInstance.objects.create(
-            action_type=ActionType.objects.get(value='problem_command'),
+        message_instance_recorder.record(
+            action_type='problem_command',
             date=datetime.fromtimestamp(
                 worker['message']["date"], tz=timezone.get_current_timezone()),
             message_id=worker.source.message['message_id'],
@@ -61,12 +63,13 @@ def send_problem(worker) -> None:
             text=worker.source.raw_text,
             current_problem=problem)
 
-    form_resp = worker.source.bot.send_message(worker.source.participant_group,
-                                               str(problem))
+    payload = problem_payloads.get_payload(problem)
+    form_resp = worker.source.bot.send_message_blocks(worker.source.participant_group,
+                                                      payload.problem_blocks, priority=PRIORITY_PROBLEM)
 
     for resp in form_resp:
-        MessageInstance.objects.create(
-            action_type=ActionType.objects.get(value='problem_associated'),
+        message_instance_recorder.record(
+            action_type='problem_associated',
             date=datetime.fromtimestamp(
                 resp["date"], tz=timezone.get_current_timezone()),
             message_id=resp['message_id'],
@@ -77,39 +80,31 @@ def send_problem(worker) -> None:
 
     logging.debug("Sending problem {}".format(problem.index))
     logging.debug(form_resp)
-    for problemimage in sorted(
-            problem.problemimage_set.filter(for_answer=False),
-            key=lambda img: img.id):
-        image = problemimage.image
-        try:
-            resp = worker.source.bot.send_image(
-                worker.source.participant_group,
-                open(image.path, "rb"),
-                reply_to_message_id=form_resp[0].get(
-                    "message_id"),  # Temporarily disabling
-                caption="Image of problem N{}.".format(problem.index),
-            )
-            MessageInstance.objects.create(
-                action_type=ActionType.objects.get(value='problem_associated'),
-                date=datetime.fromtimestamp(
-                    resp["date"], tz=timezone.get_current_timezone()),
-                message_id=resp['message_id'],
-                participant=None,
-                participant_group=worker.participant_group,
-                text=None,
-                current_problem=problem)
-            logging.debug("Sending image for problem {}".format(problem.index))
-            worker.adm_log("Sent image {} for problem N{}".format(
-                path.basename(image.name), problem.index))
-        except Exception as e:
-            print("Can't send image {}".format(image))
-            print(e)
-            logging.info(e)
-            worker.adm_log("Can't send image {} for problem N{}".format(
-                image, problem.index))
+    problem_images = payload.problem_images
+    if problem_images:
+        failed_images = []
+        resps = worker.source.bot.send_problem_images(
+            worker.source.participant_group,
+            problem_images,
+            reply_to_message_id=form_resp[0].get(
+                "message_id"),  # Temporarily disabling
+            caption="Image of problem N{}.".format(problem.index),
+            priority=PRIORITY_PROBLEM,
+            failed=failed_images,
+        )
+        message_instance_recorder.record_bot_messages(resps, worker.participant_group, problem)
+        if failed_images:
+            print("Can't send images of problem N{}".format(problem.index))
+            worker.adm_log("Can't send images {} for problem N{}".format(
+                ', '.join(str(problemimage.image) for problemimage in failed_images), problem.index))
+        logging.debug("Sending images for problem {}".format(problem.index))
+        worker.adm_log("Sent {}/{} images for problem N{}".format(
+            len(resps), len(problem_images), problem.index))
     worker.source.participant_group.activeProblem = problem
     worker.source.participant_group.save()
     worker.source.participant_group.activeSubjectGroupBinding.last_problem = problem
     worker.source.participant_group.activeSubjectGroupBinding.save()
+    problem_payloads.prefetch_next(problem)
+    answer_tallies.get_tally(worker.source.participant_group, problem)  # Building the tally of the opened problem
     register_current_participant_group_members_count(
         worker)  # Registering participants count with send command
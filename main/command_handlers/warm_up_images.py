@@ -0,0 +1,31 @@
+from main.models import ProblemImage
+from main.program_settings import IMAGES_WARM_UP_CHAT_ID
+from main.outbound_scheduler import PRIORITY_LOG
+
+
+def warm_up_images(worker):
+    """ Will pre-upload images of the active subject to get their Telegram file_ids
+    The images are sent to IMAGES_WARM_UP_CHAT_ID (or to the administrator page) and are removed after that
+    """
+    participant_group = worker.source.administrator_page.participant_group
+    if not participant_group.activeSubjectGroupBinding:
+        worker.answer_to_the_message("There is no active subject for the bound participant group.")
+        return
+    subject = participant_group.activeSubjectGroupBinding.subject
+    chat_id = IMAGES_WARM_UP_CHAT_ID or worker.source.administrator_page.telegram_id
+    uploaded = 0
+    failed = 0
+    for problem_image in ProblemImage.objects.filter(problem__subject=subject).select_related('problem').order_by(
+            'problem__index', 'id'):
+        try:
+            resp = worker.source.bot.send_problem_image(chat_id, problem_image, priority=PRIORITY_LOG)
+        except OSError as e:  # The image file is missing
+            print(e)
+            resp = None
+        if isinstance(resp, dict):
+            uploaded += 1
+            worker.source.bot.delete_message(chat_id, resp['message_id'], priority=PRIORITY_LOG, wait=False)
+        else:
+            failed += 1
+    worker.unilog("Images of subject {} are warmed up - {} uploaded, {} failed.".format(
+        subject.name, uploaded, failed))
@@ -0,0 +1,89 @@
+"""
+Live tallies of the unprocessed answers of the active problems
+- Tally is kept per (participant group, problem) - counts per variant, right answers count and the answerers
+- Is built with one query when the problem is opened (or first used), then is updated in O(1) per accepted answer
+- Is dropped when the problem is closed or cancelled and when its answers are deleted
+"""
+
+import threading
+from collections import Counter
+from django.apps import apps
+from django.db.models.signals import post_delete
+
+_tallies = {}  # {(participant_group_id, problem_id): AnswerTally}
+_lock = threading.Lock()
+
+
+class AnswerTally:
+    """ Tally of one problem in one participant group """
+
+    def __init__(self, answers=()):
+        """ :param answers: [(gspd_id, variant, right)] """
+        self.lock = threading.Lock()
+        self.variant_counts = Counter()
+        self.right_count = 0
+        self.answers = {}  # {gspd_id: variant}
+        for gspd_id, variant, right in answers:
+            self.add(gspd_id, variant, right)
+
+    def add(self, gspd_id, variant: str, right: bool) -> bool:
+        """ Will register the answer - returns False if the participant has already answered """
+        with self.lock:
+            if gspd_id in self.answers:
+                return False
+            variant = (variant or '').upper()
+            self.answers[gspd_id] = variant
+            self.variant_counts[variant] += 1
+            self.right_count += bool(right)
+            return True
+
+    def has_answered(self, gspd_id) -> bool:
+        return gspd_id in self.answers
+
+    @property
+    def answers_count(self) -> int:
+        return len(self.answers)
+
+    def get_status(self) -> list:
+        """ Will return [(variant, count)] sorted by variant """
+        with self.lock:
+            return sorted(((variant, count) for variant, count in self.variant_counts.items() if count),
+                          key=lambda el: el[0])
+
+
+def _load(participant_group_id, problem_id) -> AnswerTally:
+    Answer = apps.get_model('main', 'Answer')
+    return AnswerTally(Answer.objects.filter(
+        problem_id=problem_id,
+        group_specific_participant_data__participant_group_id=participant_group_id,
+        processed=False).order_by('id').values_list('group_specific_participant_data_id', 'answer', 'right'))
+
+
+def get_tally(participant_group, problem) -> AnswerTally:
+    """ Will return the tally of the problem in the group, building it if needed """
+    key = (participant_group.id, problem.id)
+    tally = _tallies.get(key)
+    if tally is None:
+        tally = _load(*key)
+        with _lock:
+            tally = _tallies.setdefault(key, tally)
+    return tally
+
+
+def drop(participant_group, problem=None):
+    """ Will drop the tally of the problem (or all tallies of the group) """
+    with _lock:
+        for key in [key for key in _tallies
+                    if key[0] == participant_group.id and (problem is None or key[1] == problem.id)]:
+            del _tallies[key]
+
+
+def _on_answer_delete(sender, instance, **kwargs):
+    with _lock:
+        for key in [key for key in _tallies if key[1] == instance.problem_id]:
+            del _tallies[key]
+
+
+def connect_signals():
+    """ Is called from MainConfig.ready """
+    post_delete.connect(_on_answer_delete, sender=apps.get_model('main', 'Answer'))
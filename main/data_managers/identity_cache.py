@@ -0,0 +1,100 @@
+"""
+Process-wide cache of the identities that are resolved on every message
+- chat id -> ParticipantGroup / AdministratorPage
+- user id -> Participant / SuperAdmin
+- command name -> TelegramCommand
+- Role by value and by id
+- ActionType by value
+The entries expire after IDENTITY_CACHE_TTL seconds and are invalidated with post_save/post_delete signals.
+Field values are cached instead of instances - every get builds a fresh instance with Model.from_db,
+so the handlers can modify and save them without affecting other threads.
+"""
+
+import time
+import threading
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+
+from main.program_settings import IDENTITY_CACHE_TTL
+
+
+class ModelCache:
+    """ Cache of one model's rows by the given field
+    - clear_on_change - will clear whole cache when an instance is changed, use when the key field can change
+    """
+
+    def __init__(self, model_name: str, field: str, *, ttl=IDENTITY_CACHE_TTL, clear_on_change=False):
+        self.model_name = model_name
+        self.field = field
+        self.ttl = ttl
+        self.clear_on_change = clear_on_change
+        self._entries = {}  # {key: (expires, values or None)}
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return apps.get_model('main', self.model_name)
+
+    @property
+    def field_names(self) -> list:
+        return [field.attname for field in self.model._meta.concrete_fields]
+
+    def get(self, key):
+        """ Will return a fresh instance or None if there is no such row """
+        key = str(key)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            values = self.model.objects.filter(**{self.field: key}).values_list(*self.field_names).first()
+            entry = (time.monotonic() + self.ttl, values)
+            with self._lock:
+                self._entries[key] = entry
+        if entry[1] is None:
+            return None
+        return self.model.from_db(DEFAULT_DB_ALIAS, self.field_names, entry[1])
+
+    def invalidate(self, instance=None):
+        """ Will invalidate the entry of given instance (or all entries) """
+        with self._lock:
+            if instance is None or self.clear_on_change:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(getattr(instance, self.field)), None)
+
+    def connect_signals(self):
+        def receiver(sender, instance, **kwargs):
+            self.invalidate(instance)
+
+        self._receiver = receiver  # Signals are keeping weak references
+        post_save.connect(receiver, sender=self.model)
+        post_delete.connect(receiver, sender=self.model)
+
+
+participant_groups = ModelCache('ParticipantGroup', 'telegram_id')
+administrator_pages = ModelCache('AdministratorPage', 'telegram_id')
+administrator_pages_by_participant_group = ModelCache('AdministratorPage', 'participant_group_id',
+                                                      clear_on_change=True)
+participants = ModelCache('Participant', 'id')
+superadmins = ModelCache('SuperAdmin', 'user_id')
+telegram_commands = ModelCache('TelegramCommand', 'command')
+roles = ModelCache('Role', 'value', clear_on_change=True)
+roles_by_id = ModelCache('Role', 'id', clear_on_change=True)
+action_types = ModelCache('ActionType', 'value', clear_on_change=True)
+
+CACHES = (participant_groups, administrator_pages, administrator_pages_by_participant_group, participants,
+          superadmins, telegram_commands, roles, roles_by_id, action_types)
+
+
+def is_superadmin(user_id) -> bool:
+    return superadmins.get(user_id) is not None
+
+
+def connect_signals():
+    """ Is called from MainConfig.ready """
+    for cache in CACHES:
+        cache.connect_signals()
+
+
+def clear():
+    for cache in CACHES:
+        cache.invalidate()
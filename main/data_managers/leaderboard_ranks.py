@@ -0,0 +1,196 @@
+"""
+Maintained leaderboard ranking of participant groups
+- Every group keeps its members sorted by (-score, -percentage, id) and the sorted list of distinct scores,
+  so the (dense) position of a score is a bisect lookup
+- The rankings are built with one query, then updated incrementally when scores change:
+  with refresh_members after bulk updates and with post_save/post_delete signals of GroupSpecificParticipantData
+- Rankings expire after LEADERBOARD_RANKS_TTL seconds, to pick up changes made by other processes
+"""
+
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from django.apps import apps
+from django.db.models.signals import post_save, post_delete
+
+from main.program_settings import LEADERBOARD_RANKS_TTL
+
+_rankings = {}  # {participant_group_id: GroupRanking}
+_lock = threading.Lock()
+
+
+class GroupRanking:
+    """ Ranking of one participant group """
+
+    def __init__(self, members: dict, *, ttl=LEADERBOARD_RANKS_TTL):
+        """ :param members: {gspd_id: (score, percentage)} """
+        self.expires = time.monotonic() + ttl
+        self.lock = threading.RLock()
+        self.members = dict(members)
+        self.keys = sorted(self._key(gspd_id, score, percentage)
+                           for gspd_id, (score, percentage) in self.members.items())
+        self.score_counts = {}
+        for score, _ in self.members.values():
+            self.score_counts[score] = self.score_counts.get(score, 0) + 1
+        self.distinct_scores = sorted(self.score_counts)
+
+    @staticmethod
+    def _key(gspd_id, score, percentage) -> tuple:
+        # In the beginning higher score, higher percentage and lower id
+        return -(score or 0), -(percentage or 0), gspd_id
+
+    @staticmethod
+    def get_position(distinct_scores: list, score: int) -> int:
+        """ Will return dense position of the score - same scores are sharing the position """
+        return len(distinct_scores) - bisect_right(distinct_scores, score) + 1
+
+    def position(self, gspd_id) -> int or None:
+        if gspd_id not in self.members:
+            return None
+        return self.get_position(self.distinct_scores, self.members[gspd_id][0])
+
+    def remove(self, gspd_id):
+        with self.lock:
+            if gspd_id not in self.members:
+                return
+            score, percentage = self.members.pop(gspd_id)
+            key = self._key(gspd_id, score, percentage)
+            index = bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+            self.score_counts[score] -= 1
+            if not self.score_counts[score]:
+                del self.score_counts[score]
+                del self.distinct_scores[bisect_left(self.distinct_scores, score)]
+
+    def set(self, gspd_id, score: int, percentage):
+        with self.lock:
+            self.remove(gspd_id)
+            self.members[gspd_id] = (score, percentage)
+            insort(self.keys, self._key(gspd_id, score, percentage))
+            if score not in self.score_counts:
+                self.score_counts[score] = 0
+                insort(self.distinct_scores, score)
+            self.score_counts[score] += 1
+
+    def ordered(self) -> list:
+        """ Will return [(gspd_id, score, percentage)] in the leaderboard order """
+        with self.lock:
+            return [(gspd_id, self.members[gspd_id][0], self.members[gspd_id][1]) for _, _, gspd_id in self.keys]
+
+
+class RankingSnapshot:
+    """ Scores of the ranking at one moment - is not changed by the later updates """
+
+    def __init__(self, ranking: GroupRanking):
+        with ranking.lock:
+            self.distinct_scores = list(ranking.distinct_scores)
+            self.scores = {gspd_id: score for gspd_id, (score, _) in ranking.members.items()}
+
+    def position(self, gspd_id) -> int or None:
+        if gspd_id not in self.scores:
+            return None
+        return GroupRanking.get_position(self.distinct_scores, self.scores[gspd_id])
+
+
+class PositionChanges:
+    """ Position deltas between two ranking snapshots - is used as the position_change map
+    - get(gspd_id) is positive when the participant got higher
+    """
+
+    def __init__(self, old: RankingSnapshot, new: RankingSnapshot):
+        self.old = old
+        self.new = new
+
+    def get(self, gspd_id, default=0):
+        old_position, new_position = self.old.position(gspd_id), self.new.position(gspd_id)
+        if old_position is None or new_position is None:
+            return default  # New members had no position
+        return old_position - new_position
+
+    def __getitem__(self, gspd_id):
+        return self.get(gspd_id)
+
+
+def _load_members(participant_group_id, gspd_ids=None) -> dict:
+    """ Will load {gspd_id: (score, percentage)} with one query """
+    GroupSpecificParticipantData = apps.get_model('main', 'GroupSpecificParticipantData')
+    query = GroupSpecificParticipantData.objects.filter(participant_group_id=participant_group_id)
+    if gspd_ids is not None:
+        query = query.filter(id__in=gspd_ids)
+    rows = query.values_list('id', 'score', 'right_answers_count', 'total_answers_count')
+    return {
+        gspd_id: (score, GroupSpecificParticipantData.calculate_percentage(score, right_count, total_count))
+        for gspd_id, score, right_count, total_count in rows
+    }
+
+
+def get_ranking(participant_group_id) -> GroupRanking:
+    """ Will return the ranking of the group, building it if needed """
+    ranking = _rankings.get(participant_group_id)
+    if ranking is None or ranking.expires < time.monotonic():
+        ranking = GroupRanking(_load_members(participant_group_id))
+        with _lock:
+            _rankings[participant_group_id] = ranking
+    return ranking
+
+
+def get_positions(participant_group_id) -> dict:
+    """ Will return dict of {gspd.id: position} """
+    ranking = get_ranking(participant_group_id)
+    with ranking.lock:
+        return {gspd_id: ranking.get_position(ranking.distinct_scores, score)
+                for gspd_id, (score, _) in ranking.members.items()}
+
+
+def snapshot(participant_group_id) -> RankingSnapshot:
+    """ Will return the current scores of the group - take it before changing the scores and pass it to
+    refresh_members, otherwise an expired ranking is rebuilt from the already changed scores """
+    return RankingSnapshot(get_ranking(participant_group_id))
+
+
+def refresh_members(participant_group_id, gspd_ids, *, old_snapshot: RankingSnapshot = None) -> PositionChanges:
+    """ Will reload the given members (after their scores or answers are changed) and return position changes
+    - old_snapshot - ranking before the changes, by default the ranking before the reload
+    """
+    ranking = get_ranking(participant_group_id)
+    gspd_ids = set(gspd_ids)
+    members = _load_members(participant_group_id, gspd_ids)
+    with ranking.lock:
+        if old_snapshot is None:
+            old_snapshot = RankingSnapshot(ranking)
+        for gspd_id in gspd_ids:
+            if gspd_id in members:
+                ranking.set(gspd_id, *members[gspd_id])
+            else:
+                ranking.remove(gspd_id)
+        new_snapshot = RankingSnapshot(ranking)
+    return PositionChanges(old_snapshot, new_snapshot)
+
+
+def invalidate(participant_group_id=None):
+    with _lock:
+        if participant_group_id is None:
+            _rankings.clear()
+        else:
+            _rankings.pop(participant_group_id, None)
+
+
+def _on_gspd_save(sender, instance, created, update_fields=None, **kwargs):
+    if instance.participant_group_id not in _rankings:
+        return
+    if created or update_fields is None or 'score' in update_fields:
+        refresh_members(instance.participant_group_id, [instance.id])
+
+
+def _on_gspd_delete(sender, instance, **kwargs):
+    ranking = _rankings.get(instance.participant_group_id)
+    if ranking:
+        ranking.remove(instance.id)
+
+
+def connect_signals():
+    """ Is called from MainConfig.ready """
+    GroupSpecificParticipantData = apps.get_model('main', 'GroupSpecificParticipantData')
+    post_save.connect(_on_gspd_save, sender=GroupSpecificParticipantData)
+    post_delete.connect(_on_gspd_delete, sender=GroupSpecificParticipantData)
@@ -0,0 +1,97 @@
+"""
+Write-behind buffer of MessageInstance records
+- ActionTypes are resolved with identity_cache
+- The records are inserted with bulk_create every MESSAGE_INSTANCES_FLUSH_EVERY records
+  or every MESSAGE_INSTANCES_FLUSH_INTERVAL_MS milliseconds (by a background thread)
+Call flush before reading MessageInstances that can be still buffered and at shutdown.
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from django.apps import apps
+from django.db import close_old_connections
+from django.utils import timezone
+
+from main.data_managers import identity_cache
+from main.program_settings import MESSAGE_INSTANCES_FLUSH_EVERY, MESSAGE_INSTANCES_FLUSH_INTERVAL_MS
+
+
+class MessageInstanceRecorder:
+    """ Will buffer MessageInstances and insert them in bulk """
+
+    def __init__(self, *, flush_every=MESSAGE_INSTANCES_FLUSH_EVERY,
+                 flush_interval_ms=MESSAGE_INSTANCES_FLUSH_INTERVAL_MS):
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval_ms / 1000
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # Keeps the insertion order between the flushes
+        self.has_records = threading.Event()
+        self.thread = None
+
+    def record(self, *, action_type: str, **kwargs):
+        """ Will buffer MessageInstance - kwargs are the fields of the model, action_type is the value """
+        MessageInstance = apps.get_model('main', 'MessageInstance')
+        instance = MessageInstance(action_type_id=identity_cache.action_types.get(action_type).id, **kwargs)
+        with self.lock:
+            self.buffer.append(instance)
+            size = len(self.buffer)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='message-instance-recorder', daemon=True)
+                self.thread.start()
+        self.has_records.set()
+        if size >= self.flush_every:
+            self.flush()
+        return instance
+
+    def record_bot_messages(self, resps: list, participant_group, current_problem,
+                            action_type='problem_associated'):
+        """ Will buffer messages sent by the bot """
+        for resp in resps:
+            self.record(
+                action_type=action_type,
+                date=datetime.fromtimestamp(resp["date"], tz=timezone.get_current_timezone()),
+                message_id=resp['message_id'],
+                participant=None,
+                participant_group=participant_group,
+                text=None,
+                current_problem=current_problem)
+
+    def flush(self):
+        """ Will insert the buffered records """
+        with self.flush_lock:
+            with self.lock:
+                instances, self.buffer = self.buffer, []
+                self.has_records.clear()
+            if not instances:
+                return
+            MessageInstance = apps.get_model('main', 'MessageInstance')
+            try:
+                MessageInstance.objects.bulk_create(instances)
+            except Exception as e:
+                # Saving one by one, so that one invalid record doesn't lose the others
+                logging.info("Can't bulk insert {} message instances: {}".format(len(instances), e))
+                for instance in instances:
+                    try:
+                        instance.save()
+                    except Exception as e:
+                        logging.info("Can't save message instance {}: {}".format(instance.message_id, e))
+
+    def _run(self):
+        while True:
+            self.has_records.wait()
+            time.sleep(self.flush_interval)  # Letting the buffer to grow
+            try:
+                self.flush()
+            except Exception as e:
+                logging.info("Can't flush message instances: {}".format(e))
+            finally:
+                close_old_connections()
+
+
+recorder = MessageInstanceRecorder()
+record = recorder.record
+record_bot_messages = recorder.record_bot_messages
+flush = recorder.flush
@@ -0,0 +1,96 @@
+"""
+Write-behind persistence of the bot's offset and last_updated
+- The offset is kept in memory and flushed with update_fields every N updates, every T seconds or at shutdown
+- Handled update_ids after the last flushed offset are appended to a local journal file, so that
+  the updates replayed by Telegram after a crash are skipped (appending a line is much cheaper than an UPDATE)
+The updates are marked as handled only after being processed, so the at-least-once semantics are kept.
+With a lease (see main/bot_leases.py) the offset is saved only with the current fencing token.
+"""
+
+import os
+import time
+import threading
+from django.utils import timezone
+
+from main.program_settings import OFFSET_FLUSH_EVERY_UPDATES, OFFSET_FLUSH_EVERY_SECONDS, OFFSETS_JOURNAL_DIR
+
+
+class OffsetCheckpointer:
+    """ Will checkpoint offset and last_updated of the bot """
+
+    def __init__(self, bot, *, every_updates=OFFSET_FLUSH_EVERY_UPDATES, every_seconds=OFFSET_FLUSH_EVERY_SECONDS,
+                 journal_dir=OFFSETS_JOURNAL_DIR):
+        self.bot = bot
+        self.lease = None  # Is set in the --lease mode of runner.py - the offset is saved only while owning it
+        self.every_updates = every_updates
+        self.every_seconds = every_seconds
+        self.pending_updates = 0
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, '{}.journal'.format(bot.id))
+        self.handled = self._load_journal()
+        self.journal = open(self.journal_path, 'a')
+
+    def _load_journal(self) -> set:
+        """ Will load handled update_ids that are not covered by the saved offset yet """
+        if not os.path.exists(self.journal_path):
+            return set()
+        with open(self.journal_path) as journal:
+            return {int(line) for line in journal if line.strip().isdigit() and int(line) >= (self.bot.offset or 0)}
+
+    def is_handled(self, update_id: int) -> bool:
+        """ Will check if the update is already handled - for updates replayed after a crash """
+        return update_id < (self.bot.offset or 0) or update_id in self.handled
+
+    def mark_handled(self, update_id: int):
+        """ Will register the update as handled - call after processing it """
+        with self.lock:
+            self.handled.add(update_id)
+            self.journal.write('{}\n'.format(update_id))
+            self.journal.flush()
+
+    def advance(self, offset: int):
+        """ Will move the offset in memory and flush if needed """
+        with self.lock:
+            if offset > (self.bot.offset or 0):
+                self.bot.offset = offset
+                self.pending_updates += 1
+                self.dirty = True
+            self.maybe_flush()
+
+    def touch(self):
+        """ Will update last_updated in memory and flush if needed """
+        with self.lock:
+            self.bot.last_updated = timezone.now()
+            self.dirty = True
+            self.maybe_flush()
+
+    def maybe_flush(self):
+        if self.pending_updates >= self.every_updates or time.monotonic() - self.last_flush >= self.every_seconds:
+            self.flush()
+
+    def flush(self):
+        """ Will save offset and last_updated, then compact the journal """
+        with self.lock:
+            if self.dirty:
+                if self.lease is None:
+                    self.bot.save(update_fields=['offset', 'last_updated'])
+                else:
+                    from main.bot_leases import save_offset, LeaseLost
+                    if not save_offset(self.bot, self.lease):  # Another node owns the bot now
+                        self.lease.lost.set()
+                        raise LeaseLost(self.lease)
+                self.dirty = False
+            self.pending_updates = 0
+            self.last_flush = time.monotonic()
+            offset = self.bot.offset or 0
+            if any(update_id < offset for update_id in self.handled):
+                self.handled = {update_id for update_id in self.handled if update_id >= offset}
+                self.journal.close()
+                temp_path = self.journal_path + '.tmp'
+                with open(temp_path, 'w') as journal:
+                    journal.writelines('{}\n'.format(update_id) for update_id in sorted(self.handled))
+                os.replace(temp_path, self.journal_path)
+                self.journal = open(self.journal_path, 'a')
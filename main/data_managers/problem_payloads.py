@@ -0,0 +1,111 @@
+"""
+Cache of ready-to-send problem payloads
+- Problem and answer texts are rendered and split into blocks with render_message_blocks
+- Problem and answer images are resolved
+- The id of the next problem is resolved
+The payloads are invalidated with post_save/post_delete signals of Problem and ProblemImage
+(for the whole subject when a problem is changed, because "#last" of the previous problem can change).
+prefetch_next renders the payload of the next problem in the background, while the current one is open.
+The payloads expire after PROBLEM_PAYLOADS_TTL seconds, to pick up the changes made by other processes
+(django admin, importer), and only PROBLEM_PAYLOADS_MAX_SIZE least recently used payloads are kept.
+"""
+
+import time
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.db import close_old_connections
+from django.db.models.signals import post_save, post_delete
+
+from main.models import render_message_blocks
+from main.program_settings import PROBLEM_PAYLOADS_TTL, PROBLEM_PAYLOADS_MAX_SIZE
+
+ProblemPayload = namedtuple('ProblemPayload', (
+    'subject_id', 'problem_blocks', 'answer_blocks', 'problem_images', 'answer_images', 'next_problem_id'))
+
+_payloads = OrderedDict()  # {problem_id: (expires, ProblemPayload)} - the least recently used first
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def render(problem) -> ProblemPayload:
+    """ Will render the payload of the problem """
+    images = sorted(problem.problemimage_set.all(), key=lambda img: img.id)
+    next_problem = problem.next
+    return ProblemPayload(
+        subject_id=problem.subject_id,
+        problem_blocks=render_message_blocks(str(problem)),
+        answer_blocks=render_message_blocks(problem.get_answer()),
+        problem_images=[image for image in images if not image.for_answer],
+        answer_images=[image for image in images if image.for_answer],
+        next_problem_id=next_problem.id if next_problem else None,
+    )
+
+
+def get_payload(problem) -> ProblemPayload:
+    """ Will return the payload of the problem, rendering it if needed """
+    with _lock:
+        entry = _payloads.get(problem.id)
+        if entry is not None and entry[0] >= time.monotonic():
+            _payloads.move_to_end(problem.id)
+            return entry[1]
+    payload = render(problem)
+    with _lock:
+        _payloads[problem.id] = (time.monotonic() + PROBLEM_PAYLOADS_TTL, payload)
+        _payloads.move_to_end(problem.id)
+        while len(_payloads) > PROBLEM_PAYLOADS_MAX_SIZE:
+            _payloads.popitem(last=False)
+    return payload
+
+
+def get_next_problem(problem):
+    """ Will return next problem if available - using the cached payload """
+    next_problem_id = get_payload(problem).next_problem_id
+    if next_problem_id is not None:
+        return apps.get_model('main', 'Problem').objects.filter(id=next_problem_id).first()
+
+
+def _prefetch_next(problem):
+    try:
+        next_problem = get_next_problem(problem)
+        if next_problem:
+            get_payload(next_problem)
+    except Exception as e:
+        logging.info("Can't prefetch the next problem of {}: {}".format(problem.id, e))
+    finally:
+        close_old_connections()
+
+
+def prefetch_next(problem):
+    """ Will render payloads of the problem and the next problem in the background """
+    _executor.submit(_prefetch_next, problem)
+
+
+def invalidate(problem_id=None, *, subject_id=None):
+    with _lock:
+        if problem_id is None and subject_id is None:
+            _payloads.clear()
+            return
+        _payloads.pop(problem_id, None)
+        if subject_id is not None:
+            for key in [key for key, (_, payload) in _payloads.items() if payload.subject_id == subject_id]:
+                del _payloads[key]
+
+
+def _on_problem_change(sender, instance, **kwargs):
+    invalidate(instance.id, subject_id=instance.subject_id)
+
+
+def _on_problem_image_change(sender, instance, **kwargs):
+    invalidate(instance.problem_id)
+
+
+def connect_signals():
+    """ Is called from MainConfig.ready """
+    for model_name, receiver in (('Problem', _on_problem_change), ('ParticipantDefinedProblem', _on_problem_change),
+                                 ('ProblemImage', _on_problem_image_change)):
+        model = apps.get_model('main', model_name)
+        post_save.connect(receiver, sender=model)
+        post_delete.connect(receiver, sender=model)
@@ -0,0 +1,56 @@
+"""
+In-memory sorted interval index of the standard-kit ScoreThreshold ranges
+- Is built once and invalidated with post_save/post_delete signals of ScoreThreshold and Role,
+  expires after SCORE_THRESHOLDS_TTL seconds to pick up the changes made by other processes (django admin)
+- get_role is a bisect lookup from score to the standard role
+The ranges are expected to be non-overlapping.
+"""
+
+import time
+import threading
+from bisect import bisect_right
+from django.apps import apps
+from django.db.models.signals import post_save, post_delete
+
+from main.program_settings import SCORE_THRESHOLDS_TTL
+
+_index = None  # (expires, range_mins, range_maxs, roles)
+_lock = threading.Lock()
+
+
+def _build():
+    ScoreThreshold = apps.get_model('main', 'ScoreThreshold')
+    thresholds = list(
+        ScoreThreshold.objects.filter(role__from_stardard_kit=True).select_related('role').order_by('range_min', 'id'))
+    return (time.monotonic() + SCORE_THRESHOLDS_TTL, [st.range_min for st in thresholds],
+            [st.range_max for st in thresholds], [st.role for st in thresholds])
+
+
+def get_role(score: int):
+    """ Will return the standard role for given score or None """
+    global _index
+    index = _index
+    if index is None or index[0] < time.monotonic():
+        with _lock:
+            if _index is None or _index[0] < time.monotonic():
+                _index = _build()
+            index = _index
+    _, range_mins, range_maxs, roles = index
+    position = bisect_right(range_mins, score) - 1
+    if position >= 0 and range_maxs[position] >= score:
+        return roles[position]
+    return None
+
+
+def invalidate(*args, **kwargs):
+    global _index
+    with _lock:
+        _index = None
+
+
+def connect_signals():
+    """ Is called from MainConfig.ready """
+    for model_name in ('ScoreThreshold', 'Role'):
+        model = apps.get_model('main', model_name)
+        post_save.connect(invalidate, sender=model)
+        post_delete.connect(invalidate, sender=model)
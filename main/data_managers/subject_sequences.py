@@ -0,0 +1,82 @@
+"""
+Cached ordered problem sequences of the subjects
+- {index: problem_id} and the problems count of every subject are loaded with one query
+- next/previous/nth/len are answered from memory, only the returned problem itself is loaded by its id
+The sequences are rebuilt lazily - they are dropped with post_save/post_delete signals of Problem
+(all of them, because the problem can be moved to another subject).
+The problems can be changed by other processes too (django admin, importer, other shards and nodes), so after
+SUBJECT_SEQUENCES_TTL seconds the sequence is checked with one aggregate query and rebuilt only if it's changed.
+"""
+
+import time
+import threading
+from collections import namedtuple
+from django.apps import apps
+from django.db.models import Count, Max, Sum
+from django.db.models.signals import post_save, post_delete
+
+from main.program_settings import SUBJECT_SEQUENCES_TTL
+
+SubjectSequence = namedtuple('SubjectSequence', ('ids_by_index', 'count', 'version', 'expires'))
+
+_sequences = {}  # {subject_id: SubjectSequence}
+_lock = threading.Lock()
+
+
+def _get_problems(subject_id):
+    return apps.get_model('main', 'Problem').objects.filter(subject_id=subject_id)
+
+
+def get_version(subject_id) -> tuple:
+    """ Will return (count, max index, sum of indexes, max id) of the subject's problems - is changed when
+    the problems are added, removed, moved or reordered """
+    versions = _get_problems(subject_id).aggregate(Count('id'), Max('index'), Sum('index'), Max('id'))
+    return versions['id__count'], versions['index__max'], versions['index__sum'], versions['id__max']
+
+
+def _build(subject_id) -> SubjectSequence:
+    version = get_version(subject_id)
+    ids_by_index = {}
+    count = 0
+    for index, problem_id in _get_problems(subject_id).order_by('index', 'id').values_list('index', 'id'):
+        count += 1
+        ids_by_index.setdefault(index, problem_id)
+    return SubjectSequence(ids_by_index, count, version, time.monotonic() + SUBJECT_SEQUENCES_TTL)
+
+
+def get_sequence(subject_id) -> SubjectSequence:
+    sequence = _sequences.get(subject_id)
+    if sequence is None:
+        sequence = _build(subject_id)
+    elif sequence.expires < time.monotonic():
+        if get_version(subject_id) == sequence.version:
+            sequence = sequence._replace(expires=time.monotonic() + SUBJECT_SEQUENCES_TTL)
+        else:
+            sequence = _build(subject_id)
+    else:
+        return sequence
+    with _lock:
+        _sequences[subject_id] = sequence
+    return sequence
+
+
+def get_count(subject_id) -> int:
+    return get_sequence(subject_id).count
+
+
+def get_problem_id(subject_id, index) -> int or None:
+    """ Will return id of the problem with given index in the subject or None """
+    return get_sequence(subject_id).ids_by_index.get(index)
+
+
+def invalidate(*args, **kwargs):
+    with _lock:
+        _sequences.clear()
+
+
+def connect_signals():
+    """ Is called from MainConfig.ready """
+    for model_name in ('Problem', 'ParticipantDefinedProblem'):
+        model = apps.get_model('main', model_name)
+        post_save.connect(invalidate, sender=model)
+        post_delete.connect(invalidate, sender=model)
@@ -1,4 +1,4 @@
-from main.universals import get_response, get_response_with_urllib
+from main.universals import get_response, get_response_with_form_data
 from collections.abc import Sequence
 import json
 
@@ -128,7 +128,7 @@ class DynamicTelegraphPageCreator:
                 "author_name": self.author_name,
                 "author_url": self.author_url,
             })
-        return get_response_with_urllib(url, payload=params)
+        return get_response_with_form_data(url, payload=params)
 
     def get_page(self, path, *, return_content=True):
         """ Will get and return page """
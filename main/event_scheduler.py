@@ -0,0 +1,75 @@
+"""
+In-process scheduler of the periodic events - is used by Worker.do_checks
+- Events are armed with a deadline and fire only when due, so checking for due events is O(1)
+- Re-arming replaces the previous deadline (the old heap entry is skipped lazily)
+
+The event types are the modules of main/events which have the following functions
+- arm(worker, scheduler) - will be called once for the worker to arm the initial events
+- fire(worker, scheduler, argument) - will be called when the event (name, argument) is due
+Use the module name as the event name - EVENTS_MAPPING = {'inactive_group': <module ...>, ...}
+"""
+
+import heapq
+import logging
+import time
+import importlib
+import threading
+from itertools import count
+from os import path, listdir
+from types import MappingProxyType
+
+from main import events
+
+EVENTS_MAPPING = MappingProxyType({
+    module_name: module for module_name, module in (
+        (module_name, importlib.import_module('.{}'.format(module_name), 'main.events'))
+        for module_name in sorted({path.splitext(pt)[0] for pt in listdir(events.__path__[0])})
+        if module_name[:2] != '__')
+    if hasattr(module, 'arm') and hasattr(module, 'fire')
+})
+
+
+class EventScheduler:
+    """ Heap of event deadlines - the events are keyed by (event_name, argument) """
+
+    def __init__(self):
+        self.heap = []  # [(deadline, sequence, key)]
+        self.deadlines = {}  # {key: (deadline, sequence)} - the actual deadlines
+        self.sequence = count()
+        self.lock = threading.Lock()
+
+    def arm(self, key: tuple, delay: float):
+        """ Will (re)arm the event to fire after delay seconds """
+        with self.lock:
+            entry = (time.monotonic() + max(delay, 0), next(self.sequence))
+            self.deadlines[key] = entry
+            heapq.heappush(self.heap, (*entry, key))
+
+    def disarm(self, key: tuple):
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    def is_armed(self, key: tuple) -> bool:
+        return key in self.deadlines
+
+    def pop_due(self) -> list:
+        """ Will return the keys of the due events and disarm them """
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, sequence, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) == (deadline, sequence):  # Else it's re-armed or disarmed
+                    del self.deadlines[key]
+                    due.append(key)
+        return due
+
+    def run_due(self, worker):
+        """ Will fire the due events """
+        for key in self.pop_due():
+            event_name, argument = key
+            try:
+                EVENTS_MAPPING[event_name].fire(worker, self, argument)
+            except Exception as e:
+                logging.exception(e)
+                print("Can't fire event {}: {}".format(key, e))
@@ -1,30 +1,61 @@
 from django.utils import timezone
-from main.models import MessageInstance, ActionType
+from main.models import ParticipantGroup
+from main.data_managers import message_instance_recorder
 from datetime import datetime
 
+NAME = __name__.split('.')[-1]  # Event name in the scheduler
+THRESHOLD = 3 * 3600  # 3 hours
+NO_PROBLEM_CHECK_INTERVAL = 10 * 60  # Without active problem will check again after 10 minutes
+RESCAN_INTERVAL = 10 * 60  # Will arm newly bound groups after 10 minutes
 
-def check(worker):
-    curr = timezone.now()
-    threshold = 3 * 3600  # 3 hours
+
+def arm(worker, scheduler):
+    """ Will arm the checks of all bound groups that are not armed yet
+    The checks are re-armed lazily - when the check is due, the deadline is moved based on the last activity
+    """
     for pg in (e.participant_group for e in worker.bot.botbinding_set.all()):
-        last_message_instance = pg.messageinstance_set.last()
-        if pg.activeProblem and (curr - last_message_instance.date).seconds > threshold:
-            # Maybe it would be better to remove the notification when participant is answering or when sending/answer a problem
-            for old_notification in pg.messageinstance_set.filter(action_type__value='bot_inactivity_notification', removed=False):
-                old_notification.remove_message(worker)
-            text = "Hey, don't miss your chance to answer the problem "\
-                "and take a higher position in the leaderboard!"
-            notification_message = worker.bot.send_message(
-                pg, text)[0]
-            MessageInstance.objects.create(
-                action_type=ActionType.objects.get(
-                    value='bot_inactivity_notification'),
-                date=datetime.fromtimestamp(
-                    notification_message["date"],
-                    tz=timezone.get_current_timezone()),
-                message_id=notification_message['message_id'],
-                participant=None,
-                participant_group=pg,
-                text=text,
-                current_problem=pg.activeProblem
-            )
+        if not scheduler.is_armed((NAME, pg.id)):
+            scheduler.arm((NAME, pg.id), 0)
+    scheduler.arm((NAME, None), RESCAN_INTERVAL)
+
+
+def fire(worker, scheduler, participant_group_id):
+    if participant_group_id is None:
+        arm(worker, scheduler)
+        return
+    key = (NAME, participant_group_id)
+    pg = ParticipantGroup.objects.filter(id=participant_group_id).first()
+    if not pg or not pg.botbinding_set.filter(bot=worker.bot).exists():
+        return  # Will be armed again if the group is bound again
+    delay = check(worker, pg)
+    scheduler.arm(key, delay)
+
+
+def check(worker, pg) -> float:
+    """ Will send notification if the group is inactive - returns seconds till the next check """
+    message_instance_recorder.flush()  # The last message instances can be still buffered
+    last_message_instance = pg.messageinstance_set.last()
+    if not pg.activeProblem or not last_message_instance:
+        return NO_PROBLEM_CHECK_INTERVAL
+    idle = (timezone.now() - last_message_instance.date).total_seconds()
+    if idle <= THRESHOLD:
+        return THRESHOLD - idle + 1
+    # Maybe it would be better to remove the notification when participant is answering or when sending/answer a problem
+    for old_notification in pg.messageinstance_set.filter(action_type__value='bot_inactivity_notification', removed=False):
+        old_notification.remove_message(worker)
+    text = "Hey, don't miss your chance to answer the problem "\
+        "and take a higher position in the leaderboard!"
+    notification_message = worker.bot.send_message(
+        pg, text)[0]
+    message_instance_recorder.record(
+        action_type='bot_inactivity_notification',
+        date=datetime.fromtimestamp(
+            notification_message["date"],
+            tz=timezone.get_current_timezone()),
+        message_id=notification_message['message_id'],
+        participant=None,
+        participant_group=pg,
+        text=text,
+        current_problem=pg.activeProblem
+    )
+    return THRESHOLD
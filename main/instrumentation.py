@@ -0,0 +1,323 @@
+"""
+Per-stage latency and query-count instrumentation of the message pipeline
+- Stages (the message handlers, decorated with timed) and the COMMANDS_MAPPING handlers are timed,
+  the DB queries and the Bot API calls are counted per update and per stage/command
+- The values are aggregated into rolling log-bucketed (HDR-style) histograms - the last
+  INSTRUMENTATION_WINDOW_SECONDS are kept, so the percentiles are describing the current load
+- The metrics are exposed in the Prometheus text format on INSTRUMENTATION_PORT (+ shard index in the shards)
+  and with the /perf command in the administrator pages
+When INSTRUMENTATION_ENABLED is False, timed is returning the functions as they are and the context managers
+are shared no-op objects, so the overhead is a function call per stage.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main.program_settings import (INSTRUMENTATION_ENABLED, INSTRUMENTATION_WINDOW_SECONDS,
+                                   INSTRUMENTATION_WINDOW_SLICES, INSTRUMENTATION_PORT)
+
+ENABLED = INSTRUMENTATION_ENABLED
+SUB_BUCKETS = 8  # Buckets per power of two - ~9% relative precision
+QUANTILES = (0.5, 0.95, 0.99)
+
+_metrics = {}  # {(kind, name): StageMetrics}
+_metrics_lock = threading.Lock()
+_current_update = contextvars.ContextVar('instrumented_update', default=None)
+
+
+class Histogram:
+    """ Log-bucketed histogram """
+
+    def __init__(self):
+        self.buckets = {}  # {bucket: count}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    @staticmethod
+    def get_bucket(value: float) -> int:
+        return math.floor(math.log2(value) * SUB_BUCKETS)
+
+    @staticmethod
+    def get_bucket_value(bucket: int) -> float:
+        """ Upper bound of the bucket """
+        return 2 ** ((bucket + 1) / SUB_BUCKETS)
+
+    def record(self, value: float):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        bucket = self.get_bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: 'Histogram'):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, quantile: float) -> float:
+        if not self.count:
+            return 0
+        rank = quantile * self.count
+        seen = self.zeros
+        if seen >= rank:
+            return 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.get_bucket_value(bucket), self.max)
+        return self.max
+
+
+class RollingHistogram:
+    """ Histogram of the last window seconds, is kept in slices which are dropped when they get old
+    - total_count and total_sum are cumulative (for the Prometheus counters)
+    """
+
+    def __init__(self, *, window=INSTRUMENTATION_WINDOW_SECONDS, slices=INSTRUMENTATION_WINDOW_SLICES):
+        self.slice_seconds = window / slices
+        self.slices_count = slices
+        self.slices = deque()  # [(slice_index, Histogram)]
+        self.total_count = 0
+        self.total_sum = 0
+        self.lock = threading.Lock()
+
+    def _drop_old(self, slice_index: int):
+        while self.slices and self.slices[0][0] <= slice_index - self.slices_count:
+            self.slices.popleft()
+
+    def record(self, value: float):
+        slice_index = int(time.monotonic() // self.slice_seconds)
+        with self.lock:
+            if not self.slices or self.slices[-1][0] != slice_index:
+                self.slices.append((slice_index, Histogram()))
+                self._drop_old(slice_index)
+            self.slices[-1][1].record(value)
+            self.total_count += 1
+            self.total_sum += value
+
+    def snapshot(self) -> Histogram:
+        histogram = Histogram()
+        with self.lock:
+            self._drop_old(int(time.monotonic() // self.slice_seconds))
+            for _, slice_histogram in self.slices:
+                histogram.merge(slice_histogram)
+        return histogram
+
+
+class StageMetrics:
+    """ Histograms of one stage or command """
+
+    def __init__(self):
+        self.durations = RollingHistogram()
+        self.queries = RollingHistogram()
+        self.api_calls = RollingHistogram()
+
+
+class UpdateCounters:
+    """ Counters of the update which is being handled """
+    __slots__ = ('queries', 'api_calls')
+
+    def __init__(self):
+        self.queries = 0
+        self.api_calls = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """ Is used with connection.execute_wrapper """
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def get_metrics(kind: str, name: str) -> StageMetrics:
+    key = (kind, name)
+    metrics = _metrics.get(key)
+    if metrics is None:
+        with _metrics_lock:
+            metrics = _metrics.setdefault(key, StageMetrics())
+    return metrics
+
+
+def record(kind: str, name: str, duration: float, queries=None, api_calls=None):
+    metrics = get_metrics(kind, name)
+    metrics.durations.record(duration)
+    if queries is not None:
+        metrics.queries.record(queries)
+        metrics.api_calls.record(api_calls)
+
+
+@contextmanager
+def _measure(kind: str, name: str):
+    counters = _current_update.get()
+    queries, api_calls = (counters.queries, counters.api_calls) if counters is not None else (None, None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        if counters is not None:
+            record(kind, name, duration, counters.queries - queries, counters.api_calls - api_calls)
+        else:
+            record(kind, name, duration)
+
+
+class _NullContext:
+    """ Is returned instead of the timers when the instrumentation is disabled """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+def stage(name: str):
+    """ Context manager timing the pipeline stage """
+    return _measure('stage', name) if ENABLED else _NULL_CONTEXT
+
+
+def command(name: str):
+    """ Context manager timing the command handler """
+    return _measure('command', name) if ENABLED else _NULL_CONTEXT
+
+
+def timed(name: str):
+    """ Decorator timing the function as a pipeline stage - returns the function itself when disabled """
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with _measure('stage', name):
+                return func(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+@contextmanager
+def _update_scope():
+    from django.db import connection
+    counters = UpdateCounters()
+    token = _current_update.set(counters)
+    try:
+        with connection.execute_wrapper(counters), _measure('stage', 'update'):
+            yield counters
+    finally:
+        _current_update.reset(token)
+
+
+def update_scope():
+    """ Context manager of one handled update - counts its DB queries and Bot API calls """
+    return _update_scope() if ENABLED else _NULL_CONTEXT
+
+
+def count_api_call():
+    """ Is called for every Bot API request made while handling an update """
+    counters = _current_update.get()
+    if counters is not None:
+        counters.api_calls += 1
+
+
+def get_summary() -> list:
+    """ Will return [(kind, name, duration histogram, queries histogram, api calls histogram)] of the window """
+    with _metrics_lock:
+        items = sorted(_metrics.items())
+    return [(kind, name, metrics.durations.snapshot(), metrics.queries.snapshot(), metrics.api_calls.snapshot())
+            for (kind, name), metrics in items]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus() -> str:
+    """ Will return the metrics in the Prometheus text format """
+    from main.universals import get_sessions_stats
+    families = (
+        ('durations', 'duration_seconds', 'Handling time'),
+        ('queries', 'db_queries', 'DB queries'),
+        ('api_calls', 'api_calls', 'Bot API calls'),
+    )
+    with _metrics_lock:
+        items = sorted(_metrics.items())
+    lines = []
+    for kind in ('stage', 'command'):
+        for attribute, suffix, description in families:
+            metric = 'tpg_{}_{}'.format(kind, suffix)
+            lines.append('# HELP {} {} of the {}s (quantiles of the last {} seconds)'.format(
+                metric, description, kind, INSTRUMENTATION_WINDOW_SECONDS))
+            lines.append('# TYPE {} summary'.format(metric))
+            for (item_kind, name), metrics in items:
+                if item_kind != kind:
+                    continue
+                rolling = getattr(metrics, attribute)
+                if not rolling.total_count:
+                    continue
+                histogram = rolling.snapshot()
+                for quantile in QUANTILES:
+                    lines.append('{}{{{}="{}",quantile="{}"}} {}'.format(
+                        metric, kind, _escape(name), quantile, histogram.percentile(quantile)))
+                lines.append('{}_sum{{{}="{}"}} {}'.format(metric, kind, _escape(name), rolling.total_sum))
+                lines.append('{}_count{{{}="{}"}} {}'.format(metric, kind, _escape(name), rolling.total_count))
+    for name, description in (('requests', 'HTTP requests'), ('new_connections', 'New HTTP connections')):
+        metric = 'tpg_http_{}_total'.format(name)
+        lines.append('# HELP {} {} of the pooled sessions'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        for session_key, stats in sorted(get_sessions_stats().items()):
+            lines.append('{}{{session="{}"}} {}'.format(metric, _escape(session_key), stats[name]))
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Not logging the scrapes
+
+
+_server = None
+
+
+def start_endpoint(port=INSTRUMENTATION_PORT):
+    """ Will start the Prometheus endpoint in a daemon thread - the shards are listening on port + shard index """
+    global _server
+    from main.universals import SHARD_ENV
+    if not ENABLED or port is None or _server is not None:
+        return
+    port += int(os.environ.get(SHARD_ENV) or 0)
+    _server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    logging.info("Instrumentation endpoint is listening on {}".format(port))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from main.models import Answer, GroupSpecificParticipantData
+
+
+def get_counter_expressions(answer_model) -> dict:
+    """ Will return {counter field: correlated COUNT subquery of the participant's answers} """
+
+    def count(**filters):
+        answers = answer_model.objects.filter(group_specific_participant_data=OuterRef('pk'), **filters).order_by(
+            ).values('group_specific_participant_data').annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(answers, output_field=IntegerField()), 0)
+
+    return {'right_answers_count': count(right=True), 'total_answers_count': count()}
+
+
+class Command(BaseCommand):
+    help = 'Recalculate right_answers_count and total_answers_count of GroupSpecificParticipantData from the answers'
+
+    def handle(self, *args, **options):
+        # One UPDATE with correlated subqueries - the answers saved meanwhile can't be overwritten with old counts
+        updated = GroupSpecificParticipantData.objects.update(**get_counter_expressions(Answer))
+        print("Done - recalculated {} rows".format(updated))
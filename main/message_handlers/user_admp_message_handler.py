@@ -2,11 +2,14 @@
 Will handle messages from administrator pages
 """
 
-from main.universals import get_from_Model, safe_getter
-from main.models import Participant, Role
+from main.universals import get_from_Model
 from main.templates import command_rejection_message_template
+from main.outbound_scheduler import PRIORITY_NOTICE
+from main.data_managers import identity_cache
+from main.instrumentation import timed
 
 
+@timed('handle_message_from_administrator_page')
 def handle_message_from_administrator_page(worker):
     """ Will handle message from administrator page
     + superadmins """
@@ -21,7 +24,7 @@ def handle_message_from_administrator_page(worker):
         # if not worker.is_from_superadmin and not worker.command_model.needs_superadmin:
         get_groupspecificparticipantdata_of_active_participant_from_administrator_page(
             worker)
-        priority_level = worker.groupspecificparticipantdata.highest_role.priority_level
+        priority_level = worker.groupspecificparticipantdata.priority_level
         if worker.is_from_superadmin or (
                 not worker.command_model.needs_superadmin and
                 priority_level >= worker.command_model.minimal_priority_level):
@@ -49,8 +52,7 @@ def get_message_sender_participant_from_administrator_page(worker):
     Will get participant from administrator page message
     """
     if worker.source.get('message'):
-        participant = get_from_Model(
-            Participant, id=worker['message']['from']['id'])
+        participant = identity_cache.participants.get(worker['message']['from']['id'])
         if not participant:
             worker.source.participant = None
             worker.source.is_from_superadmin = False
@@ -60,8 +62,7 @@ def get_message_sender_participant_from_administrator_page(worker):
                 or worker.message['from']['last_name']))
             return
         worker.source.participant = participant
-        worker.source.is_from_superadmin = not not safe_getter(
-            worker.participant, 'superadmin')
+        worker.source.is_from_superadmin = worker.source.is_superadmin
         return participant
     else:
         worker.source.participant = None
@@ -94,8 +95,10 @@ def reject_command_in_administrator_page(worker):
             command=worker['command'],
             highest_role=worker['groupspecificparticipantdata'].highest_role.
             name if worker['groupspecificparticipantdata'] else
-            Role.objects.get(value='guest').name),
+            identity_cache.roles.get('guest').name),
         reply_to_message_id=worker['message']["message_id"],
+        priority=PRIORITY_NOTICE,
+        wait=False,
     )
 
 
@@ -2,11 +2,12 @@
 Will handle message from user
 """
 
-from main.universals import get_from_Model
-from main.models import TelegramCommand, ParticipantGroup, SuperAdmin, AdministratorPage
+from main.data_managers import identity_cache
 from main.message_handlers import user_pg_message_handler, user_admp_message_handler, user_unrgp_message_handler
+from main.instrumentation import timed
 
 
+@timed('handle_message_from_user')
 def handle_message_from_user(worker):
     """ Handling message from user
     [Saving]
@@ -25,8 +26,7 @@ def handle_message_from_user(worker):
                                                                                           0] == '/' else ''
 
     if worker.source.command:
-        worker.source.command_model = get_from_Model(
-            TelegramCommand, command=worker.command)
+        worker.source.command_model = identity_cache.telegram_commands.get(worker.command)
         worker.source.command_argv = worker.source.raw_text.split(' ')[1:]
     else:
         worker.source.command_model = None
@@ -35,19 +35,16 @@ def handle_message_from_user(worker):
     worker.source.text = worker.source.raw_text if not worker.source.command else None
 
     # Checking if the group is registered
-    worker.source.participant_group = get_from_Model(
-        ParticipantGroup, telegram_id=worker.source.message["chat"]["id"])
+    worker.source.participant_group = identity_cache.participant_groups.get(worker.source.message["chat"]["id"])
 
     if worker.source.participant_group:
         worker.source.pg_adm_page = worker.source.participant_group.get_administrator_page()
 
     # Checking if is a superadmin
-    worker.source.is_superadmin = not not SuperAdmin.objects.filter(
-        user__id=worker.source.message['from']['id'])
+    worker.source.is_superadmin = identity_cache.is_superadmin(worker.source.message['from']['id'])
 
     # Checking if in an administrator page
-    worker.source.administrator_page = get_from_Model(
-        AdministratorPage, telegram_id=worker.source.message['chat']['id'])
+    worker.source.administrator_page = identity_cache.administrator_pages.get(worker.source.message['chat']['id'])
     worker.source.is_administrator_page = not not worker.source.administrator_page
 
     if worker.participant_group:
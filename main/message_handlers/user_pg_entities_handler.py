@@ -5,6 +5,7 @@ Will handle entities from user in participant groups
 from main.universals import safe_getter, get_from_Model
 from main.models import ViolationType
 from main.templates import message_removal_message_with_highest_role_template
+from main.outbound_scheduler import PRIORITY_NOTICE
 from datetime import datetime
 from django.utils import timezone
 import logging
@@ -29,8 +30,7 @@ AVAILABLE_ENTITIES = {
 def check_entities(worker):
     """ Will check message for entities and check participant's permissions to use them """
     resp = {"status": True, "unknown": False}
-    priority_level = worker[
-        'groupspecificparticipantdata'].highest_role.priority_level
+    priority_level = worker['groupspecificparticipantdata'].priority_level
     for entity in worker['entities']:
         entity = entity["type"]
         if entity not in AVAILABLE_ENTITIES:
@@ -65,10 +65,12 @@ def handle_entities(worker) -> bool:
                     highest_role=worker['groupspecificparticipantdata'].highest_role.name
                 ),
                 reply_to_message_id=worker['message']["message_id"],
+                priority=PRIORITY_NOTICE,
+                wait=False,
             )
             # Removing message with restricted entities
             worker['bot'].delete_message(worker['participant_group'],
-                                         worker['message']["message_id"])
+                                         worker['message']["message_id"], priority=PRIORITY_NOTICE, wait=False)
             # Creating violation
             worker['groupspecificparticipantdata'].create_violation(
                 get_from_Model(
@@ -2,24 +2,25 @@
 Get Or Register user participant in participant groups
 """
 
-from main.universals import get_from_Model, safe_getter
+from main.universals import get_from_Model
 from main.models import Participant, GroupSpecificParticipantData
-from main.data_managers import user_registry
+from main.data_managers import user_registry, identity_cache
+from main.instrumentation import timed
 
 
+@timed('get_or_register_message_sender_participant')
 def get_or_register_message_sender_participant(worker) -> Participant:
     """
     Will get if registered or register message sender as a participant
     """
     if worker.source.get('message'):
-        participant = get_from_Model(
-            Participant, id=worker['message']['from']['id'])
+        participant = identity_cache.participants.get(worker['message']['from']['id'])
         if not participant:
             participant = user_registry.register_participant(worker['message']['from'])
         else:
             participant.update_from_telegram_dict(worker['message']['from'])
         worker.source.participant = participant
-        worker.source.is_from_superadmin = not not safe_getter(worker.participant, 'superadmin')
+        worker.source.is_from_superadmin = worker.source.is_superadmin
         return participant
     else:
         worker.source.participant = None
@@ -27,6 +28,7 @@ def get_or_register_message_sender_participant(worker) -> Participant:
         raise ValueError("INVALID MESSAGE DATA")
 
 
+@timed('get_or_register_groupspecificparticipantdata_of_active_participant')
 def get_or_register_groupspecificparticipantdata_of_active_participant(
         worker) -> GroupSpecificParticipantData:
     """
@@ -6,6 +6,7 @@ import logging
 from main.universals import get_from_Model
 from main.models import ViolationType
 from main.templates import message_removal_message_with_highest_role_template
+from main.outbound_scheduler import PRIORITY_NOTICE
 
 AVAILABLE_MESSAGE_BINDINGS = {
     "document": 0,
@@ -23,8 +24,7 @@ AVAILABLE_MESSAGE_BINDINGS = {
 def check_message_bindings(worker):
     """ Will check message for bindings and check participant's permissions to use them """
     resp = {"status": True, "unknown": False}
-    priority_level = worker[
-        'groupspecificparticipantdata'].highest_role.priority_level
+    priority_level = worker['groupspecificparticipantdata'].priority_level
     for message_binding in AVAILABLE_MESSAGE_BINDINGS:
         if message_binding in worker['message'] and AVAILABLE_MESSAGE_BINDINGS[message_binding] > priority_level:
             if resp["status"]: resp["status"] = False
@@ -49,9 +49,11 @@ def handle_message_bindings(worker) -> bool:
                     highest_role=worker['groupspecificparticipantdata'].highest_role.name
                 ),
                 reply_to_message_id=worker['message']["message_id"],
+                priority=PRIORITY_NOTICE,
+                wait=False,
             )
             worker['bot'].delete_message(worker['participant_group'],
-                                         worker['message']["message_id"])
+                                         worker['message']["message_id"], priority=PRIORITY_NOTICE, wait=False)
             worker['groupspecificparticipantdata'].create_violation(
                 get_from_Model(
                     ViolationType,
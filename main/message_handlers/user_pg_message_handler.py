@@ -5,8 +5,11 @@ Will handle messages from users in partisipant groups
 from main.message_handlers import user_pg_gor_sender, user_pg_register_new_members, user_pg_entities_handler, \
     user_pg_message_bindings_handler, user_pg_pgm_text_handler, user_pg_pgm_command_handler, \
     user_pg_message_validity_checker
+from main.outbound_scheduler import PRIORITY_LOG
+from main.instrumentation import timed
 
 
+@timed('handle_message_from_participant_group')
 def handle_message_from_participant_group(worker):
     """
     Will handle message from participant group
@@ -20,6 +23,8 @@ def handle_message_from_participant_group(worker):
                 from_group=worker.source.message['chat']['id'],
                 to_group=worker.pg_adm_page,
                 message_id=worker.source.message['message_id'],
+                priority=PRIORITY_LOG,
+                wait=False,
             )
     status_checkers = (
         user_pg_entities_handler.handle_entities, user_pg_message_bindings_handler.handle_message_bindings,
@@ -1,8 +1,11 @@
 import re
 from main.universals import get_from_Model
 from main.models import ViolationType
+from main.outbound_scheduler import PRIORITY_NOTICE
+from main.instrumentation import timed
 
 
+@timed('check_message_validity')
 def check_message_validity(worker):
     """
     Will check message validity with multiple criteria.
@@ -30,8 +33,10 @@ def check_message_language(worker):
     if non_english_parts:# and not worker.is_from_superadmin:
         worker.answer_to_the_message(
             "Your message will be removed, because it contains these restricted parts: [ {} ].\n"
-            "Currently allowed language is {}.".format(', '.join(non_english_parts), current_language))
-        worker.bot.delete_message(worker.source.participant_group, worker.source.message['message_id'])
+            "Currently allowed language is {}.".format(', '.join(non_english_parts), current_language),
+            priority=PRIORITY_NOTICE)
+        worker.bot.delete_message(worker.source.participant_group, worker.source.message['message_id'],
+                                  priority=PRIORITY_NOTICE, wait=False)
         worker.source.groupspecificparticipantdata.create_violation(
             get_from_Model(ViolationType, value='language_restriction'), worker=worker)
         return False
@@ -46,12 +51,13 @@ def check_message_length(worker):
     Will check message length
     """
     if worker.source.raw_text and len(worker.source.raw_text) > TEXT_MAX_LENGTH and \
-            worker.source.groupspecificparticipantdata.highest_role.priority_level <= 0 and \
+            worker.source.groupspecificparticipantdata.priority_level <= 0 and \
             not worker.source.is_from_superadmin:  # Recruit
         worker.answer_to_the_message(
             f"Your message will be removed, because you don't have "
-            f"permissions to send messages with length more than {TEXT_MAX_LENGTH}.")
-        worker.bot.delete_message(worker.source.participant_group, worker.source.message['message_id'])
+            f"permissions to send messages with length more than {TEXT_MAX_LENGTH}.", priority=PRIORITY_NOTICE)
+        worker.bot.delete_message(worker.source.participant_group, worker.source.message['message_id'],
+                                  priority=PRIORITY_NOTICE, wait=False)
         worker.source.groupspecificparticipantdata.create_violation(
             get_from_Model(ViolationType, value='long_message_restriction'), worker=worker)
         return False
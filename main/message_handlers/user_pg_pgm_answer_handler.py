@@ -3,7 +3,9 @@ Will handle answer of participant group member in participant group
 """
 
 from main.universals import get_from_Model
-from main.models import Answer, MessageInstance, ActionType
+from main.models import Answer
+from main.outbound_scheduler import PRIORITY_NOTICE
+from main.data_managers import answer_tallies, message_instance_recorder
 from datetime import datetime
 from django.utils import timezone
 
@@ -15,12 +17,17 @@ def handle_answer(worker):
     if not worker['participant_group'].activeProblem:
         print(f"There is no active problem in {worker['participant_group']}")
         return False
+    # The database is the source of truth - the tally can be stale after a restart or when the group
+    # was handled by another process, it's used only for the counts
     old_answer = get_from_Model(
         worker['participant_group'].activeProblem.answer_set,
         group_specific_participant_data=worker[
             'groupspecificparticipantdata'],
         processed=False,
         _mode='direct')
+    if old_answer:
+        answer_tallies.get_tally(worker['participant_group'], worker['participant_group'].activeProblem).add(
+            old_answer.group_specific_participant_data_id, old_answer.answer, old_answer.right)  # If missing
     worker.source.old_answer = old_answer
     if old_answer:
         handle_answer_change(worker)
@@ -41,7 +48,7 @@ def handle_answer_change(worker):
         worker.unilog("{} is trying to answer {} again".format(
             worker['participant'], worker['variant']))
         worker['bot'].delete_message(worker['participant_group'],
-                                     worker['message']['message_id'])
+                                     worker['message']['message_id'], priority=PRIORITY_NOTICE, wait=False)
     else:
         worker.unilog("{} is trying to change answer {} to {}".format(
             worker['participant'], worker['old_answer'].answer,
@@ -50,7 +57,9 @@ def handle_answer_change(worker):
             worker['participant_group'],
             'Dear {}, you can\'t change your answer (your accepted answer is {}).'.format(
                 worker['participant'].name, worker['old_answer'].answer),
-            reply_to_message_id=worker['message']['message_id'])
+            reply_to_message_id=worker['message']['message_id'],
+            priority=PRIORITY_NOTICE,
+            wait=False)
 
 
 def handle_answers_from_testing_bots(worker):
@@ -60,8 +69,8 @@ def handle_answers_from_testing_bots(worker):
     worker.unilog("Answer from testing bot's controlling groups")
 
     # Registering message instance
-    MessageInstance.objects.create(
-        action_type=ActionType.objects.get(value='participant_answer'),
+    message_instance_recorder.record(
+        action_type='participant_answer',
         date=datetime.fromtimestamp(
             worker['message']["date"],
             tz=timezone.get_current_timezone()),
@@ -77,28 +86,17 @@ def accept_answer(worker) -> Answer:
     """
     Accepting answer - right or wrong
     """
+    tally = answer_tallies.get_tally(worker['participant_group'], worker['participant_group'].activeProblem)
     if worker['variant'] == worker['participant_group'].activeProblem.right_variant.upper():
         print("Right answer from {} N{}".format(
-            worker['participant'],
-            len(
-                worker['participant_group'].activeProblem.answer_set.filter(
-                    right=True,
-                    processed=False,
-                    group_specific_participant_data__participant_group=
-                    worker['participant_group'])) + 1))
+            worker['participant'], tally.right_count + 1))
     else:
         print("Wrong answer from {} - Right answers {}".format(
-            worker['participant'],
-            len(
-                worker['participant_group'].activeProblem.answer_set.filter(
-                    right=True,
-                    processed=False,
-                    group_specific_participant_data__participant_group=worker[
-                        'participant_group']))))
+            worker['participant'], tally.right_count))
 
     # Registering message instance
-    MessageInstance.objects.create(
-        action_type=ActionType.objects.get(value='participant_answer'),
+    message_instance_recorder.record(
+        action_type='participant_answer',
         date=datetime.fromtimestamp(
             worker['message']["date"],
             tz=timezone.get_current_timezone()),
@@ -120,4 +118,5 @@ def accept_answer(worker) -> Answer:
                 tz=timezone.get_current_timezone()),
     )
     answer.save()
+    tally.add(answer.group_specific_participant_data_id, answer.answer, answer.right)
     return answer
@@ -5,8 +5,11 @@ Will handle commands from participant group members in participant groups
 from main.universals import get_from_Model
 from main.models import ViolationType
 from main.templates import command_rejection_message_template
+from main.outbound_scheduler import PRIORITY_NOTICE
+from main.instrumentation import timed
 
 
+@timed('handle_pgm_commands')
 def handle_pgm_commands(worker):
     """
     Will handle commands from participant_group message
@@ -14,7 +17,7 @@ def handle_pgm_commands(worker):
     if not worker['command']:
         return
     if worker.command_model:
-        priority_level = worker.groupspecificparticipantdata.highest_role.priority_level
+        priority_level = worker.groupspecificparticipantdata.priority_level
         if worker.command_model.needs_superadmin:  # Got superadmin commands in PG
             handle_superadmin_commands_in_pg(worker)  # Not checking permissions, just handling
         else:  # Got regular commands in PG
@@ -33,6 +36,8 @@ def handle_pgm_commands(worker):
             worker['participant_group'],
             'Invalid command "{}"'.format(worker['command']),
             reply_to_message_id=worker['message']["message_id"],
+            priority=PRIORITY_NOTICE,
+            wait=False,
         )
 
 
@@ -58,6 +63,8 @@ def reject_command_in_pg(worker):
             highest_role=worker['groupspecificparticipantdata'].highest_role.name
         ),
         reply_to_message_id=worker['message']["message_id"],
+        priority=PRIORITY_NOTICE,
+        wait=False,
     )
     worker['groupspecificparticipantdata'].create_violation(
         get_from_Model(ViolationType, value='command_low_permissions'), worker=worker)
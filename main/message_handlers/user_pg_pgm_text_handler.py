@@ -3,8 +3,10 @@ Will handle text (not command) from participant group member in participant grou
 """
 
 from main.message_handlers import user_pg_pgm_answer_handler
+from main.instrumentation import timed
 
 
+@timed('handle_pgm_text')
 def handle_pgm_text(worker):
     """
     Will handle text from participant_group message
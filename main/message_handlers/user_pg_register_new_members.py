@@ -4,7 +4,7 @@ Will register new members
 
 from main.universals import safe_getter, get_from_Model
 from main.models import Participant
-from main.data_managers import user_registry
+from main.data_managers import user_registry, identity_cache
 from datetime import datetime
 from django.utils import timezone
 
@@ -16,7 +16,7 @@ def register_participant_group_new_members(worker) -> list:
     new_members = []
     for new_member_data in safe_getter(
             worker.source, 'message.new_chat_members', default=[], mode='DICT'):
-        participant = get_from_Model(Participant, id=new_member_data['id'])
+        participant = identity_cache.participants.get(new_member_data['id'])
         if not participant:
             participant = user_registry.register_participant(new_member_data)
         gspd = get_from_Model(
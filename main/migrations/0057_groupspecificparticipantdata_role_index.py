@@ -0,0 +1,55 @@
+# Generated by Django 2.2.4 on 2026-10-17 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_role_index(apps, schema_editor):
+    """ Will calculate the role index of existing GroupSpecificParticipantData rows from their bindings """
+    Role = apps.get_model('main', 'Role')
+    GroupSpecificParticipantData = apps.get_model('main', 'GroupSpecificParticipantData')
+    guest = Role.objects.filter(value='guest').first()
+    admin = Role.objects.filter(value='admin').first()
+    for gspd in GroupSpecificParticipantData.objects.prefetch_related('participantgroupbinding_set__role'):
+        bindings = list(gspd.participantgroupbinding_set.all())
+        standard = max((b.role for b in bindings if b.role.from_stardard_kit),
+                       key=lambda role: role.priority_level, default=None)
+        non_standard = max((b.role for b in bindings if not b.role.from_stardard_kit),
+                           key=lambda role: role.priority_level, default=None)
+        gspd.standard_role = standard
+        gspd.non_standard_role = non_standard
+        gspd.admin = bool(non_standard and admin and non_standard.priority_level >= admin.priority_level)
+        gspd.priority_level = max(
+            [role.priority_level for role in (standard, non_standard, guest) if role] or [0])
+        gspd.save(update_fields=['standard_role', 'non_standard_role', 'admin', 'priority_level'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0056_messageinstance_removed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupspecificparticipantdata',
+            name='standard_role',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.Role'),
+        ),
+        migrations.AddField(
+            model_name='groupspecificparticipantdata',
+            name='non_standard_role',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.Role'),
+        ),
+        migrations.AddField(
+            model_name='groupspecificparticipantdata',
+            name='admin',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='groupspecificparticipantdata',
+            name='priority_level',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_role_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.4 on 2026-10-17 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0057_groupspecificparticipantdata_role_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupspecificparticipantdata',
+            name='right_answers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='groupspecificparticipantdata',
+            name='total_answers_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
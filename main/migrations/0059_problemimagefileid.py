@@ -0,0 +1,31 @@
+# Generated by Django 2.2.4 on 2026-10-17 13:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0058_groupspecificparticipantdata_answer_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemImageFileId',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_id', models.CharField(max_length=250)),
+                ('file_name', models.CharField(max_length=250)),
+                ('file_size', models.IntegerField()),
+                ('file_mtime', models.FloatField()),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Bot')),
+                ('problem_image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.ProblemImage')),
+            ],
+            options={
+                'verbose_name': 'Problem Image File Id',
+                'db_table': 'db_problem_image_file_id',
+                'unique_together': {('problem_image', 'bot')},
+            },
+        ),
+    ]
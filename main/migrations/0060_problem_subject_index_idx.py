@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-17 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0059_problemimagefileid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='problem',
+            index=models.Index(fields=['subject', 'index'], name='db_problem_subject_index_idx'),
+        ),
+    ]
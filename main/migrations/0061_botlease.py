@@ -0,0 +1,28 @@
+# Generated by Django 2.2.4 on 2026-10-17 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0060_problem_subject_index_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(blank=True, default='', max_length=150)),
+                ('expires', models.DateTimeField(blank=True, null=True)),
+                ('fencing_token', models.BigIntegerField(default=0)),
+                ('bot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='main.Bot')),
+            ],
+            options={
+                'verbose_name': 'Bot Lease',
+                'db_table': 'db_bot_lease',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.4 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0061_botlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaseNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=150, unique=True)),
+                ('expires', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Lease Node',
+                'db_table': 'db_lease_node',
+            },
+        ),
+    ]
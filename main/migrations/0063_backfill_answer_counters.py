@@ -0,0 +1,29 @@
+# Generated by Django 2.2.4 on 2026-10-17 20:10
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_answer_counters(apps, schema_editor):
+    """ Will calculate the answer counters of existing GroupSpecificParticipantData rows from their answers """
+    Answer = apps.get_model('main', 'Answer')
+    GroupSpecificParticipantData = apps.get_model('main', 'GroupSpecificParticipantData')
+
+    def count(**filters):
+        answers = Answer.objects.filter(group_specific_participant_data=OuterRef('pk'), **filters).order_by(
+            ).values('group_specific_participant_data').annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(answers, output_field=IntegerField()), 0)
+
+    GroupSpecificParticipantData.objects.update(right_answers_count=count(right=True), total_answers_count=count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0062_leasenode'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_answer_counters, migrations.RunPython.noop),
+    ]
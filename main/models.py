@@ -1,16 +1,45 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
 from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
 from main.universals import (get_response, configure_logging, safe_getter)
+from main.outbound_scheduler import get_scheduler, PRIORITY_DEFAULT
+from main import instrumentation
+from main.program_settings import OUTBOUND_SCHEDULER_ENABLED, TELEGRAM_API_URL
+from concurrent.futures import Future
 import io
+import os
 import re
+import json
 import logging
 from main.universals import get_from_Model
+from main.data_managers import (identity_cache, score_thresholds_index, leaderboard_ranks, subject_sequences,
+                                answer_tallies)
 from collections import defaultdict
 
 configure_logging()
 
 MESSAGE_MAX_LENGTH = 4096
+MEDIA_GROUP_MAX_SIZE = 10
+
+
+def render_message_blocks(text, *, parse_mode='HTML') -> list:
+    """ Will split the text into blocks of MESSAGE_MAX_LENGTH and escape them for sending """
+    text = str(text)
+
+    if parse_mode == 'Markdown':
+        text = text.replace('_', '\_')
+    blocks = []
+    if len(text) > MESSAGE_MAX_LENGTH:
+        current = text
+        while len(current) > MESSAGE_MAX_LENGTH:
+            f = current.rfind('. ', 0, MESSAGE_MAX_LENGTH)
+            blocks.append(current[:f + 1])
+            current = current[f + 2:]
+        blocks.append(current)
+    else:
+        blocks.append(text)
+    return [block.replace('<', '&lt;').replace('\\&lt;', '<') for block in blocks]
 
 
 class Discipline(models.Model):
@@ -33,7 +62,14 @@ class Subject(models.Model):
     discipline = models.ForeignKey(Discipline, on_delete=models.CASCADE)
 
     def __len__(self):
-        return self.problem_set.count()
+        return subject_sequences.get_count(self.id)
+
+    def get_problem(self, index: int) -> 'Problem':
+        """ Will return the problem with given index - raises Problem.DoesNotExist if there is no such problem """
+        problem_id = subject_sequences.get_problem_id(self.id, index)
+        if problem_id is None:
+            raise Problem.DoesNotExist('There is no problem N{} in {}'.format(index, self))
+        return Problem.objects.get(id=problem_id)
 
     def __str__(self):
         return '{}->{}'.format(self.discipline, self.name)
@@ -76,33 +112,45 @@ class Problem(models.Model):
 
     def close(self, participant_group):
         """ Will close the problem for participant group """
-        answers = sorted(
-            self.answer_set.filter(
-                group_specific_participant_data__participant_group=
-                participant_group,
-                processed=False),
-            key=lambda answer: answer.id
-        )  # Getting both right and wrong answers -> have to be processed
-        old_roles = {
-            answer.id: answer.group_specific_participant_data.
-                highest_standard_role_binding.role
-            for answer in answers
-        }
-        for answer in answers:
-            answer.process()
-            answer.group_specific_participant_data.recalculate_roles()
-        new_roles = {
-            answer.id: answer.group_specific_participant_data.
-                highest_standard_role_binding.role
-            for answer in answers
-        }
+        return self.close_with_position_change(participant_group)[0]
+
+    def close_with_position_change(self, participant_group) -> (str, 'leaderboard_ranks.PositionChanges'):
+        """ Will close the problem for participant group and return (leaderboard, position changes)
+        - The answers are processed in bulk - scores are awarded with F() expressions, roles are recalculated in batch
+        """
+        with transaction.atomic():
+            answers = list(
+                self.answer_set.filter(
+                    group_specific_participant_data__participant_group=
+                    participant_group,
+                    processed=False).select_related('group_specific_participant_data').order_by('id')
+            )  # Getting both right and wrong answers -> have to be processed
+            ranking_snapshot = leaderboard_ranks.snapshot(participant_group.id)  # Positions before the scoring
+            gspds = list({answer.group_specific_participant_data_id: answer.group_specific_participant_data
+                          for answer in answers}.values())
+            # Both old and new roles are taken from the bindings, so a stale role index can't hide a promotion
+            GroupSpecificParticipantData.prefetch_role_bindings(gspds)
+            old_roles = {
+                answer.id: answer.group_specific_participant_data.highest_standard_role_binding.role
+                for answer in answers
+            }
+            Answer.bulk_process(answers, self.value)
+            GroupSpecificParticipantData.bulk_recalculate_roles(gspds)
+            new_roles = {
+                answer.id: answer.group_specific_participant_data.highest_standard_role_binding.role
+                for answer in answers
+            }
+        answer_tallies.drop(participant_group, self)
+        position_change = leaderboard_ranks.refresh_members(
+            participant_group.id, {answer.group_specific_participant_data_id for answer in answers},
+            old_snapshot=ranking_snapshot)
         return self.get_leader_board(
             participant_group,
             answers=[answer for answer in answers if answer.right],
             all_answers_count=len(answers),
             old_roles=old_roles,
             new_roles=new_roles
-        )  # Including in the leaderboard only right answers
+        ), position_change  # Including in the leaderboard only right answers
 
     def get_leader_board(self,
                          participant_group,
@@ -110,15 +158,17 @@ class Problem(models.Model):
                          all_answers_count=None,
                          old_roles=None,
                          new_roles=None):
-        """ Will return problem leaderboard """
-        answers = answers or sorted(
-            Answer.objects.filter(
+        """ Will return problem leaderboard - the answers with participants are got by one query """
+        if answers is None:
+            answers_query = Answer.objects.filter(
                 problem=self,
                 group_specific_participant_data__participant_group=
                 participant_group,
                 right=True,
-                processed=False),
-            key=lambda answer: answer.id)
+                processed=False)
+        else:
+            answers_query = Answer.objects.filter(id__in=[answer.id for answer in answers])
+        answers = list(answers_query.select_related('group_specific_participant_data__participant').order_by('id'))
         if all_answers_count is None:
             all_answers_count = Answer.objects.filter(
                 problem=self,
@@ -129,13 +179,12 @@ class Problem(models.Model):
         if len(answers):
             index = 1
             for answer in answers:
+                percentage = answer.group_specific_participant_data.percentage
                 current = "{}: {} - {}{}{}".format(
                     index, answer.group_specific_participant_data.participant,
                     answer.group_specific_participant_data.score,
-                    (' [{}%]'.format(
-                        answer.group_specific_participant_data.percentage)
-                     if answer.group_specific_participant_data.percentage else
-                     ''), f' -> {new_roles[answer.id].name}'
+                    (' [{}%]'.format(percentage) if percentage else ''),
+                    f' -> {new_roles[answer.id].name}'
                     if new_roles and old_roles and answer.id in new_roles
                        and new_roles[answer.id].name != old_roles[answer.id].name else '')
                 if index <= 3:
@@ -153,23 +202,23 @@ class Problem(models.Model):
     @property
     def next(self):
         """ Will return next problem if available """
-        if self.subject and self.index < len(self.subject):
-            n = self.subject.problem_set.filter(index=self.index + 1)
-            if n:
-                return n[0]
+        if self.has_next:
+            problem_id = subject_sequences.get_problem_id(self.subject_id, self.index + 1)
+            if problem_id is not None:
+                return Problem.objects.filter(id=problem_id).first()
 
     @property
     def has_next(self):
         """ Will check if has next problem """
-        return self.subject and self.index < len(self.subject)
+        return bool(self.subject_id) and self.index < subject_sequences.get_count(self.subject_id)
 
     @property
     def previous(self):
         """ Will return previous problem if available """
-        if self.subject and self.index > 1:
-            n = self.subject.problem_set.filter(index=self.index - 1)
-            if n:
-                return n[0]
+        if self.subject_id and self.index > 1:
+            problem_id = subject_sequences.get_problem_id(self.subject_id, self.index - 1)
+            if problem_id is not None:
+                return Problem.objects.filter(id=problem_id).first()
 
     @property
     def variants_dict(self):
@@ -201,6 +250,9 @@ class Problem(models.Model):
     class Meta:
         verbose_name = 'Problem'
         db_table = 'db_problem'
+        indexes = [
+            models.Index(fields=['subject', 'index'], name='db_problem_subject_index_idx'),
+        ]
 
 
 class ParticipantDefinedProblem(Problem):
@@ -240,11 +292,40 @@ class ProblemImage(models.Model):
     def __str__(self):
         return f'{"A" if self.for_answer else "P"}: {self.image} -> {self.problem}'
 
+    def get_file_signature(self) -> (str, int, float):
+        """ Will return (name, size, mtime) of the image file - is used to detect changes of the file """
+        stat = os.stat(self.image.path)
+        return self.image.name, stat.st_size, stat.st_mtime
+
     class Meta:
         verbose_name = 'Problem Image'
         db_table = 'db_problem_image'
 
 
+class ProblemImageFileId(models.Model):
+    """ Telegram file_id of the uploaded ProblemImage
+    - file_ids are specific for the bot
+    - Is valid while the signature of the image file is the same """
+    problem_image = models.ForeignKey(ProblemImage, on_delete=models.CASCADE)
+    bot = models.ForeignKey('Bot', on_delete=models.CASCADE)
+    file_id = models.CharField(max_length=250)
+    file_name = models.CharField(max_length=250)
+    file_size = models.IntegerField()
+    file_mtime = models.FloatField()
+
+    def __str__(self):
+        return '{} -> {}'.format(self.problem_image, self.bot)
+
+    @property
+    def file_signature(self) -> (str, int, float):
+        return self.file_name, self.file_size, self.file_mtime
+
+    class Meta:
+        verbose_name = 'Problem Image File Id'
+        db_table = 'db_problem_image_file_id'
+        unique_together = ('problem_image', 'bot')
+
+
 class GroupType(models.Model):
     """ Group Types """
     name = models.CharField(max_length=50)
@@ -322,27 +403,13 @@ class ParticipantGroup(Group):
 
     def get_administrator_page(self):
         """ Will return administrator page if available """
-        return safe_getter(self, 'administratorpage')
+        return identity_cache.administrator_pages_by_participant_group.get(self.id)
 
     def get_participants_positions(self) -> dict:
         """
         Will return dict of {gspd.id: position}
         """
-        position = 0
-        prev = None
-        res = {}
-
-        for score, i in (reversed(
-                sorted(
-                    ((gspd.score, gspd.id)
-                     for gspd in self.groupspecificparticipantdata_set.all()),
-                    key=lambda e: e[0]))):
-            if score != prev:
-                prev = score
-                position += 1
-            res[i] = position
-
-        return res
+        return leaderboard_ranks.get_positions(self.id)
 
     @staticmethod
     def get_list_display():
@@ -416,7 +483,10 @@ class User(models.Model):
             return self.username
 
     def update_from_telegram_dict(self, user: dict):
-        """ Will update username, first_name and last_name from given user dict """
+        """ Will update username, first_name and last_name from given user dict - saving only if changed """
+        if (self.username, self.first_name, self.last_name) == (
+                user.get('username'), user.get('first_name'), user.get('last_name')):
+            return
         self.username = user.get('username')
         self.first_name = user.get('first_name')
         self.last_name = user.get('last_name')
@@ -453,7 +523,45 @@ class Bot(User):
     @property
     def base_url(self):
         """ This is the base URL of the bot for all API calls """
-        return 'https://api.telegram.org/bot{}/'.format(self.token)
+        return '{}bot{}/'.format(TELEGRAM_API_URL, self.token)
+
+    def send_request(self, method, payload=None, files=None, *, chat_id=None, priority=PRIORITY_DEFAULT,
+                     wait=True):
+        """ Will send outbound request through the bot's outbound scheduler
+        - wait - if False, will return Future of the response instead of the response
+        """
+        url = self.base_url + method
+
+        def request():
+            for file in (files or {}).values():
+                if hasattr(file, 'seek'):
+                    file.seek(0)  # The file can be already read if the request is retried
+            return get_response(url, payload=payload, files=files, raise_retry_after=True)
+
+        if not OUTBOUND_SCHEDULER_ENABLED:
+            resp = get_response(url, payload=payload, files=files)
+            if wait:
+                return resp
+            future = Future()
+            future.set_result(resp)
+            return future
+        instrumentation.count_api_call()  # The scheduler's threads are not counting it
+        future = get_scheduler(self).submit(chat_id, request, priority=priority)
+        return future.result() if wait else future
+
+    def set_webhook(self, url: str, secret_token: str):
+        """ Will set the webhook of the bot - Telegram will send the updates to the url with the secret token
+        - max_connections=1 - the updates are delivered one by one in order, so an update with lower id can't
+          arrive after the offset is moved past it (it would be dropped as already handled) """
+        return get_response(self.base_url + 'setWebhook', payload={
+            'url': url,
+            'secret_token': secret_token,
+            'max_connections': 1,
+        }, use_post=True)
+
+    def delete_webhook(self):
+        """ Will delete the webhook of the bot - getUpdates is working only without webhook """
+        return get_response(self.base_url + 'deleteWebhook', use_post=True)
 
     def update_information(self):
         """ Bot will update it's information with getMe """
@@ -480,82 +588,235 @@ class Bot(User):
                      text,
                      *,
                      parse_mode='HTML',
-                     reply_to_message_id=None):
-        """ Will send a message to the group """
+                     reply_to_message_id=None,
+                     priority=PRIORITY_DEFAULT,
+                     wait=True):
+        """ Will send a message to the group
+        - wait - if False, will return list of futures and won't chain the blocks with replies """
+        return self.send_message_blocks(group, render_message_blocks(text, parse_mode=parse_mode),
+                                        parse_mode=parse_mode, reply_to_message_id=reply_to_message_id,
+                                        priority=priority, wait=wait)
+
+    def send_message_blocks(self,
+                            group: 'text/id or group',
+                            blocks: list,
+                            *,
+                            parse_mode='HTML',
+                            reply_to_message_id=None,
+                            priority=PRIORITY_DEFAULT,
+                            wait=True):
+        """ Will send already rendered blocks (see render_message_blocks) to the group """
         if not (isinstance(group, str) or isinstance(group, int)):
             group = group.telegram_id
-
-        text = str(text)
-
-        if parse_mode == 'Markdown':
-            text = text.replace('_', '\_')
-        blocks = []
-        if len(text) > MESSAGE_MAX_LENGTH:
-            current = text
-            while len(current) > MESSAGE_MAX_LENGTH:
-                f = current.rfind('. ', 0, MESSAGE_MAX_LENGTH)
-                blocks.append(current[:f + 1])
-                current = current[f + 2:]
-            blocks.append(current)
-        else:
-            blocks.append(text)
         resp = []
         for message in blocks:
-            url = self.base_url + 'sendMessage'
             payload = {
                 'chat_id':
                     group,
                 'text':
-                    message.replace('<', '&lt;').replace('\\&lt;', '<'),
+                    message,
                 'reply_to_message_id':
-                    reply_to_message_id if not resp else resp[-1].get('message_id')
+                    reply_to_message_id if not resp or not wait else resp[-1].get('message_id')
             }
             if parse_mode:
                 payload['parse_mode'] = parse_mode
-            resp_c = get_response(url, payload=payload)
-            logging.info(resp_c)
+            resp_c = self.send_request('sendMessage', payload, chat_id=group, priority=priority, wait=wait)
+            if wait:
+                logging.info(resp_c)
             resp.append(resp_c)
         return resp
 
     def send_image(self,
                    participant_group: 'text/id or group',
-                   image_file: io.BufferedReader,
+                   image_file: io.BufferedReader or str,
                    *,
                    caption='',
-                   reply_to_message_id=None):
-        """ Will send an image to the group """
+                   reply_to_message_id=None,
+                   priority=PRIORITY_DEFAULT):
+        """ Will send an image to the group - image_file can be a file or Telegram file_id """
         if not (isinstance(participant_group, str)
                 or isinstance(participant_group, int)):
             participant_group = participant_group.telegram_id
-        url = self.base_url + 'sendPhoto'
         payload = {
             'chat_id': participant_group,
             'caption': caption,
             'reply_to_message_id': reply_to_message_id,
         }
-        files = {'photo': image_file}
-        resp = get_response(url, payload=payload, files=files)
+        files = None
+        if isinstance(image_file, str):
+            payload['photo'] = image_file
+        else:
+            files = {'photo': image_file}
+        resp = self.send_request('sendPhoto', payload, files, chat_id=participant_group, priority=priority)
         logging.info(resp)
         return resp
 
+    def send_problem_image(self,
+                           participant_group: 'text/id or group',
+                           problem_image: ProblemImage,
+                           *,
+                           caption='',
+                           reply_to_message_id=None,
+                           priority=PRIORITY_DEFAULT):
+        """ Will send the problem image reusing Telegram file_id of the previous upload if available
+        - The image is uploaded if there is no file_id for this bot or the file is changed after the upload
+        """
+        signature = problem_image.get_file_signature()
+        cached = problem_image.problemimagefileid_set.filter(bot=self).first()
+        if cached and cached.file_signature == signature:
+            resp = self.send_image(participant_group, cached.file_id, caption=caption,
+                                   reply_to_message_id=reply_to_message_id, priority=priority)
+            if isinstance(resp, dict):
+                return resp
+            logging.info("Can't send image {} with file_id, uploading again".format(problem_image.image))
+        with open(problem_image.image.path, 'rb') as image_file:
+            resp = self.send_image(participant_group, image_file, caption=caption,
+                                   reply_to_message_id=reply_to_message_id, priority=priority)
+        if isinstance(resp, dict) and resp.get('photo'):
+            ProblemImageFileId.objects.update_or_create(
+                problem_image=problem_image, bot=self,
+                defaults={
+                    'file_id': resp['photo'][-1]['file_id'],  # The biggest size
+                    'file_name': signature[0],
+                    'file_size': signature[1],
+                    'file_mtime': signature[2],
+                })
+        return resp
+
+    def send_media_group(self,
+                         participant_group: 'text/id or group',
+                         images: list,
+                         *,
+                         caption='',
+                         reply_to_message_id=None,
+                         priority=PRIORITY_DEFAULT):
+        """ Will send 2-10 images as an album - images can be files or Telegram file_ids
+        - The caption is set to the first image, so it's shown as the album caption
+        """
+        if not (isinstance(participant_group, str)
+                or isinstance(participant_group, int)):
+            participant_group = participant_group.telegram_id
+        media = []
+        files = {}
+        for index, image in enumerate(images):
+            if isinstance(image, str):
+                item = {'type': 'photo', 'media': image}
+            else:
+                item = {'type': 'photo', 'media': 'attach://photo{}'.format(index)}
+                files['photo{}'.format(index)] = image
+            if index == 0 and caption:
+                item['caption'] = caption
+            media.append(item)
+        payload = {
+            'chat_id': participant_group,
+            'media': json.dumps(media),
+            'reply_to_message_id': reply_to_message_id,
+        }
+        resp = self.send_request('sendMediaGroup', payload, files or None, chat_id=participant_group,
+                                 priority=priority)
+        logging.info(resp)
+        return resp
+
+    def send_problem_images(self,
+                            participant_group: 'text/id or group',
+                            problem_images: list,
+                            *,
+                            caption='',
+                            reply_to_message_id=None,
+                            priority=PRIORITY_DEFAULT,
+                            failed: list = None) -> list:
+        """ Will send the problem images as albums of up to MEDIA_GROUP_MAX_SIZE images, reusing file_ids
+        - Returns the list of sent messages
+        - If the album can't be sent, will send its images one by one
+        - Unreadable images and images of failed sends are skipped and appended to the failed list if given,
+          the other images are still sent
+        """
+        messages = []
+        failed = failed if failed is not None else []
+        cached = {
+            file_id.problem_image_id: file_id
+            for file_id in ProblemImageFileId.objects.filter(bot=self, problem_image__in=problem_images)
+        }
+
+        def send_one(problem_image):
+            try:
+                resp = self.send_problem_image(participant_group, problem_image, caption=caption,
+                                               reply_to_message_id=reply_to_message_id, priority=priority)
+            except Exception as e:
+                logging.info("Can't send image {}: {}".format(problem_image.image, e))
+                failed.append(problem_image)
+                return
+            if isinstance(resp, dict):
+                messages.append(resp)
+            else:
+                failed.append(problem_image)
+
+        for start in range(0, len(problem_images), MEDIA_GROUP_MAX_SIZE):
+            chunk, signatures = [], []
+            for problem_image in problem_images[start:start + MEDIA_GROUP_MAX_SIZE]:
+                try:
+                    signatures.append(problem_image.get_file_signature())
+                except OSError as e:
+                    logging.info("Can't read image {}: {}".format(problem_image.image, e))
+                    failed.append(problem_image)
+                else:
+                    chunk.append(problem_image)
+            if len(chunk) <= 1:
+                for problem_image in chunk:
+                    send_one(problem_image)
+                continue
+            images = []
+            resp = None
+            try:
+                for problem_image, signature in zip(chunk, signatures):
+                    if problem_image.id in cached and cached[problem_image.id].file_signature == signature:
+                        images.append(cached[problem_image.id].file_id)
+                    else:
+                        images.append(open(problem_image.image.path, 'rb'))
+                resp = self.send_media_group(participant_group, images, caption=caption,
+                                             reply_to_message_id=reply_to_message_id, priority=priority)
+            except Exception as e:
+                logging.info("Can't send album of {} images: {}".format(len(chunk), e))
+            finally:
+                for image in images:
+                    if not isinstance(image, str):
+                        image.close()
+            if not isinstance(resp, list):
+                logging.info("Can't send album of {} images, sending them one by one".format(len(chunk)))
+                for problem_image in chunk:
+                    send_one(problem_image)
+                continue
+            messages += resp
+            for problem_image, signature, image, message in zip(chunk, signatures, images, resp):
+                if not isinstance(image, str) and message.get('photo'):
+                    ProblemImageFileId.objects.update_or_create(
+                        problem_image=problem_image, bot=self,
+                        defaults={
+                            'file_id': message['photo'][-1]['file_id'],
+                            'file_name': signature[0],
+                            'file_size': signature[1],
+                            'file_mtime': signature[2],
+                        })
+        return messages
+
     def send_document(self,
                       participant_group: 'text/id or group',
                       document: io.BufferedReader,
                       *,
                       caption='',
-                      reply_to_message_id=None):
+                      reply_to_message_id=None,
+                      priority=PRIORITY_DEFAULT):
         """ Will send a document to the group """
         if not (isinstance(participant_group, str)
                 or isinstance(participant_group, int)):
             participant_group = participant_group.telegram_id
-        url = self.base_url + 'sendDocument'
         payload = {
             'chat_id': participant_group,
             'caption': caption,
             'reply_to_message_id': reply_to_message_id,
         }
         files = {'document': document}
-        resp = get_response(url, payload=payload, files=files)
+        resp = self.send_request('sendDocument', payload, files, chat_id=participant_group, priority=priority)
         logging.info(resp)
         return resp
 
@@ -575,35 +836,37 @@ class Bot(User):
         """
         Will download and return file content
         """
-        return get_response('https://api.telegram.org/file/bot{}/{}'.format(self.token, file_path), raw=True)
+        return get_response('{}file/bot{}/{}'.format(TELEGRAM_API_URL, self.token, file_path), raw=True)
 
     def delete_message(self, participant_group: str or Group, message_id: int
-                                                                          or str):
+                                                                          or str, *, priority=PRIORITY_DEFAULT,
+                       wait=True):
         """ Will delete message from the group """
         if not (isinstance(participant_group, str)
                 or isinstance(participant_group, int)):
             participant_group = participant_group.telegram_id
-        url = self.base_url + 'deleteMessage'
         payload = {'chat_id': participant_group, 'message_id': message_id}
-        resp = get_response(url, payload=payload)
-        logging.info(resp)
+        resp = self.send_request('deleteMessage', payload, chat_id=participant_group, priority=priority, wait=wait)
+        if wait:
+            logging.info(resp)
         return resp
 
     def forward_message(self, from_group: Group or str or int, to_group: Group
-                                                                         or str or int, message_id: int or str):
+                                                                         or str or int, message_id: int or str, *,
+                        priority=PRIORITY_DEFAULT, wait=True):
         """
         Will forward message from one group to another one using message_id
         """
         if isinstance(from_group, Group): from_group = from_group.telegram_id
         if isinstance(to_group, Group): to_group = to_group.telegram_id
-        url = self.base_url + 'forwardMessage'
         payload = {
             'from_chat_id': from_group,
             'chat_id': to_group,
             'message_id': message_id
         }
-        resp = get_response(url, payload=payload)
-        logging.info(resp)
+        resp = self.send_request('forwardMessage', payload, chat_id=to_group, priority=priority, wait=wait)
+        if wait:
+            logging.info(resp)
         return resp
 
     def get_chat_participants_count(self, chat: str or int or Group):
@@ -705,59 +968,142 @@ class GroupSpecificParticipantData(models.Model):
     score = models.IntegerField(default=0)
     joined = models.DateTimeField(blank=True, null=True)
 
+    # Denormalized role index - is maintained by refresh_role_index, use highest_* properties to read
+    standard_role = models.ForeignKey(
+        Role, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    non_standard_role = models.ForeignKey(
+        Role, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    admin = models.BooleanField(default=False)
+    priority_level = models.IntegerField(default=0)
+
+    # Answer counters - are maintained with F() updates by Answer.save and the Answer post_delete receiver
+    # (queryset and cascade deletes too), use percentage to read. They are never written by full saves,
+    # deletes outside of django (raw SQL) are repaired with the backfill_answer_counters command
+    right_answers_count = models.IntegerField(default=0)
+    total_answers_count = models.IntegerField(default=0)
+    COUNTER_FIELDS = ('right_answers_count', 'total_answers_count')
+
+    def save(self, *args, **kwargs):
+        """ New rows are getting the guest priority level (there are no bindings yet),
+        full saves of existing rows are saving all fields except the answer counters,
+        so stale in-memory counters can't overwrite the F() updates """
+        if self._state.adding and not self.pk:
+            self.priority_level = identity_cache.roles.get('guest').priority_level
+        elif not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            deferred_fields = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS
+                                       and field.attname not in deferred_fields]
+        super().save(*args, **kwargs)
+
     @property
     def percentage(self):
         """ Will return user percentage if the score is higher or equal to 450 """
-        if self.score >= 450:
-            return round(self.answer_set.filter(right=True).count() / self.answer_set.count() * 100, 1)
+        return self.calculate_percentage(self.score, self.right_answers_count, self.total_answers_count)
+
+    @staticmethod
+    def calculate_percentage(score: int, right_answers_count: int, total_answers_count: int):
+        """ Will return the percentage of right answers if the score is higher or equal to 450 """
+        if score >= 450 and total_answers_count:
+            return round(right_answers_count / total_answers_count * 100, 1)
 
     def recalculate_roles(self):
-        """ Will recalculate user's roles in the group """
+        """ Will recalculate user's roles in the group and the role index """
+        self.recalculate_standard_role()
+        self.refresh_role_index()
+
+    def recalculate_standard_role(self):
+        """ Will promote user's standard role based on the score """
+        bindings_to_delete, binding_to_save = self.get_standard_role_changes()
+        for binding in bindings_to_delete:
+            binding.delete()
+        if binding_to_save:
+            # If the participant got to the new level, then setting new role for the binding
+            binding_to_save.save()
+            logging.info('New Role for {} will be {} - score is {}'.format(
+                self.participant.name, binding_to_save.role, self.score))
+
+    def get_standard_role_changes(self) -> (list, 'ParticipantGroupBinding'):
+        """ Will return (bindings_to_delete, binding_to_save) to promote the standard role based on the score
+        - bindings_to_delete - lower standard bindings, only the highest one is kept
+        - binding_to_save - highest standard binding with the new role or a new binding, None if not promoted
+        """
         standard_bindings = [
-            b for b in self.participantgroupbinding_set.all()
+            b for b in self.role_bindings
             if b.role.from_stardard_kit
         ]
+        bindings_to_delete = []
+        highest_binding = None
+        standard_role = None
         if len(standard_bindings) >= 1:
             highest_binding = sorted(
                 standard_bindings,
                 key=lambda binding: binding.role.priority_level)[-1]
-            for binding in standard_bindings:
-                if binding != highest_binding:
-                    binding.delete()
+            bindings_to_delete = [binding for binding in standard_bindings if binding != highest_binding]
             standard_role = highest_binding.role
 
-            new_role = [
-                st.role for st in ScoreThreshold.objects.all()
-                if st.range_min <= self.score and st.range_max >= self.score
-                   and st.role.from_stardard_kit
-            ]
-            if not new_role or new_role[
-                0].priority_level <= standard_role.priority_level:
-                return
-            new_role = new_role[0]
-            if new_role.priority_level == -1:
-                return
-            # If the participant got to the new level, then setting new role for the binding
+        new_role = score_thresholds_index.get_role(self.score)
+        if not new_role or new_role.priority_level == -1 or (
+                standard_role and new_role.priority_level <= standard_role.priority_level):
+            return bindings_to_delete, None
+        if highest_binding:
             highest_binding.role = new_role
-            highest_binding.save()
-        else:
-            standard_role = None
-            new_role = [
-                st.role for st in ScoreThreshold.objects.all()
-                if st.range_min <= self.score and st.range_max >= self.score
-                   and st.role.from_stardard_kit
-            ]
-            if not new_role:
-                return
-            new_role = new_role[0]
-            if new_role.priority_level == -1:
-                return
+            return bindings_to_delete, highest_binding
+        return bindings_to_delete, ParticipantGroupBinding(groupspecificparticipantdata=self, role=new_role)
+
+    @staticmethod
+    def prefetch_role_bindings(gspds: list):
+        """ Will load role bindings (with their roles) of given GroupSpecificParticipantData objects by one query """
+        prefetch_related_objects(list(gspds), Prefetch(
+            'participantgroupbinding_set',
+            queryset=ParticipantGroupBinding.objects.select_related('role'),
+            to_attr='_role_bindings'))
+
+    @staticmethod
+    def bulk_recalculate_roles(gspds: list) -> list:
+        """ Will recalculate roles and role indexes of given GroupSpecificParticipantData objects
+        with a constant number of queries - returns the list of gspds with changed role index """
+        gspds = list(gspds)
+        GroupSpecificParticipantData.prefetch_role_bindings(
+            [gspd for gspd in gspds if gspd.__dict__.get('_role_bindings') is None])
+        bindings_to_delete, bindings_to_update, bindings_to_create = [], [], []
+        for gspd in gspds:
+            to_delete, to_save = gspd.get_standard_role_changes()
+            bindings_to_delete += to_delete
+            gspd._role_bindings = [b for b in gspd._role_bindings if b not in to_delete]
+            if to_save and to_save.pk:
+                bindings_to_update.append(to_save)
+            elif to_save and to_save.role.value != 'guest':
+                bindings_to_create.append(to_save)
+                gspd._role_bindings.append(to_save)
+            if to_save:
+                logging.info('New Role for {} will be {} - score is {}'.format(
+                    gspd.participant_id, to_save.role, gspd.score))
+        changed_gspds = [gspd for gspd in gspds if gspd.refresh_role_index(save=False)]
+        with transaction.atomic():
+            if bindings_to_delete:
+                ParticipantGroupBinding.objects.filter(id__in=[b.id for b in bindings_to_delete]).delete()
+            if bindings_to_update:
+                ParticipantGroupBinding.objects.bulk_update(bindings_to_update, ['role'])
+            if bindings_to_create:
+                ParticipantGroupBinding.objects.bulk_create(bindings_to_create)
+            if changed_gspds:
+                GroupSpecificParticipantData.objects.bulk_update(
+                    changed_gspds, ['standard_role', 'non_standard_role', 'admin', 'priority_level'])
+        return changed_gspds
+
+    @property
+    def role_bindings(self) -> list:
+        """ Will return role bindings with their roles
+        Memoized on the instance, which is living during one update """
+        if self.__dict__.get('_role_bindings') is None:
+            self._role_bindings = list(self.participantgroupbinding_set.select_related('role'))
+        return self._role_bindings
 
-            # Creating new binding
-            ParticipantGroupBinding(
-                groupspecificparticipantdata=self, role=new_role).save()
-        logging.info('New Role for {} will be {} - score is {}'.format(
-            self.participant.name, new_role, self.score))
+    def reset_role_bindings(self):
+        """ Will reset memoized role bindings - is called when the bindings are changed """
+        self._role_bindings = None
 
     @property
     def highest_role_binding(self):
@@ -765,17 +1111,20 @@ class GroupSpecificParticipantData(models.Model):
         from main.models import ParticipantGroupBinding
         res = ParticipantGroupBinding(
             groupspecificparticipantdata=self,
-            role=Role.objects.get(value='guest'))
-        for binding in self.participantgroupbinding_set.all():
+            role=identity_cache.roles.get('guest'))
+        for binding in self.role_bindings:
             if not res or binding.role.priority_level > res.role.priority_level:
                 res = binding
         return res
 
     @property
-    def highest_role(self):
-        """ Will return user's highest role in the group """
-        return self.highest_role_binding.role or Role.objects.get(
-            value='guest')
+    def highest_role(self) -> Role:
+        """ Will return user's highest role in the group - from the role index """
+        non_standard_role = self.highest_non_standard_role
+        standard_role = self.highest_standard_role
+        if non_standard_role and non_standard_role.priority_level > standard_role.priority_level:
+            return non_standard_role
+        return standard_role
 
     @property
     def highest_standard_role_binding(self):
@@ -783,10 +1132,9 @@ class GroupSpecificParticipantData(models.Model):
         from main.models import ParticipantGroupBinding
         res = ParticipantGroupBinding(
             groupspecificparticipantdata=self,
-            role=Role.objects.get(value='guest'))
-        for binding in self.participantgroupbinding_set.filter(
-                role__from_stardard_kit=True):
-            if not res or binding.role.priority_level > res.role.priority_level:
+            role=identity_cache.roles.get('guest'))
+        for binding in self.role_bindings:
+            if binding.role.from_stardard_kit and (not res or binding.role.priority_level > res.role.priority_level):
                 res = binding
         return res
 
@@ -794,20 +1142,46 @@ class GroupSpecificParticipantData(models.Model):
     def highest_non_standard_role_binding(self) -> 'ParticipantGroupBinding':
         """ Will return user's highest non-standard role binding in the group """
         res = None
-        for binding in self.participantgroupbinding_set.filter(
-                role__from_stardard_kit=False):
-            if not res or binding.role.priority_level > res.role.priority_level:
+        for binding in self.role_bindings:
+            if not binding.role.from_stardard_kit and (
+                    not res or binding.role.priority_level > res.role.priority_level):
                 res = binding
         return res
 
+    def refresh_role_index(self, *, save=True):
+        """ Will recalculate the denormalized role index from the role bindings - saving only if changed """
+        old_index = (self.standard_role_id, self.non_standard_role_id, self.admin, self.priority_level)
+        standard_binding = self.highest_standard_role_binding
+        non_standard_binding = self.highest_non_standard_role_binding
+        # The guest binding is synthetic - the bindings created by bulk_recalculate_roles don't have pk yet
+        self.standard_role_id = standard_binding.role_id if standard_binding.role.value != 'guest' else None
+        self.non_standard_role_id = non_standard_binding.role_id if non_standard_binding else None
+        self.admin = bool(non_standard_binding and non_standard_binding.role >= identity_cache.roles.get(
+            'admin'))  # Will raise error if the database is not filled
+        self.priority_level = self.highest_role_binding.role.priority_level
+        changed = old_index != (self.standard_role_id, self.non_standard_role_id, self.admin, self.priority_level)
+        if save and self.pk and changed:
+            self.save(update_fields=['standard_role', 'non_standard_role', 'admin', 'priority_level'])
+        return changed
+
+    @property
+    def highest_standard_role(self) -> Role:
+        """ Will return user's highest standard role in the group - from the role index """
+        return identity_cache.roles_by_id.get(self.standard_role_id) if self.standard_role_id else \
+            identity_cache.roles.get('guest')
+
+    @property
+    def highest_non_standard_role(self) -> Role:
+        """ Will return user's highest non-standard role in the group if available - from the role index """
+        if self.non_standard_role_id:
+            return identity_cache.roles_by_id.get(self.non_standard_role_id)
+
     @property
     def is_admin(self) -> bool:
         """
-        Will return True if the participant is admin in current group
+        Will return True if the participant is admin in current group - from the role index
         """
-        ns_role_binding = self.highest_non_standard_role_binding
-        return ns_role_binding and ns_role_binding.role >= Role.objects.get(
-            value='admin')  # Will raise error if the database is not filled
+        return self.admin
 
     def create_violation(self, type: 'ViolationType', date=None, worker=None):
         """ Will create a violation to this GroupSpecificParticipantData """
@@ -874,6 +1248,14 @@ class ParticipantGroupBinding(models.Model):
         if self.role.value == 'guest':
             return
         super().save(*args, **kwargs)
+        self.groupspecificparticipantdata.reset_role_bindings()
+        self.groupspecificparticipantdata.refresh_role_index()
+
+    def delete(self, *args, **kwargs):
+        res = super().delete(*args, **kwargs)
+        self.groupspecificparticipantdata.reset_role_bindings()
+        self.groupspecificparticipantdata.refresh_role_index()
+        return res
 
     class Meta:
         verbose_name = 'Participant-Group Binding'
@@ -894,6 +1276,38 @@ class BotBinding(models.Model):
         db_table = 'db_bot_binding'
 
 
+class BotLease(models.Model):
+    """ Lease of the bot by a runner node - see main/bot_leases.py
+    - expires - the lease has to be renewed before it, otherwise another node can claim the bot
+    - fencing_token - is incremented on every claim, the offset is saved only with the current token
+    """
+    bot = models.OneToOneField(Bot, on_delete=models.CASCADE)
+    owner = models.CharField(max_length=150, blank=True, default='')
+    expires = models.DateTimeField(blank=True, null=True)
+    fencing_token = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '{} -[{}]-> {}'.format(self.bot, self.fencing_token, self.owner or 'FREE')
+
+    class Meta:
+        verbose_name = 'Bot Lease'
+        db_table = 'db_bot_lease'
+
+
+class LeaseNode(models.Model):
+    """ Alive runner node of the lease mode - is renewed by the node's heartbeat, the bots are shared
+    between the nodes whose rows are not expired """
+    owner = models.CharField(max_length=150, unique=True)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return '{} (till {})'.format(self.owner, self.expires)
+
+    class Meta:
+        verbose_name = 'Lease Node'
+        db_table = 'db_lease_node'
+
+
 class Answer(models.Model):
     """ User Answer model """
 
@@ -905,17 +1319,79 @@ class Answer(models.Model):
         GroupSpecificParticipantData, on_delete=models.CASCADE)
     date = models.DateTimeField(blank=True, null=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'right' in instance.__dict__:
+            instance._loaded_right = instance.right
+        return instance
+
+    def save(self, *args, **kwargs):
+        """ Will save the answer and update the answer counters of the participant """
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                self.update_answer_counters(right=int(bool(self.right)), total=1)
+            elif self.right != self.__dict__.get('_loaded_right', self.right):
+                self.update_answer_counters(right=1 if self.right else -1)
+        self._loaded_right = self.right
+
+    @staticmethod
+    def on_delete(sender, instance, **kwargs):
+        """ post_delete receiver - is called for every deleted answer, also with queryset and cascade deletes
+        (deleting a problem or a group's answers), which don't call Answer.delete """
+        instance.update_answer_counters(
+            right=-int(bool(instance.__dict__.get('_loaded_right', instance.right))), total=-1)
+
+    def update_answer_counters(self, *, right=0, total=0):
+        """ Will atomically change the answer counters of the participant (and of the loaded instance) """
+        GroupSpecificParticipantData.objects.filter(id=self.group_specific_participant_data_id).update(
+            right_answers_count=F('right_answers_count') + right,
+            total_answers_count=F('total_answers_count') + total)
+        if Answer.group_specific_participant_data.is_cached(self):
+            self.group_specific_participant_data.right_answers_count += right
+            self.group_specific_participant_data.total_answers_count += total
+
     def process(self):
         """ Will process the answer and give points to the user if is right """
         if not self.processed:
             if self.right:
                 self.group_specific_participant_data.score += self.problem.value
-                self.group_specific_participant_data.save()
+                self.group_specific_participant_data.save(update_fields=['score'])
                 self.group_specific_participant_data.participant.sum_score += self.problem.value
                 self.group_specific_participant_data.participant.save()
             self.processed = True
             self.save()
 
+    @staticmethod
+    def bulk_process(answers: list, value: int):
+        """ Will process the answers of one problem with a constant number of queries
+        - Scores are added with F() expressions grouped by the awarded points
+        - Scores of the loaded GroupSpecificParticipantData objects are updated in memory
+        """
+        answers = [answer for answer in answers if not answer.processed]
+        gspd_points = defaultdict(int)
+        participant_points = defaultdict(int)
+        for answer in answers:
+            if answer.right:
+                gspd_points[answer.group_specific_participant_data_id] += value
+                participant_points[answer.group_specific_participant_data.participant_id] += value
+        with transaction.atomic():
+            for model, field, points in ((GroupSpecificParticipantData, 'score', gspd_points),
+                                         (Participant, 'sum_score', participant_points)):
+                ids_by_points = defaultdict(list)
+                for pk, pk_points in points.items():
+                    ids_by_points[pk_points].append(pk)
+                for pk_points, ids in ids_by_points.items():
+                    model.objects.filter(pk__in=ids).update(**{field: F(field) + pk_points})
+            Answer.objects.filter(id__in=[answer.id for answer in answers]).update(processed=True)
+        for answer in answers:
+            answer.processed = True
+        for gspd in {answer.group_specific_participant_data_id: answer.group_specific_participant_data
+                     for answer in answers}.values():
+            gspd.score += gspd_points.get(gspd.id, 0)
+
     def __str__(self):
         return '{}[{}] {} -> Problem {}'.format(
             ("+" if self.right else "-") if self.processed else "*",
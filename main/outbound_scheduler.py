@@ -0,0 +1,194 @@
+"""
+Rate-limit-aware outbound scheduler for the Bot API calls that are posting to the chats.
+- Every bot has its own scheduler, because Telegram limits are per bot token
+- Per-chat and global token buckets (roughly 1 msg/s per chat and 30 msg/s globally)
+- 429 responses are honoured - the chat (or the whole bot) is paused for retry_after seconds and the call is retried
+- Calls are queued with priorities, so problems and answers are sent before violation notices and logs
+- submit returns concurrent.futures.Future, so the handlers don't have to block on delivery
+Only one call per chat is in flight at a time, so the order of same-priority calls in a chat is kept.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from main.universals import TelegramRetryAfter
+from main.program_settings import (OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_GLOBAL_RATE,
+                                   OUTBOUND_GLOBAL_BURST, OUTBOUND_SENDERS_COUNT)
+
+PRIORITY_PROBLEM = 0  # Problems, answers and leaderboards
+PRIORITY_DEFAULT = 5
+PRIORITY_NOTICE = 7  # Violation notices, command rejections and so on
+PRIORITY_LOG = 9  # unilog echoes to the administrator pages
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+class TokenBucket:
+    """ Simple token bucket with support of blocking for some time (for retry_after) """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now) -> float:
+        """ Will return seconds to wait until a token is available - 0 if is available now """
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class _Job:
+    __slots__ = ('priority', 'sequence', 'chat_id', 'func', 'future')
+
+    def __init__(self, priority, sequence, chat_id, func):
+        self.priority = priority
+        self.sequence = sequence
+        self.chat_id = chat_id
+        self.func = func
+        self.future = Future()
+
+    def __lt__(self, other: '_Job'):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class OutboundScheduler:
+    """ Will send queued calls of one bot respecting the rate limits """
+
+    def __init__(self, name='', *, chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST,
+                 global_rate=OUTBOUND_GLOBAL_RATE, global_burst=OUTBOUND_GLOBAL_BURST,
+                 senders_count=OUTBOUND_SENDERS_COUNT):
+        self.name = name
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets = {}
+        self.in_flight = set()
+        self._running_count = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=senders_count)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, chat_id, func, *, priority=PRIORITY_DEFAULT) -> Future:
+        """ Will queue the call - func has to raise TelegramRetryAfter when getting 429 """
+        chat_id = str(chat_id) if chat_id is not None else None  # Telegram ids are coming both as str and int
+        job = _Job(priority, next(self._sequence), chat_id, func)
+        with self._condition:
+            heapq.heappush(self._queue, job)
+            self._condition.notify()
+        return job.future
+
+    def drain(self, timeout=None) -> bool:
+        """ Will wait until all queued calls are sent - returns False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._running_count:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _get_chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _pick(self, now) -> (_Job, float):
+        """ Will pick the first ready job by priority -> (job, None) or (None, seconds to wait) """
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait:
+            return None, global_wait
+        min_wait = None
+        for job in sorted(self._queue):
+            if job.chat_id in self.in_flight:
+                continue
+            wait = self._get_chat_bucket(job.chat_id).wait_time(now) if job.chat_id is not None else 0
+            if not wait:
+                return job, None
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                job, wait = self._pick(time.monotonic())
+                if job is None:
+                    self._condition.wait(wait)
+                    continue
+                self._queue.remove(job)
+                heapq.heapify(self._queue)
+                now = time.monotonic()
+                self.global_bucket.consume(now)
+                self._running_count += 1
+                if job.chat_id is not None:
+                    self._get_chat_bucket(job.chat_id).consume(now)
+                    self.in_flight.add(job.chat_id)
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: _Job):
+        try:
+            result = job.func()
+        except TelegramRetryAfter as e:
+            logging.info("[{}] Got 429, retrying after {} seconds.".format(self.name, e.retry_after))
+            with self._condition:
+                now = time.monotonic()
+                if job.chat_id is not None:
+                    self._get_chat_bucket(job.chat_id).block(e.retry_after, now)
+                else:
+                    self.global_bucket.block(e.retry_after, now)
+                heapq.heappush(self._queue, job)  # Keeping the same place in the queue
+                self.in_flight.discard(job.chat_id)
+                self._running_count -= 1
+                self._condition.notify_all()
+            return
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        with self._condition:
+            self.in_flight.discard(job.chat_id)
+            self._running_count -= 1
+            self._condition.notify_all()
+
+
+def get_scheduler(bot) -> OutboundScheduler:
+    """ Will return the scheduler of the bot, creating it if needed """
+    scheduler = _SCHEDULERS.get(bot.id)
+    if scheduler is None:
+        with _SCHEDULERS_LOCK:
+            scheduler = _SCHEDULERS.get(bot.id)
+            if scheduler is None:
+                scheduler = _SCHEDULERS[bot.id] = OutboundScheduler(str(bot))
+    return scheduler
+
+
+def drain_all(timeout=None):
+    """ Will wait until all schedulers send their queued calls - use before restarting """
+    for scheduler in list(_SCHEDULERS.values()):
+        scheduler.drain(timeout)
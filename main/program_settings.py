@@ -4,3 +4,83 @@ Here we manually set some settings
 
 ALLOW_PRODUCTION_MODE = False
 python = 'python3.7'
+
+# Base URL of the Bot API - can be changed to a local Bot API server or to main/tools/fake_telegram.py
+TELEGRAM_API_URL = 'https://api.telegram.org/'
+
+# Maximal count of threads running the handlers in the --async mode of runner.py
+ASYNC_HANDLERS_POOL_SIZE = 8
+
+# Size of the keep-alive connections pool of each bot's (and telegraph's) HTTP session
+HTTP_POOL_SIZE = 10
+HTTP_KEEP_ALIVE = True
+
+# Outbound scheduler - rates are in messages per second, bursts are the sizes of the token buckets
+OUTBOUND_SCHEDULER_ENABLED = True
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_GLOBAL_BURST = 30
+OUTBOUND_SENDERS_COUNT = 4
+
+# Threads handling different chats of one bot concurrently (the order within a chat is kept), 1 - sequential
+CHAT_DISPATCH_WORKERS = 4
+
+# Write-behind checkpointing of bots' offsets - flushing every N updates or every T seconds
+OFFSET_FLUSH_EVERY_UPDATES = 20
+OFFSET_FLUSH_EVERY_SECONDS = 5
+OFFSETS_JOURNAL_DIR = 'offsets_journal'
+
+# Write-behind buffer of MessageInstance records - flushing every N records or every T milliseconds
+MESSAGE_INSTANCES_FLUSH_EVERY = 50
+MESSAGE_INSTANCES_FLUSH_INTERVAL_MS = 500
+
+# Seconds to keep groups, participants, commands and roles in the identity cache
+IDENTITY_CACHE_TTL = 300
+
+# Seconds to keep the standard role index of the score thresholds
+SCORE_THRESHOLDS_TTL = 300
+
+# Seconds to keep the maintained leaderboard rankings of the groups
+LEADERBOARD_RANKS_TTL = 600
+
+# Seconds to trust the cached subject problem sequences before checking them for changes of other processes
+SUBJECT_SEQUENCES_TTL = 60
+
+# Seconds to keep the rendered problem payloads and the count of the kept (least recently used) payloads
+PROBLEM_PAYLOADS_TTL = 300
+PROBLEM_PAYLOADS_MAX_SIZE = 256
+
+# Private chat to pre-upload problem images to with /warm_up_images, None - the administrator page
+IMAGES_WARM_UP_CHAT_ID = None
+
+# Source watcher of the runner - seconds without changes before restarting and the interval of the polling fallback
+WATCHER_DEBOUNCE_SECONDS = 1
+WATCHER_POLL_INTERVAL = 2
+
+# Webhook mode of runner.py - the receiver is listening on WEBHOOK_HOST:WEBHOOK_PORT,
+# WEBHOOK_URL is the public URL of the receiver (the bots' secret paths are appended to it)
+# WEBHOOK_SECRET is used to derive the secret paths and the secret tokens of the bots
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8443
+WEBHOOK_URL = None
+WEBHOOK_SECRET = None
+
+# Supervisor of the sharded runner (runner.py --shards N) - intervals are in seconds
+SUPERVISOR_REBALANCE_INTERVAL = 30
+SHARD_RESTART_DELAY = 1  # Is doubled after every crash, up to SHARD_RESTART_MAX_DELAY
+SHARD_RESTART_MAX_DELAY = 60
+SHARD_STABLE_SECONDS = 60  # The restart delay is reset when the shard was running this long
+SHARD_STOP_TIMEOUT = 90  # The long-polls can take up to 60 seconds
+
+# Database leases of the bots (runner.py --lease) - seconds, the TTL has to be longer than the long-polls
+LEASE_TTL = 90
+LEASE_HEARTBEAT_INTERVAL = 15
+LEASE_MAX_BOTS = None  # Maximal count of bots of one node, None - only the fair share is limiting
+
+# Instrumentation of the message pipeline (see main/instrumentation.py) - disabled has near-zero overhead
+# The percentiles are of the last window (kept in slices), the Prometheus endpoint is off when the port is None
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_WINDOW_SECONDS = 300
+INSTRUMENTATION_WINDOW_SLICES = 5
+INSTRUMENTATION_PORT = None
@@ -5,37 +5,20 @@ This is the main runner file of TelegramProblemGenerator.
 Just call run function and it will continuously update all bots from Bot table.
 The bot's updates won't be accepted if last update was more than 24 hours ago and will ask you for further actions.
 All logs are collected in the logs.txt.
+With --shards N the bots are run in N worker processes by the supervisor (see main/supervisor.py).
 """
 
 import sys
 import os
+import argparse
 import logging
+import signal
 import time
 from datetime import datetime
 from threading import Thread
 import django
 import platform
 
-from os.path import getmtime
-
-
-def get_listening_files(base=None):
-    res = []
-    if not base:
-        base = os.path.abspath(os.getcwd()+ '/../..')
-    for fl in os.listdir(base):
-        current = os.path.join(base, fl)
-        if os.path.isfile(current):
-            if current.split('.')[-1] == 'py':
-                res.append(current)
-        else:
-            res += get_listening_files(current)
-    return res
-
-WATCHED_FILES = get_listening_files()
-WATCHED_FILES_MTIMES = [(f, getmtime(f)) for f in WATCHED_FILES]
-
-
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(BASE_PATH)
 os.environ.setdefault('DJANGO_SETTINGS_MODULE',
@@ -43,32 +26,51 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE',
 
 django.setup()
 from django.utils import timezone
-from main.universals import (update_and_restart)
+from main.universals import (update_and_restart, restart_requested, RESTART_EXIT_CODE)
 from main.worker import Worker
+from main import outbound_scheduler, source_watcher, instrumentation
 from main.models import *
+from main.data_managers import answer_tallies
 from main.program_settings import ALLOW_PRODUCTION_MODE
 running = True
-file_checks = 0
 
 autorestart = True
-def run(bots, *, testing=False):
-    """ Will run main cycle and continuously load updates of bots """
-    global autorestart
+
+shard = False  # Is True in the worker processes of the supervisor
+crashed = False
+
+WATCHED_BASE = os.path.abspath(os.getcwd() + '/../..')
+
+
+def check_for_restart() -> bool:
+    """ Will return True if the program has to stop - it's stopped with a signal (in a shard),
+    the restart is requested (with /restart in a shard) or any of the watched files is changed,
+    so that the program has to be restarted """
+    if not running or restart_requested.is_set():
+        return True
+    if not autorestart or platform.system() == 'Windows':
+        return False
+    return source_watcher.get_watcher(WATCHED_BASE).changed.is_set()
+
+
+def stop(*args):
+    """ Is the SIGTERM handler of the shards and of the --lease mode - the workers are stopped
+    and their offsets are flushed, the program isn't restarted """
+    global running, autorestart
+    running = False
+    autorestart = False
+
+
+def get_shard_exit_code() -> int:
+    """ Will return the exit code of the shard - 1 if crashed, RESTART_EXIT_CODE if /restart is requested """
+    if crashed:
+        return 1
+    return RESTART_EXIT_CODE if restart_requested.is_set() else 0
+
+
+def check_last_updates(bots) -> bool:
+    """ Will ask to continue if some of the bots were not updated more than a day - returns False to stop """
     for bot in bots:
-        for binding in bot.botbinding_set.all():
-            adm_p = binding.participant_group.get_administrator_page()
-            if adm_p:
-                bot.send_message(adm_p, "Started...")
-            if binding.participant_group.activeProblem:
-                print('{} - {} - {} -> {} right answers'.format(
-                    bot.name, bot.last_updated, binding.participant_group,
-                    len(
-                        Answer.objects.filter(
-                            problem=binding.participant_group.activeProblem,
-                            group_specific_participant_data__participant_group=
-                            binding.participant_group,
-                            right=True,
-                            processed=False))))
         td = datetime.now(timezone.utc) - bot.last_updated
         print("[{}] {} since last update.".format(bot.name, td))
         if (td.days):
@@ -83,55 +85,217 @@ def run(bots, *, testing=False):
             if input(
                     "WARNING: The data can be not up-to-date, so you'll get all the updates in the logs, do you want to continue? y/N: "
             ) != 'y':
-                return
+                return False
+    return True
+
+
+def run(bots, *, testing=False, use_async=False, use_webhook=False, interactive=True):
+    """ Will run main cycle and continuously load updates of bots
+    - use_async - will multiplex all bots' long-polls over a single event loop instead of one thread per bot
+    - use_webhook - will receive updates of all bots with the embedded webhook receiver instead of long-polling
+    - interactive - will check the last updates of the bots, is False in the shards (the supervisor checks them)
+    """
+    global autorestart, running
+    if autorestart and platform.system() != 'Windows':
+        source_watcher.get_watcher(WATCHED_BASE)  # Starting to watch before the first update
+    instrumentation.start_endpoint()
+    for bot in bots:
+        for binding in bot.botbinding_set.all():
+            adm_p = binding.participant_group.get_administrator_page()
+            if adm_p:
+                bot.send_message(adm_p, "Started...")
+            if binding.participant_group.activeProblem:
+                print('{} - {} - {} -> {} right answers'.format(
+                    bot.name, bot.last_updated, binding.participant_group,
+                    answer_tallies.get_tally(
+                        binding.participant_group, binding.participant_group.activeProblem).right_count))
+    if interactive and not check_last_updates(bots):
+        return
 
     def update(bot):
-        global running, file_checks, autorestart
+        global running, crashed
         worker = Worker(bot)
-        while running:
-            if file_checks % 20 < 2:
-                if get_listening_files() != WATCHED_FILES and autorestart and platform.system() != 'Windows':
+        try:
+            while running:
+                if check_for_restart():
                     running = False
                     return
+                # try:
+                if running:
+                    worker.update_bot()
+                    worker.do_checks()
+                # except Exception as e:
+                #     logging.warning("ERROR: {}".format(e))
+                #     time.sleep(1)
+        except Exception:
+            if shard:  # Stopping the other bots too, so that the supervisor restarts the shard
+                crashed = True
+                running = False
+            raise
+        finally:
+            worker.shutdown()
 
-            file_checks += 1
-            for f, mtime in WATCHED_FILES_MTIMES:
-                if getmtime(f) != mtime and autorestart and platform.system() != 'Windows':
-                    running = False
-                    print("Found changed file!")
-                    return
-            # try:
-            if running:
-                worker.update_bot()
-                worker.do_checks()
-            # except Exception as e:
-            #     logging.warning("ERROR: {}".format(e))
-            #     time.sleep(1)
+    if not use_webhook:
+        for bot in bots:
+            bot.delete_webhook()  # getUpdates is not working while the webhook is set
 
-    ts = []
-    for bot in bots:
-        t = Thread(target=update, args=(bot,))
-        t.daemon = True
-        t.start()
-        ts.append(t)
-    for t in ts:
-        t.join()
+    if use_webhook:
+        from main import webhook_runner
+        webhook_runner.run(bots, check_for_restart=check_for_restart)
+        running = False
+    elif use_async:
+        from main import async_runner
+        async_runner.run(bots, check_for_restart=check_for_restart)
+        running = False
+    else:
+        ts = []
+        for bot in bots:
+            t = Thread(target=update, args=(bot,))
+            t.daemon = True
+            t.start()
+            ts.append(t)
+        for t in ts:
+            t.join()
 
+    outbound_scheduler.drain_all(timeout=30)  # Not losing queued messages
     if autorestart and not running:
         update_and_restart()
 
 
+def run_with_leases(bots):
+    """ Will run the bots whose leases are claimed by this node - see main/bot_leases.py
+    Several nodes can run this with the same bots, every bot is handled by one node at a time.
+    """
+    global running
+    from main import bot_leases
+    from main.program_settings import LEASE_HEARTBEAT_INTERVAL
+    if autorestart and platform.system() != 'Windows':
+        source_watcher.get_watcher(WATCHED_BASE)
+    instrumentation.start_endpoint()
+    manager = bot_leases.LeaseManager()
+    print("[{}] Claiming the bots...".format(manager.owner))
+    threads = {}  # {bot_id: (Thread, Lease)}
+
+    def update(bot, lease):
+        worker = Worker(bot)
+        worker.checkpointer.lease = lease
+        try:
+            while running and lease.is_valid and not lease.handover.is_set():
+                updates = worker.get_updates()
+                if not lease.is_valid:  # Could be claimed by another node during the long-poll
+                    break
+                worker.process_updates(updates)
+                worker.do_checks()
+        except bot_leases.LeaseLost as e:
+            logging.info(e)
+        finally:
+            try:
+                worker.shutdown()
+            except bot_leases.LeaseLost as e:
+                logging.info(e)
+            print("[{}] Stopped".format(bot.name))
+
+    try:
+        while running:
+            claimed, lost, handover = manager.heartbeat(bots.values_list('id', flat=True))
+            for lease in lost:
+                print("[{}] Lost the lease of bot {}".format(manager.owner, lease.bot_id))
+            for lease in handover:  # Is released below when its thread stops
+                print("[{}] Handing over bot {} to the other nodes".format(manager.owner, lease.bot_id))
+            for lease in claimed:
+                bot = Bot.objects.get(id=lease.bot_id)  # Loading after claiming - the offset is up-to-date
+                print("[{}] Claimed {} (fencing token {})".format(manager.owner, bot.name, lease.fencing_token))
+                bot.delete_webhook()
+                thread = Thread(target=update, args=(bot, lease))
+                thread.daemon = True
+                thread.start()
+                threads[lease.bot_id] = (thread, lease)
+            for bot_id, (thread, lease) in list(threads.items()):
+                if not thread.is_alive():
+                    del threads[bot_id]
+                    if not lease.lost.is_set():  # Is handed over or crashed - letting it to be claimed again
+                        manager.release(lease)
+            next_heartbeat = time.monotonic() + LEASE_HEARTBEAT_INTERVAL
+            while time.monotonic() < next_heartbeat:
+                if check_for_restart():
+                    running = False
+                    break
+                time.sleep(1)
+    finally:
+        running = False
+        for thread, _ in threads.values():
+            thread.join()
+        manager.release_all()
+
+    outbound_scheduler.drain_all(timeout=30)  # Not losing queued messages
+    if autorestart:
+        update_and_restart()
+
+
+def run_supervisor(bots, args):
+    """ Will run the bots in args.shards worker processes """
+    from main import supervisor
+    if args.use_webhook:
+        raise ValueError("The webhook mode can't be sharded - all shards would listen on WEBHOOK_PORT")
+    if not check_last_updates(bots):
+        return
+    if autorestart and platform.system() != 'Windows':
+        source_watcher.get_watcher(WATCHED_BASE)
+    command = [sys.executable, os.path.abspath(__file__)]
+    command += ['--test'] if args.test else ['--all'] if args.all else []
+    command += ['--async'] if args.use_async else []
+    restart = supervisor.run(args.shards, command, lambda: list(bots.values_list('id', flat=True)),
+                             check_for_restart=check_for_restart)
+    outbound_scheduler.drain_all(timeout=30)
+    if autorestart and restart:
+        update_and_restart()  # Migrating once for all shards
+
+
 if __name__ == '__main__':
-    testing = False
-    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+    parser = argparse.ArgumentParser(description='Runs the bots from the Bot table')
+    bots_mode = parser.add_mutually_exclusive_group()
+    bots_mode.add_argument('--test', action='store_true', help='run the bots for testing')
+    bots_mode.add_argument('--all', action='store_true', help='run all bots')
+    engine = parser.add_mutually_exclusive_group()
+    engine.add_argument('--async', dest='use_async', action='store_true',
+                        help='multiplex the long-polls over a single event loop')
+    engine.add_argument('--webhook', dest='use_webhook', action='store_true',
+                        help='receive the updates with the embedded webhook receiver')
+    parser.add_argument('--shards', type=int, default=0, help='run the bots in N worker processes')
+    parser.add_argument('--lease', action='store_true',
+                        help='run only the bots claimed with database leases, for running on several nodes')
+    parser.add_argument('--bots', help=argparse.SUPPRESS)  # Comma separated ids - is given to the shards
+    args = parser.parse_args()
+    testing = args.test
+    if args.test:
         print("*****************--IN THE TESTING MODE--*****************")
         bots = Bot.objects.filter(for_testing=True)
-        testing = True
-    elif len(sys.argv) > 1 and sys.argv[1] == '--all':
+    elif args.all:
         print("*****************--IN THE GLOBAL MODE--*****************")
         bots = Bot.objects.all()
     else:
         print("*****************--IN THE STANDARD MODE--*****************")
         bots = Bot.objects.filter(for_testing=False)
+    if args.use_webhook:
+        print("*****************--USING WEBHOOK UPDATE ENGINE--*****************")
+    elif args.use_async:
+        print("*****************--USING ASYNCIO UPDATE ENGINE--*****************")
     if testing or (not testing and ALLOW_PRODUCTION_MODE):
-        run(bots, testing=testing)
+        if args.bots is not None:  # Is a shard of the supervisor
+            shard = True
+            autorestart = False  # The supervisor is restarting the shards
+            signal.signal(signal.SIGTERM, stop)
+            bots = bots.filter(id__in=[int(bot_id) for bot_id in args.bots.split(',') if bot_id])
+            run(bots, testing=testing, use_async=args.use_async, interactive=False)
+            sys.exit(get_shard_exit_code())
+        elif args.lease:
+            if args.shards or args.use_async or args.use_webhook:
+                parser.error("--lease can't be combined with --shards, --async or --webhook")
+            print("*****************--USING DATABASE LEASES--*****************")
+            signal.signal(signal.SIGTERM, stop)  # Releasing the leases
+            run_with_leases(bots)
+        elif args.shards:
+            print("*****************--SUPERVISING {} SHARDS--*****************".format(args.shards))
+            run_supervisor(bots, args)
+        else:
+            run(bots, testing=testing, use_async=args.use_async, use_webhook=args.use_webhook)
@@ -1,11 +1,17 @@
 """
 Use this module to get "sourced" decorator, which will allow you to access data_stack elements without giving bot_id
+Is a compatibility shim over main.update_context - the data of the handled update is kept in the current
+UpdateContext, so the updates of one bot can be handled in several threads at the same time
 """
 
 from functools import wraps
-from collections import deque
 
-_DATA_STACK = {}
+from main import update_context
+from main.update_context import UpdateContext
+
+
+def _get_context() -> UpdateContext:
+    return update_context.get_required()
 
 
 class SourceManager:
@@ -16,30 +22,32 @@ class SourceManager:
 
     def __init__(self, bot_id: int):
         self.bot_id = bot_id
-        _DATA_STACK[self.bot_id] = deque()
 
-    def append(self, **kwargs) -> dict:
-        new_data = kwargs
-        _DATA_STACK[self.bot_id].append(new_data)
-        return new_data
+    def append(self, **kwargs) -> UpdateContext:
+        return update_context.push(self.bot_id, **kwargs)
 
-    def pop(self) -> dict:
-        return _DATA_STACK[self.bot_id].pop()
+    def pop(self) -> UpdateContext:
+        return update_context.pop()
 
     @property
     def is_empty(self):
-        return not _DATA_STACK[self.bot_id]
+        context = update_context.get_current()
+        return context is None or context.bot_id != self.bot_id
 
     def __getitem__(self, item):
-        return self.__getattr__(item)
+        if item in self.__dict__:
+            return self.__dict__[item]
+        return _get_context()[item]
 
     def has(self, item):
-        return item in _DATA_STACK[self.bot_id][-1]
+        return item in _get_context()
+
+    def __contains__(self, item):
+        return item in _get_context()
 
     def __getattr__(self, item):
-        if item == 'own_props' or item in self.own_prosp or item in self.__dict__:
-            return self.__dict__[item] if item in self.__dict__ else getattr(self, item)
-        return _DATA_STACK[self.bot_id][-1][item]
+        # Is called only for the names which are not own attributes
+        return _get_context()[item]
 
     def __setitem__(self, key, value):
         self.__setattr__(key, value)
@@ -48,13 +56,13 @@ class SourceManager:
         if key in self.own_prosp or key in self.__dict__:
             self.__dict__[key] = value
         else:
-            _DATA_STACK[self.bot_id][-1][key] = value
+            _get_context()[key] = value
 
     def __iter__(self):
-        return iter(_DATA_STACK[self.bot_id][-1].keys())
+        return iter(_get_context())
 
     def __str__(self):
-        return str(_DATA_STACK[self.bot_id][-1])
+        return str(_get_context())
 
     @property
     def sourced(self):
@@ -66,15 +74,17 @@ class SourceManager:
             @wraps(func)
             def inner(*args, from_args=False,
                       **kwargs):  # args are not used, will stay it here while integrating with commands
-                return func(_DATA_STACK[self.bot_id][-1] if not from_args else kwargs)
+                return func(_get_context() if not from_args else kwargs)
 
             return inner
 
         return decorator
 
     def get(self, item):
-        return _DATA_STACK[self.bot_id][-1].get(item)
+        return _get_context().get(item)
+
 
+update_context.install_field_properties(SourceManager)
 
 if __name__ == '__main__':
     source_manager = SourceManager(1)
@@ -0,0 +1,157 @@
+"""
+Watcher of the source files - is used by runner.py to restart the program when a .py file is changed
+- Uses inotify (Linux, through ctypes) and falls back to polling the mtimes when it's not available
+- Runs in one thread per process, bursts of changes are debounced
+- All bot loops are checking the same threading.Event, so there are no syscalls in the update path
+"""
+
+import os
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+import time
+
+from main.program_settings import WATCHER_DEBOUNCE_SECONDS, WATCHER_POLL_INTERVAL
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def get_listening_files(base) -> dict:
+    """ Will return {path: mtime} of the .py files in the base directory """
+    res = {}
+    for directory, _, files in os.walk(base):
+        for fl in files:
+            if fl.endswith('.py'):
+                current = os.path.join(directory, fl)
+                try:
+                    res[current] = os.path.getmtime(current)
+                except OSError:  # Removed while walking
+                    pass
+    return res
+
+
+class SourceWatcher:
+    """ Will set changed event when a .py file in the base directory is changed, created or removed """
+
+    def __init__(self, base, *, debounce=WATCHER_DEBOUNCE_SECONDS, poll_interval=WATCHER_POLL_INTERVAL):
+        self.base = os.path.abspath(base)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.changed = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='source-watcher', daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            inotify = Inotify()
+        except OSError as e:
+            logging.info("Can't use inotify, polling the source files: {}".format(e))
+            self._poll()
+            return
+        with inotify:
+            for directory, _, _ in os.walk(self.base):
+                inotify.add_watch(directory)
+            while True:
+                if not self._is_relevant(inotify, inotify.read()):
+                    continue
+                # Debouncing - waiting until there are no changes during the debounce interval
+                while self._is_relevant(inotify, inotify.read(timeout=self.debounce), debouncing=True):
+                    pass
+                print("Found changed file!")
+                self.changed.set()
+                return
+
+    @staticmethod
+    def _is_relevant(inotify, events, *, debouncing=False) -> bool:
+        relevant = False
+        for directory, mask, name in events:
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    inotify.add_watch(os.path.join(directory, name))  # New directories are not a change themselves
+            elif name.endswith('.py'):
+                relevant = True
+        return relevant or (debouncing and bool(events))
+
+    def _poll(self):
+        snapshot = get_listening_files(self.base)
+        while True:
+            time.sleep(self.poll_interval)
+            current = get_listening_files(self.base)
+            if current != snapshot:
+                # Debouncing - waiting until the files are not changing
+                while True:
+                    time.sleep(self.debounce)
+                    snapshot, current = current, get_listening_files(self.base)
+                    if current == snapshot:
+                        break
+                print("Found changed file!")
+                self.changed.set()
+                return
+
+
+class Inotify:
+    """ Minimal inotify wrapper """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not supported")
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # {wd: directory}
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def read(self, timeout=None) -> list:
+        """ Will return [(directory, mask, name)], [] on timeout """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            events.append((self.directories.get(wd, ''), mask, name))
+        return events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        os.close(self.fd)
+
+
+_watcher = None
+
+
+def get_watcher(base) -> SourceWatcher:
+    """ Will return the started watcher of the process """
+    global _watcher
+    if _watcher is None:
+        _watcher = SourceWatcher(base).start()
+    return _watcher
@@ -0,0 +1,176 @@
+"""
+Supervisor of the sharded runner - is used by runner.py with --shards N
+- The bots are sharded by id (bot.id % N) across N worker processes - runner.py with --bots <ids>
+- Crashed shards are restarted with a growing delay
+- The Bot table is checked every SUPERVISOR_REBALANCE_INTERVAL seconds, only the shards whose bots are changed
+  are restarted
+- The stdout of the shards is printed with a [shard N] prefix, their logs (stderr) are written to the logs.txt
+  of the supervisor
+- SIGTERM/SIGINT - the shards are stopped with SIGTERM, so that every shard flushes its offsets,
+  and are killed after SHARD_STOP_TIMEOUT seconds
+- A shard exiting with RESTART_EXIT_CODE (/restart) stops all shards and restarts the supervisor,
+  so the migrations run once and all shards get the new code
+"""
+
+import os
+import sys
+import signal
+import logging
+import subprocess
+import time
+from threading import Thread
+from django.db import close_old_connections
+
+from main.universals import SHARD_ENV, RESTART_EXIT_CODE
+from main.program_settings import (SUPERVISOR_REBALANCE_INTERVAL, SHARD_RESTART_DELAY, SHARD_RESTART_MAX_DELAY,
+                                   SHARD_STABLE_SECONDS, SHARD_STOP_TIMEOUT)
+
+CHECK_INTERVAL = 1  # seconds
+
+
+class Shard:
+    """ One worker process """
+
+    def __init__(self, index: int, command: list):
+        self.index = index
+        self.command = command
+        self.bot_ids = ()
+        self.process = None
+        self.started = 0
+        self.restart_delay = SHARD_RESTART_DELAY
+        self.restart_at = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def requested_restart(self) -> bool:
+        return self.process is not None and self.process.poll() == RESTART_EXIT_CODE
+
+    def start(self, bot_ids):
+        self.bot_ids = tuple(bot_ids)
+        self.restart_at = None
+        if not self.bot_ids:
+            self.process = None
+            return
+        env = dict(os.environ, PYTHONIOENCODING='utf-8', PYTHONUNBUFFERED='1')
+        env[SHARD_ENV] = str(self.index)
+        self.process = subprocess.Popen(
+            self.command + ['--bots', ','.join(str(bot_id) for bot_id in self.bot_ids)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, encoding='utf-8',
+            start_new_session=True)  # Ctrl+C is handled by the supervisor
+        self.started = time.monotonic()
+        Thread(target=self._forward, args=(self.process.stdout, print), daemon=True).start()
+        Thread(target=self._forward, args=(self.process.stderr, logging.info), daemon=True).start()
+        print("[supervisor] Started shard {} (pid {}) with bots {}".format(
+            self.index, self.process.pid, ', '.join(str(bot_id) for bot_id in self.bot_ids)))
+
+    def _forward(self, stream, write):
+        for line in stream:
+            write('[shard {}] {}'.format(self.index, line.rstrip('\n')))
+
+    def terminate(self):
+        """ Will ask the shard to stop - it will flush the offsets """
+        if self.is_running:
+            self.process.terminate()
+
+    def wait(self, deadline: float):
+        """ Will wait for the shard to stop, killing it after the deadline """
+        if self.process is None:
+            return
+        try:
+            self.process.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            print("[supervisor] Shard {} didn't stop in time, killing".format(self.index))
+            self.process.kill()
+            self.process.wait()
+
+    def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        self.terminate()
+        self.wait(time.monotonic() + timeout)
+
+    def check(self):
+        """ Will schedule/make the restart of the crashed shard """
+        if self.process is None or self.is_running or self.requested_restart:
+            return  # The restart request is handled by the supervisor
+        now = time.monotonic()
+        if self.restart_at is None:
+            if now - self.started > SHARD_STABLE_SECONDS:
+                self.restart_delay = SHARD_RESTART_DELAY
+            print("[supervisor] Shard {} exited with code {}, restarting in {} seconds".format(
+                self.index, self.process.returncode, self.restart_delay))
+            self.restart_at = now + self.restart_delay
+            self.restart_delay = min(self.restart_delay * 2, SHARD_RESTART_MAX_DELAY)
+        elif now >= self.restart_at:
+            self.start(self.bot_ids)
+
+
+def assign(bot_ids, shards_count: int) -> list:
+    """ Will return sorted bot ids of every shard """
+    return [tuple(sorted(bot_id for bot_id in bot_ids if bot_id % shards_count == index))
+            for index in range(shards_count)]
+
+
+class Supervisor:
+    """ Will keep the shards running """
+
+    def __init__(self, shards_count: int, command: list, get_bot_ids, *, check_for_restart=None):
+        """
+        :param command: command of the shard process, --bots <ids> is appended to it
+        :param get_bot_ids: callable returning ids of the bots to run
+        :param check_for_restart: callable returning True when the program has to be restarted
+        """
+        self.shards = [Shard(index, command) for index in range(shards_count)]
+        self.get_bot_ids = get_bot_ids
+        self.check_for_restart = check_for_restart
+        self.running = True
+
+    def stop(self, *args):
+        self.running = False
+
+    def rebalance(self):
+        close_old_connections()
+        for shard, bot_ids in zip(self.shards, assign(self.get_bot_ids(), len(self.shards))):
+            if bot_ids != shard.bot_ids:
+                if shard.is_running:
+                    print("[supervisor] Bots of shard {} are changed, restarting".format(shard.index))
+                    shard.stop()
+                shard.start(bot_ids)
+
+    def run(self) -> bool:
+        """ Will run until stopped with a signal, check_for_restart or a shard's restart request
+        - returns True in the latter cases """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        restart = False
+        next_rebalance = 0
+        try:
+            while self.running:
+                if self.check_for_restart and self.check_for_restart():
+                    restart = True
+                    break
+                if any(shard.requested_restart for shard in self.shards):
+                    print("[supervisor] Restart is requested by a shard, restarting all shards")
+                    restart = True
+                    break
+                if time.monotonic() >= next_rebalance:
+                    self.rebalance()
+                    next_rebalance = time.monotonic() + SUPERVISOR_REBALANCE_INTERVAL
+                for shard in self.shards:
+                    shard.check()
+                time.sleep(CHECK_INTERVAL)
+        finally:
+            print("[supervisor] Stopping the shards...")
+            deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+            for shard in self.shards:  # All shards are flushing at the same time
+                shard.terminate()
+            for shard in self.shards:
+                shard.wait(deadline)
+            sys.stdout.flush()
+        return restart
+
+
+def run(shards_count: int, command: list, get_bot_ids, *, check_for_restart=None) -> bool:
+    """ Will run the supervisor - returns True if the program has to be restarted """
+    return Supervisor(shards_count, command, get_bot_ids, check_for_restart=check_for_restart).run()
@@ -1,3 +1,72 @@
-from django.test import TestCase
+import os
+import sys
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
 # Some notes here to check if the program restarts after these changes, 
 # Create your tests here.
+
+from main import webhook_runner, universals, supervisor, runner
+from main.command_handlers.restart import restart
+
+
+class WebhookReceiverConsumeTests(SimpleTestCase):
+
+    def test_updates_are_consumed_in_order_when_more_than_one_batch_is_queued(self):
+        worker = SimpleNamespace(bot=SimpleNamespace(id=1, token='token', name='bot'))
+        updates_count = webhook_runner.MAX_BATCH_SIZE * 2 + 50
+        batches = []
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            receiver = webhook_runner.WebhookReceiver([worker], secret='secret')
+            for update_id in range(updates_count):
+                receiver.queues[worker.bot.id].put_nowait({'update_id': update_id})
+
+            async def consume_all():
+                task = asyncio.ensure_future(receiver.consume(worker, executor))
+                while sum(len(batch) for batch in batches) < updates_count:
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+            with mock.patch.object(webhook_runner, 'handle_updates_batch',
+                                   lambda _, updates: batches.append(updates)):
+                loop.run_until_complete(asyncio.wait_for(consume_all(), 5))
+        finally:
+            executor.shutdown(wait=True)
+            loop.close()
+        self.assertTrue(all(len(batch) <= webhook_runner.MAX_BATCH_SIZE for batch in batches))
+        self.assertEqual([update['update_id'] for batch in batches for update in batch], list(range(updates_count)))
+
+
+class ShardRestartTests(SimpleTestCase):
+
+    def tearDown(self):
+        universals.restart_requested.clear()
+
+    def test_restart_command_in_shard_requests_the_restart_and_exits_with_restart_code(self):
+        worker = mock.Mock()
+        restart(worker)
+        (func, *args), kwargs = worker.add_to_post_processing_stack.call_args
+        with mock.patch.dict(os.environ, {universals.SHARD_ENV: '0'}), \
+                mock.patch.object(universals.os, 'execv') as execv:
+            func(*args, **kwargs)  # Is run after processing the update
+        execv.assert_not_called()
+        self.assertTrue(universals.restart_requested.is_set())
+        self.assertTrue(runner.check_for_restart())
+        self.assertEqual(runner.get_shard_exit_code(), universals.RESTART_EXIT_CODE)
+
+    def test_supervisor_recognizes_the_restart_exit_code(self):
+        shard = supervisor.Shard(0, [])
+        shard.process = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; sys.exit({})'.format(universals.RESTART_EXIT_CODE)])
+        shard.process.wait()
+        self.assertTrue(shard.requested_restart)
+        shard.check()
+        self.assertIsNone(shard.restart_at)  # Is not restarted as a crashed shard
@@ -0,0 +1,247 @@
+"""
+Local stand-in of the Telegram Bot API - for testing the bots offline
+Set TELEGRAM_API_URL = 'http://127.0.0.1:8081/' in program_settings and run
+    python main/tools/fake_telegram.py --port 8081
+- Updates are injected with POST /fake/inject/<token> (JSON update) - they are delivered to the webhook
+  of the bot if it's set with setWebhook, otherwise are returned by getUpdates
+- Outbound calls of the bots (sendMessage, ...) are answered with fake messages and are recorded,
+  GET /fake/calls will return them
+- The outbound calls can be slowed down with --latency/--jitter (seconds) and rejected with 429 with the
+  --rate-limit probability, to see how the bots behave with the real Telegram
+- getChatMember and getChatMembersCount are answered from the senders of the injected updates
+- getFile returns the file_id as the file path, GET /file/bot<token>/<path> returns placeholder content
+FakeTelegram can be also used in-process (see webhook_benchmark.py and load_generator.py).
+"""
+
+import asyncio
+import argparse
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class FakeBotState:
+    """ State of one bot token """
+
+    def __init__(self, token: str):
+        self.token = token
+        self.updates = []
+        self.new_updates = asyncio.Condition()
+        self.webhook = None  # (url, secret_token)
+        self.polling = False  # Is True after the first getUpdates
+
+
+class FakeTelegram:
+    """ Fake Bot API server """
+
+    def __init__(self, *, latency=0, jitter=0, rate_limit=0, retry_after=1):
+        """
+        :param latency: seconds to wait before answering the outbound calls
+        :param jitter: maximal random addition to the latency
+        :param rate_limit: probability of answering the outbound call with 429 Too Many Requests
+        :param retry_after: retry_after of the 429 responses
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.bots = {}
+        self.calls = []  # [(time, token, method, payload)]
+        self.call_listeners = []  # [callable(token, method, payload)]
+        self.rate_limited_count = 0
+        self.chat_members = defaultdict(dict)  # {chat_id: {user_id: user}}
+        self.message_ids = itertools.count(1)
+        self.update_ids = itertools.count(1)
+        self.session = None
+
+    def get_bot(self, token) -> FakeBotState:
+        if token not in self.bots:
+            self.bots[token] = FakeBotState(token)
+        return self.bots[token]
+
+    def make_message_update(self, chat_id, user_id, text, *, chat_type='supergroup', chat_title='Fake group',
+                            first_name='User') -> dict:
+        """ Will create an update with a text message in the chat """
+        return {
+            'update_id': next(self.update_ids),
+            'message': {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': chat_type, 'title': chat_title},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': '{} {}'.format(first_name, user_id)},
+                'text': text,
+            }
+        }
+
+    def make_photo_update(self, chat_id, user_id, *, caption=None, **kwargs) -> dict:
+        """ Will create an update with a photo message in the chat """
+        update = self.make_message_update(chat_id, user_id, None, **kwargs)
+        message = update['message']
+        del message['text']
+        message['photo'] = [{
+            'file_id': 'fake-photo-{}'.format(message['message_id']),
+            'file_unique_id': 'fake-photo-{}'.format(message['message_id']),
+            'width': 90, 'height': 90, 'file_size': 1024,
+        }]
+        if caption:
+            message['caption'] = caption
+        return update
+
+    async def inject(self, token, update: dict):
+        """ Will deliver the update to the webhook of the bot or will queue it for getUpdates """
+        message = update.get('message')
+        if message and message.get('from'):
+            self.chat_members[message['chat']['id']][message['from']['id']] = message['from']
+        bot = self.get_bot(token)
+        if bot.webhook:
+            url, secret_token = bot.webhook
+            if self.session is None:
+                self.session = aiohttp.ClientSession()
+            async with self.session.post(url, json=update, headers={SECRET_TOKEN_HEADER: secret_token}) as resp:
+                return resp.status
+        async with bot.new_updates:
+            bot.updates.append(update)
+            bot.new_updates.notify_all()
+        return 200
+
+    def make_message(self, payload: dict) -> dict:
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(payload.get('chat_id') or 0)},
+            'text': payload.get('text'),
+        }
+
+    def get_chat_member(self, payload: dict) -> dict:
+        members = self.chat_members.get(int(payload.get('chat_id') or 0), {})
+        user_id = int(payload.get('user_id') or 0)
+        if user_id in members:
+            return {'user': members[user_id], 'status': 'member'}
+        return {'user': {'id': user_id, 'is_bot': False, 'first_name': 'User {}'.format(user_id)}, 'status': 'left'}
+
+    async def delay(self):
+        """ Will simulate the latency of the Bot API """
+        latency = self.latency + random.uniform(0, self.jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+    def is_rate_limited(self) -> bool:
+        if self.rate_limit and random.random() < self.rate_limit:
+            self.rate_limited_count += 1
+            return True
+        return False
+
+    async def call(self, token, method: str, payload: dict):
+        """ Will return the result of the Bot API method """
+        bot = self.get_bot(token)
+        if method == 'getUpdates':
+            bot.polling = True
+            offset = int(payload.get('offset') or 0)
+            timeout = float(payload.get('timeout') or 0)
+            async with bot.new_updates:
+                bot.updates = [update for update in bot.updates if update['update_id'] >= offset]
+                if not bot.updates and timeout:
+                    try:
+                        await asyncio.wait_for(bot.new_updates.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                return list(bot.updates)
+        if method == 'setWebhook':
+            bot.webhook = (payload['url'], payload.get('secret_token', ''))
+            return True
+        if method == 'deleteWebhook':
+            bot.webhook = None
+            return True
+        if method == 'getMe':
+            bot_id = int(token.split(':')[0]) if token.split(':')[0].isdigit() else 0
+            return {'id': bot_id, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_{}_bot'.format(bot_id)}
+        await self.delay()
+        if method == 'getChatMember':
+            return self.get_chat_member(payload)
+        if method == 'getChatMembersCount':
+            return len(self.chat_members.get(int(payload.get('chat_id') or 0), {}))
+        if method == 'getFile':
+            file_id = payload.get('file_id', '')
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_path': 'files/{}'.format(file_id)}
+        self.calls.append((time.monotonic(), token, method, payload))
+        for listener in list(self.call_listeners):
+            listener(token, method, payload)
+        if method == 'sendMediaGroup':
+            return [self.make_message(payload) for _ in json.loads(payload.get('media') or '[]')]
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument', 'forwardMessage'):
+            return self.make_message(payload)
+        return True
+
+    async def handle_api(self, request):
+        payload = dict(request.query)
+        if request.method == 'POST':
+            if request.content_type == 'application/json':
+                payload.update(await request.json())
+            else:
+                payload.update({key: value for key, value in (await request.post()).items()
+                                if isinstance(value, str)})
+        method = request.match_info['method']
+        if method not in ('getUpdates', 'setWebhook', 'deleteWebhook', 'getMe') and self.is_rate_limited():
+            await self.delay()
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests: retry after {}'.format(self.retry_after),
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        result = await self.call(request.match_info['token'], method, payload)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_file(self, request):
+        await self.delay()
+        return web.Response(body='fake file {}'.format(request.match_info['path']).encode(),
+                            content_type='application/octet-stream')
+
+    async def handle_inject(self, request):
+        status = await self.inject(request.match_info['token'], await request.json())
+        return web.json_response({'ok': True, 'status': status})
+
+    async def handle_calls(self, request):
+        return web.json_response([
+            {'time': call_time, 'method': method, 'payload': payload}
+            for call_time, _, method, payload in self.calls
+        ])
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_api)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        app.router.add_post('/fake/inject/{token}', self.handle_inject)
+        app.router.add_get('/fake/calls', self.handle_calls)
+        return app
+
+    async def start(self, host='127.0.0.1', port=8081) -> web.AppRunner:
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Telegram Bot API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help='seconds to answer the outbound calls')
+    parser.add_argument('--jitter', type=float, default=0, help='maximal random addition to the latency')
+    parser.add_argument('--rate-limit', type=float, default=0, help='probability of 429 for the outbound calls')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+    telegram = FakeTelegram(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                            retry_after=args.retry_after)
+    web.run_app(telegram.make_app(), host=args.host, port=args.port)
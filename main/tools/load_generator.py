@@ -0,0 +1,252 @@
+"""
+Load generator - measures how many updates one Worker can absorb
+1. Use a separate database - the scenario data (load test bot, groups, subject and problems) is created there,
+   the reference data (roles, commands, action types, playing modes, ...) has to be loaded already
+2. Set TELEGRAM_API_URL = 'http://127.0.0.1:8081/' in program_settings
+3. Run it - the fake Telegram server is started in the same process
+    python main/tools/load_generator.py --groups 10 --participants 50 --latency 0.05 --rate-limit 0.01
+Scenarios (--scenarios, are run in the given order):
+- answers - every participant of every group answers the active problem
+- cycle - a superadmin runs /cycle in every group - the problem is closed and the next one is sent
+- media - every participant posts a photo - is removed because of the low permissions and forwarded
+  to the administrator page
+The updates are delivered with getUpdates of the fake server and are handled with Worker.update_bot,
+as in the update loop of runner.run. For every scenario are reported the throughput, p50/p95/p99 of
+Worker.handle_update and the DB queries per update (of the worker's thread).
+"""
+
+import sys
+import os
+import asyncio
+import argparse
+import random
+import statistics
+import threading
+import time
+import django
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(BASE_PATH)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'TelegramProblemGenerator.settings')
+
+django.setup()
+from django.db import connection
+from django.utils import timezone
+from main.models import *
+from main.worker import Worker
+from main import outbound_scheduler
+from main.data_managers import message_instance_recorder
+from main.program_settings import TELEGRAM_API_URL, OFFSETS_JOURNAL_DIR
+
+from fake_telegram import FakeTelegram
+
+LOAD_TEST_BOT_ID = 1000000
+LOAD_TEST_TOKEN = '{}:LOAD-TEST'.format(LOAD_TEST_BOT_ID)
+LOAD_TEST_SUBJECT = 'load_test'
+SUPERADMIN_ID = 1999999999
+FIRST_PARTICIPANT_ID = 2000000000
+FIRST_GROUP_ID = -1009000000000
+FIRST_ADMINISTRATOR_PAGE_ID = -1008000000000
+SCENARIOS = ('answers', 'cycle', 'media')
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class FakeTelegramThread(threading.Thread):
+    """ Runs the fake Telegram server in its own event loop """
+
+    def __init__(self, telegram: FakeTelegram, port: int):
+        super().__init__(daemon=True)
+        self.telegram = telegram
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.telegram.start(port=self.port))
+        self.started.set()
+        self.loop.run_forever()
+
+    def inject(self, token, update: dict):
+        asyncio.run_coroutine_threadsafe(self.telegram.inject(token, update), self.loop).result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class QueryCounter:
+    """ Is used with connection.execute_wrapper """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MeasuredWorker(Worker):
+    """ Worker which records the duration and the DB queries of every handled update """
+
+    def __init__(self, bot: Bot):
+        super().__init__(bot)
+        self.__dict__['measurements'] = []  # [(seconds, queries)]
+
+    def handle_update(self, update, *, catch_exceptions=False) -> bool:
+        counter = QueryCounter()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                return super().handle_update(update, catch_exceptions=catch_exceptions)
+        finally:
+            self.__dict__['measurements'].append((time.perf_counter() - started, counter.count))
+
+
+def prepare(groups_count: int, problems_count: int) -> (Bot, list):
+    """ Will create (or reset) the scenario data - returns the bot and [(participant_group, administrator_page)] """
+    bot = Bot.objects.filter(token=LOAD_TEST_TOKEN).first()
+    if not bot:
+        bot = Bot.objects.create(id=LOAD_TEST_BOT_ID, token=LOAD_TEST_TOKEN, first_name='Load test',
+                                 for_testing=True)
+    bot.offset = 0
+    bot.last_updated = timezone.now()
+    bot.save()
+    journal_path = os.path.join(OFFSETS_JOURNAL_DIR, '{}.journal'.format(bot.id))
+    if os.path.exists(journal_path):
+        os.remove(journal_path)  # The update_ids of the fake server are starting from 1 again
+    discipline, _ = Discipline.objects.get_or_create(value=LOAD_TEST_SUBJECT, defaults={'name': 'Load test'})
+    subject, _ = Subject.objects.get_or_create(value=LOAD_TEST_SUBJECT, discipline=discipline,
+                                               defaults={'name': 'Load test'})
+    existing_indexes = set(subject.problem_set.values_list('index', flat=True))
+    Problem.objects.bulk_create([
+        Problem(index=index, formulation='Load test problem N{}'.format(index),
+                answer_formulation='The right answer of N{} is A.'.format(index), right_variant='a',
+                subject=subject)
+        for index in range(1, problems_count + 1) if index not in existing_indexes
+    ])
+    first_problem = subject.get_problem(1)
+    group_type, _ = GroupType.objects.get_or_create(name='supergroup')
+    superadmin_user, _ = Participant.objects.get_or_create(id=SUPERADMIN_ID, defaults={'first_name': 'Superadmin'})
+    SuperAdmin.objects.get_or_create(user=superadmin_user)
+    targets = []
+    for number in range(groups_count):
+        participant_group, _ = ParticipantGroup.objects.get_or_create(
+            telegram_id=str(FIRST_GROUP_ID - number),
+            defaults={'title': 'Load test group {}'.format(number), 'type': group_type})
+        administrator_page, _ = AdministratorPage.objects.get_or_create(
+            telegram_id=str(FIRST_ADMINISTRATOR_PAGE_ID - number),
+            defaults={'title': 'Load test administrator page {}'.format(number), 'type': group_type,
+                      'participant_group': participant_group})
+        BotBinding.objects.get_or_create(bot=bot, participant_group=participant_group)
+        binding, _ = SubjectGroupBinding.objects.get_or_create(subject=subject, participant_group=participant_group)
+        binding.last_problem = first_problem
+        binding.save()
+        GroupSpecificParticipantData.objects.filter(participant_group=participant_group).delete()  # Fresh members
+        participant_group.activeSubjectGroupBinding = binding
+        participant_group.activeProblem = first_problem
+        participant_group.save()
+        targets.append((participant_group, administrator_page))
+    return bot, targets
+
+
+def make_updates(telegram: FakeTelegram, scenario: str, targets: list, participants_count: int) -> list:
+    updates = []
+    for participant_group, _ in targets:
+        chat_id = int(participant_group.telegram_id)
+        if scenario == 'cycle':
+            updates.append(telegram.make_message_update(chat_id, SUPERADMIN_ID, '/cycle',
+                                                        chat_title=participant_group.title))
+            continue
+        for number in range(participants_count):
+            user_id = FIRST_PARTICIPANT_ID + number
+            if scenario == 'answers':
+                updates.append(telegram.make_message_update(chat_id, user_id, random.choice('ABCDE'),
+                                                            chat_title=participant_group.title))
+            else:
+                updates.append(telegram.make_photo_update(chat_id, user_id, chat_title=participant_group.title))
+    random.shuffle(updates)  # The groups are active at the same time
+    for update in updates:
+        update['update_id'] = next(telegram.update_ids)  # getUpdates is returning them in the order of ids
+    return updates
+
+
+def run_scenario(server: FakeTelegramThread, worker: MeasuredWorker, scenario: str, targets: list,
+                 participants_count: int) -> dict:
+    telegram = server.telegram
+    updates = make_updates(telegram, scenario, targets, participants_count)
+    worker.measurements.clear()
+    calls_before = len(telegram.calls)
+    rate_limited_before = telegram.rate_limited_count
+    started = time.perf_counter()
+    for update in updates:
+        server.inject(worker.bot.token, update)
+    while len(worker.measurements) < len(updates):
+        worker.update_bot(timeout=0)
+        worker.do_checks()
+    handled = time.perf_counter() - started
+    message_instance_recorder.flush()
+    outbound_scheduler.drain_all(timeout=60)
+    durations = [duration for duration, _ in worker.measurements]
+    queries = [count for _, count in worker.measurements]
+    return {
+        'scenario': scenario,
+        'updates': len(updates),
+        'throughput': len(updates) / handled if handled else 0,
+        'p50': percentile(durations, 50) * 1000,
+        'p95': percentile(durations, 95) * 1000,
+        'p99': percentile(durations, 99) * 1000,
+        'queries': statistics.mean(queries),
+        'max_queries': max(queries),
+        'outbound_calls': len(telegram.calls) - calls_before,
+        'rate_limited': telegram.rate_limited_count - rate_limited_before,
+    }
+
+
+def main(args):
+    expected_url = 'http://127.0.0.1:{}/'.format(args.port)
+    if TELEGRAM_API_URL != expected_url:
+        sys.exit("Set TELEGRAM_API_URL = '{}' in program_settings - the load mustn't reach Telegram".format(
+            expected_url))
+    scenarios = args.scenarios.split(',')
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+    server = FakeTelegramThread(FakeTelegram(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                                             retry_after=args.retry_after), args.port)
+    server.start()
+    server.started.wait()
+    bot, targets = prepare(args.groups, args.problems)
+    worker = MeasuredWorker(bot)
+    results = []
+    try:
+        for scenario in scenarios:
+            results.append(run_scenario(server, worker, scenario, targets, args.participants))
+    finally:
+        worker.shutdown()
+        server.stop()
+    print("{} groups x {} participants, latency {}s (+{}s), 429 probability {}".format(
+        args.groups, args.participants, args.latency, args.jitter, args.rate_limit))
+    for result in results:
+        print("[{scenario}] {updates} updates - {throughput:.1f} updates/s, p50 {p50:.1f}ms, p95 {p95:.1f}ms, "
+              "p99 {p99:.1f}ms, {queries:.1f} queries/update (max {max_queries}), "
+              "{outbound_calls} outbound calls, {rate_limited} rate limited".format(**result))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load generator of the Worker')
+    parser.add_argument('--groups', type=int, default=5)
+    parser.add_argument('--participants', type=int, default=20, help='participants in every group')
+    parser.add_argument('--problems', type=int, default=50)
+    parser.add_argument('--scenarios', default='answers,cycle,answers,media',
+                        help='comma separated of {}'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--latency', type=float, default=0, help='seconds to answer the outbound calls')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--rate-limit', type=float, default=0, help='probability of 429 for the outbound calls')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8081)
+    main(parser.parse_args())
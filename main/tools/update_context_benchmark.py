@@ -0,0 +1,109 @@
+"""
+Microbenchmark of the attribute access cost of the handled update's data
+- legacy - the old module-global dict of deques behind SourceManager (is copied here as the baseline)
+- shim - SourceManager over the contextvars UpdateContext
+- context - direct slot read of the current UpdateContext
+The accesses are made through the Worker's delegation (old and new) (worker.x, worker['x']) and through worker.source.x
+    python main/tools/update_context_benchmark.py --count 1000000
+"""
+
+import sys
+import os
+import argparse
+import timeit
+from collections import deque
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(BASE_PATH)
+
+from main import update_context
+from main.source_manager import SourceManager
+
+_LEGACY_DATA_STACK = {}
+
+
+class LegacySourceManager:
+    """ SourceManager before the update context - kept for the comparison """
+    own_prosp = ('bot_id', 'get')
+
+    def __init__(self, bot_id: int):
+        self.bot_id = bot_id
+        _LEGACY_DATA_STACK[self.bot_id] = deque()
+
+    def append(self, **kwargs) -> dict:
+        _LEGACY_DATA_STACK[self.bot_id].append(kwargs)
+        return kwargs
+
+    def __getitem__(self, item):
+        return self.__getattr__(item)
+
+    def __getattr__(self, item):
+        if item == 'own_props' or item in self.own_prosp or item in self.__dict__:
+            return self.__dict__[item] if item in self.__dict__ else getattr(self, item)
+        return _LEGACY_DATA_STACK[self.bot_id][-1][item]
+
+
+class LegacyWorker:
+    """ Has the delegation of Worker before the update context """
+
+    def __init__(self, source):
+        self.__dict__['source'] = source
+
+    def __getitem__(self, item):
+        return self.__getattr__(item)
+
+    def __getattr__(self, item):
+        if item == 'source' or item in self.__dict__:
+            return self.__dict__[item]
+        return self.__dict__['source'][item]
+
+
+class ContextWorker:
+    """ Has the same delegation as Worker """
+
+    def __init__(self, source):
+        self.__dict__['source'] = source
+
+    def __getitem__(self, item):
+        if item in self.__dict__:
+            return self.__dict__[item]
+        return self.__getattr__(item)
+
+    def __getattr__(self, item):
+        if item == 'source':
+            raise AttributeError(item)
+        return update_context.get_required()[item]
+
+
+update_context.install_field_properties(ContextWorker)
+
+
+def benchmark(count: int) -> dict:
+    fields = {'update': {}, 'message': {'message_id': 1}, 'bot': object(), 'participant_group': object()}
+    legacy = LegacyWorker(LegacySourceManager(1))
+    legacy.source.append(**fields)
+    shim = ContextWorker(SourceManager(2))
+    shim.source.append(**fields)
+    context = update_context.get_current()
+    statements = {
+        'legacy worker.source.x': lambda: legacy.source.participant_group,
+        'legacy worker.x': lambda: legacy.participant_group,
+        "legacy worker['x']": lambda: legacy['participant_group'],
+        'shim worker.source.x': lambda: shim.source.participant_group,
+        'shim worker.x': lambda: shim.participant_group,
+        "shim worker['x']": lambda: shim['participant_group'],
+        'context.x': lambda: context.participant_group,
+        'get_current().x': lambda: update_context.get_current().participant_group,
+    }
+    results = {name: min(timeit.repeat(statement, number=count, repeat=3)) / count * 1e9
+               for name, statement in statements.items()}
+    update_context.pop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update data attribute access microbenchmark')
+    parser.add_argument('--count', type=int, default=1000000)
+    args = parser.parse_args()
+    for name, nanoseconds in benchmark(args.count).items():
+        print('{:<28} {:8.1f} ns'.format(name, nanoseconds))
@@ -0,0 +1,69 @@
+"""
+End-to-end latency benchmark of the webhook and polling modes, using the fake Telegram server
+1. Set TELEGRAM_API_URL = 'http://127.0.0.1:8081/' in program_settings
+2. Run this benchmark - it starts the fake server and waits for the runner to connect
+    python main/tools/webhook_benchmark.py --token <bot token> --chat <group id> --user <participant id>
+3. Run the runner in the mode to measure (python main/runner.py --test or python main/runner.py --test --webhook),
+   for the webhook mode set WEBHOOK_URL = 'http://127.0.0.1:8443' and WEBHOOK_SECRET in program_settings
+The latency is measured from injecting the update till the first outbound call of the bot to the chat,
+so use a text the bot is answering to in the chat (--text).
+Run it once for each mode and compare the results.
+"""
+
+import asyncio
+import argparse
+import statistics
+import time
+
+from fake_telegram import FakeTelegram
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def benchmark(args):
+    telegram = FakeTelegram()
+    runner = await telegram.start(port=args.port)
+    bot = telegram.get_bot(args.token)
+    replies = asyncio.Queue()
+    telegram.call_listeners.append(
+        lambda token, method, payload: token == args.token and str(payload.get('chat_id')) == str(args.chat)
+        and replies.put_nowait(time.monotonic()))
+    print("Waiting for the runner (getUpdates or setWebhook)...")
+    while not bot.webhook and not bot.polling:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(args.warm_up)
+    mode = 'webhook' if bot.webhook else 'polling'
+    latencies = []
+    for _ in range(args.count):
+        while not replies.empty():
+            replies.get_nowait()
+        started = time.monotonic()
+        await telegram.inject(args.token, telegram.make_message_update(args.chat, args.user, args.text))
+        try:
+            latencies.append(await asyncio.wait_for(replies.get(), args.timeout) - started)
+        except asyncio.TimeoutError:
+            print("No reply in {} seconds".format(args.timeout))
+        await asyncio.sleep(args.interval)
+    await telegram.close()
+    await runner.cleanup()
+    if latencies:
+        print("[{}] {} replies of {} - mean {:.1f}ms, p50 {:.1f}ms, p95 {:.1f}ms, max {:.1f}ms".format(
+            mode, len(latencies), args.count, statistics.mean(latencies) * 1000,
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, max(latencies) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Webhook vs polling latency benchmark')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--chat', type=int, required=True)
+    parser.add_argument('--user', type=int, required=True)
+    parser.add_argument('--text', default='/status')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between the updates')
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--warm-up', type=float, default=2)
+    parser.add_argument('--port', type=int, default=8081)
+    asyncio.get_event_loop().run_until_complete(benchmark(parser.parse_args()))
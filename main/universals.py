@@ -1,18 +1,94 @@
 import requests
 import json
 import logging
-import urllib
+import urllib.parse
+import re
+import threading
+from requests.adapters import HTTPAdapter
 from django.core.management import call_command
 import os
 import sys
 import platform
-from main.program_settings import python
+from main.program_settings import python, HTTP_POOL_SIZE, HTTP_KEEP_ALIVE
+from main import instrumentation
 import time
 
+"""
+Pooled keep-alive sessions - one per bot token (and one per host for other APIs, like telegraph)
+{session_key: requests.Session}
+"""
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
 
-def get_response(url, *, payload=None, files=None, use_post=False, raw=False, max_retries=3, timeout=None):
-    """ Will get response with get/post based on files existance """
-    headers = {"Content-Type": "application/json"}
+SHARD_ENV = 'RUNNER_SHARD'  # Is set by the supervisor for the shard processes - the index of the shard
+RESTART_EXIT_CODE = 3  # The shard is exiting with it to ask the supervisor to update and restart all shards
+restart_requested = threading.Event()  # Is set by update_and_restart in the shards
+
+
+def get_session_key(url: str) -> str:
+    """ Will return the key of the session for given url
+    - bot{id} for Bot API urls - the secret part of the token is not used to not expose it in the stats
+    - host for other urls """
+    parsed = urllib.parse.urlsplit(url)
+    match = re.search(r'/(?:file/)?bot(\d+):', parsed.path)
+    if match:
+        return 'bot{}'.format(match.group(1))
+    return parsed.netloc
+
+
+def get_session(url: str) -> requests.Session:
+    """ Will return pooled session for given url, creating it if needed """
+    key = get_session_key(url)
+    session = _SESSIONS.get(key)
+    if session is None:
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                if not HTTP_KEEP_ALIVE:
+                    session.headers['Connection'] = 'close'
+                _SESSIONS[key] = session
+    return session
+
+
+def get_sessions_stats() -> dict:
+    """ Will return connection counters of the pooled sessions
+    {session_key: {'requests': ..., 'new_connections': ..., 'reused_connections': ...}} """
+    res = {}
+    for key, session in list(_SESSIONS.items()):
+        requests_count = connections_count = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    requests_count += pool.num_requests
+                    connections_count += pool.num_connections
+        res[key] = {
+            'requests': requests_count,
+            'new_connections': connections_count,
+            'reused_connections': requests_count - connections_count,
+        }
+    return res
+
+
+class TelegramRetryAfter(Exception):
+    """ Is raised by get_response when Telegram responds 429 and raise_retry_after is given """
+
+    def __init__(self, retry_after):
+        super().__init__('Retry after {} seconds'.format(retry_after))
+        self.retry_after = retry_after
+
+
+def get_response(url, *, payload=None, files=None, use_post=False, raw=False, max_retries=3, timeout=None,
+                 raise_retry_after=False):
+    """ Will get response with get/post based on files existance
+    - raise_retry_after - will raise TelegramRetryAfter on 429 instead of sleeping and retrying """
+    session = get_session(url)
+    instrumentation.count_api_call()  # Is counted only in the thread handling the update
     if timeout is None:
         if payload is None or 'timeout' not in payload:
             timeout = 10
@@ -23,9 +99,9 @@ def get_response(url, *, payload=None, files=None, use_post=False, raw=False, ma
         cycle += 1
         try:
             if files or use_post:
-                resp = requests.post(url, params=payload, files=files, timeout=timeout)
+                resp = session.post(url, params=payload, files=files, timeout=timeout)
             else:
-                resp = requests.get(url, params=payload, timeout=timeout)
+                resp = session.get(url, params=payload, timeout=timeout)
             break
         except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
             if cycle >= max_retries:
@@ -45,25 +121,35 @@ def get_response(url, *, payload=None, files=None, use_post=False, raw=False, ma
                                 use_post=use_post,
                                 raw=raw,
                                 max_retries=max_retries,
-                                timeout=timeout)
+                                timeout=timeout,
+                                raise_retry_after=raise_retry_after)
         elif data.get('description') == 'Bad Request: message to delete not found':
             return   # The message is already removed
+    elif data.get('error_code') == 429:
+        retry_after = safe_getter(data, 'parameters.retry_after', mode='DICT', default=1)
+        if raise_retry_after:
+            raise TelegramRetryAfter(retry_after)
+        logging.info("Got 429, retrying after {} seconds.".format(retry_after))
+        time.sleep(retry_after)
+        return get_response(url,
+                            payload=payload,
+                            files=files,
+                            use_post=use_post,
+                            raw=raw,
+                            max_retries=max_retries,
+                            timeout=timeout)
     else:
         print(resp.__dict__)
         pass
     return resp
 
 
-def get_response_with_urllib(url, *, payload=None, method="POST"):
-    """ Will get response with post (method kwarg) using urllib
-    Is working better than requests for telegraph pages """
-    data = urllib.parse.urlencode(payload).encode("utf-8")
-    request = urllib.request.Request(url)
-    request.get_method = lambda: method
-    with urllib.request.urlopen(request, data=data) as f:
-        resp = f.read()
-        res = json.loads(resp.decode("utf-8"), encoding="utf-8")
-        return res.get("result") if res.get("result") is not None else res
+def get_response_with_form_data(url, *, payload=None, method="POST", timeout=10):
+    """ Will get response sending the payload as form data in the body (method kwarg)
+    Is working better than query params for telegraph pages, because the content can be big """
+    resp = get_session(url).request(method, url, data=payload, timeout=timeout)
+    res = resp.json()
+    return res.get("result") if res.get("result") is not None else res
 
 
 def configure_logging():
@@ -72,11 +158,14 @@ def configure_logging():
     root_logger = logging.getLogger()
     """ Preventing multiple calls """
     if (root_logger.handlers
-            and root_logger.handlers[0].stream.name == "logs.txt"
+            and root_logger.handlers[0].stream.name in ("logs.txt", "<stderr>")
             and root_logger.handlers[0].stream.encoding == "utf-8"):
         return
     root_logger.setLevel(logging.INFO)
-    handler = logging.FileHandler("logs.txt", "a", "utf-8")
+    if SHARD_ENV in os.environ:  # The supervisor is collecting the logs of the shards to its logs.txt
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = logging.FileHandler("logs.txt", "a", "utf-8")
     root_logger.addHandler(handler)
 
 
@@ -120,10 +209,19 @@ def safe_getter(model: object or dict, path: str, default=None, mode='OBJECT'):
 def update_and_restart():
     """
     Will run migrations and restart the program
+    - In a shard will only request the restart - the shard is stopped and the supervisor migrates once
+      and restarts all shards
     """
+    if SHARD_ENV in os.environ:
+        restart_requested.set()
+        return
     if platform.system() == 'Windows':
         print('Can\'t restart script in Windows.')
         return -1
+    from main import outbound_scheduler
+    from main.data_managers import message_instance_recorder
+    outbound_scheduler.drain_all(timeout=30)  # Sending already queued messages before restarting
+    message_instance_recorder.flush()  # The buffered records would be lost with execv
     call_command('migrate')  # Test
     # Restarting the script if on macOS or Linux -> has to be executable -> chmod a+x runner.py
     # Won't match new python files
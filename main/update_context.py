@@ -0,0 +1,128 @@
+"""
+Context of the update which is being handled - is propagated with contextvars, so the handlers of
+concurrently handled updates (other threads, other chats) can't see each other's state
+- The known fields are __slots__, so the access is a direct slot read
+- Other fields can be set too, they are kept in the extra dict
+- Supports the mapping interface of the old data stack (ctx['message'], ctx.get('message'), 'message' in ctx),
+  missing fields are raising KeyError as before
+SourceManager is kept as a compatibility shim over the current context, both SourceManager and Worker
+are getting properties of the known fields with install_field_properties.
+"""
+
+import contextvars
+
+FIELDS = (
+    'update', 'message', 'bot',
+    'raw_text', 'text', 'command', 'command_model', 'command_argv', 'variant', 'entities',
+    'participant_group', 'pg_adm_page', 'administrator_page', 'is_administrator_page',
+    'participant', 'groupspecificparticipantdata', 'new_members_models', 'is_superadmin', 'is_from_superadmin',
+    'old_answer', 'position_change',
+)
+_FIELDS_SET = frozenset(FIELDS)
+
+_current = contextvars.ContextVar('update_context', default=None)
+
+
+class UpdateContext:
+    """ Data of one handled update """
+    __slots__ = FIELDS + ('bot_id', 'extra', 'token')
+
+    def __init__(self, bot_id, **fields):
+        self.bot_id = bot_id
+        self.extra = {}
+        self.token = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @property
+    def gspd(self):
+        return self.groupspecificparticipantdata
+
+    def __getitem__(self, item):
+        if item in _FIELDS_SET:
+            try:
+                return getattr(self, item)
+            except AttributeError:
+                raise KeyError(item) from None
+        return self.extra[item]
+
+    def __setitem__(self, key, value):
+        if key in _FIELDS_SET:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, item):
+        if item in _FIELDS_SET:
+            return hasattr(self, item)
+        return item in self.extra
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def keys(self) -> list:
+        return [field for field in FIELDS if hasattr(self, field)] + list(self.extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __str__(self):
+        return str({key: self[key] for key in self.keys()})
+
+
+def get_current() -> UpdateContext or None:
+    """ Will return the context of the update which is being handled in the current thread/task """
+    return _current.get()
+
+
+def get_required() -> UpdateContext:
+    """ Will return the current context, raises IndexError when no update is being handled """
+    context = _current.get()
+    if context is None:
+        raise IndexError('There is no update being handled')
+    return context
+
+
+def _make_field_property(name: str) -> property:
+    slot = UpdateContext.__dict__[name]
+
+    def getter(self):
+        context = _current.get()
+        if context is None:
+            raise IndexError('There is no update being handled')
+        try:
+            return slot.__get__(context)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def setter(self, value):
+        slot.__set__(get_required(), value)
+
+    return property(getter, setter, doc='{} of the handled update'.format(name))
+
+
+def install_field_properties(cls, *, exclude=()):
+    """ Will add properties reading the known fields of the current context to the class,
+    so that obj.message is a slot read instead of a __getattr__ fallback """
+    for name in FIELDS:
+        if name not in exclude and name not in cls.__dict__:
+            setattr(cls, name, _make_field_property(name))
+
+
+def push(bot_id, **fields) -> UpdateContext:
+    """ Will make a new context current - call pop after handling the update """
+    context = UpdateContext(bot_id, **fields)
+    context.token = _current.set(context)
+    return context
+
+
+def pop() -> UpdateContext:
+    """ Will restore the previous context """
+    context = _current.get()
+    if context is None:
+        raise IndexError('pop from an empty update context stack')
+    _current.reset(context.token)
+    return context
@@ -0,0 +1,136 @@
+"""
+Webhook based update engine - is used by runner.py in the --webhook mode.
+One embedded aiohttp server receives the updates of all bots on WEBHOOK_PORT:
+- Every bot has its own secret path, so the updates are routed to the right Worker by the path
+- Telegram sends the secret token of the bot in the X-Telegram-Bot-Api-Secret-Token header, which is verified
+- The updates are acknowledged immediately and are put to the bot's queue, which is consumed in order
+  by the handlers' thread pool (the same as in the --async mode)
+- The webhook is set with max_connections=1 (see Bot.set_webhook), so Telegram delivers the updates of a bot
+  one by one in the update_id order - the offset watermark can't skip a late lower update
+The acknowledged updates that are still in the queues are processed before stopping.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from main.worker import Worker
+from main.async_runner import handle_updates_batch, watch_for_restart
+from main.program_settings import (ASYNC_HANDLERS_POOL_SIZE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL,
+                                   WEBHOOK_SECRET)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BATCH_SIZE = 100
+
+
+def get_secret_path(bot, secret: str) -> str:
+    """ Will return the secret path of the bot's webhook """
+    return hmac.new(secret.encode(), 'path:{}'.format(bot.token).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def get_secret_token(bot, secret: str) -> str:
+    """ Will return the secret token that Telegram has to send with the bot's updates """
+    return hmac.new(secret.encode(), 'token:{}'.format(bot.token).encode(), hashlib.sha256).hexdigest()
+
+
+class WebhookReceiver:
+    """ Will receive the updates of the workers' bots and put them to the workers' queues """
+
+    def __init__(self, workers: list, *, secret: str):
+        self.routes = {
+            get_secret_path(worker.bot, secret): (get_secret_token(worker.bot, secret), worker)
+            for worker in workers
+        }
+        self.queues = {worker.bot.id: asyncio.Queue() for worker in workers}
+
+    async def handle(self, request):
+        route = self.routes.get(request.match_info['path'])
+        if route is None:
+            return web.Response(status=404)
+        secret_token, worker = route
+        if not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret_token):
+            logging.info("Got webhook request with invalid secret token for {}".format(worker.bot.name))
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        self.queues[worker.bot.id].put_nowait(update)
+        return web.Response(text='ok')  # Acknowledging before processing
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/{path}', self.handle)
+        return app
+
+    def take_batch(self, worker, updates=None) -> list:
+        """ Will take the queued updates of the worker (up to MAX_BATCH_SIZE)
+        - updates - already taken updates, the batch starts with them """
+        queue = self.queues[worker.bot.id]
+        updates = list(updates or [])
+        while not queue.empty() and len(updates) < MAX_BATCH_SIZE:
+            updates.append(queue.get_nowait())
+        return sorted(updates, key=lambda update: update['update_id'])
+
+    async def consume(self, worker, executor: ThreadPoolExecutor):
+        """ Will continuously give the worker's queued updates to the executor """
+        loop = asyncio.get_event_loop()
+        queue = self.queues[worker.bot.id]
+        while True:
+            first = await queue.get()  # Waiting for the first update, it has to stay the first in the batch
+            await loop.run_in_executor(executor, handle_updates_batch, worker, self.take_batch(worker, [first]))
+
+
+async def run_bots(bots, *, check_for_restart=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT, url=WEBHOOK_URL,
+                   secret=WEBHOOK_SECRET, register=True):
+    """ Will receive the updates of all bots until check_for_restart returns True
+    - register - will call setWebhook for the bots
+    """
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers=ASYNC_HANDLERS_POOL_SIZE)
+    workers = [Worker(bot) for bot in bots]
+    receiver = WebhookReceiver(workers, secret=secret)
+    app_runner = web.AppRunner(receiver.make_app())
+    await app_runner.setup()
+    try:
+        await web.TCPSite(app_runner, host, port).start()
+        if register:
+            for worker in workers:
+                resp = await loop.run_in_executor(
+                    None, worker.bot.set_webhook, '{}/{}'.format(url.rstrip('/'), get_secret_path(worker.bot, secret)),
+                    get_secret_token(worker.bot, secret))
+                logging.info("setWebhook for {}: {}".format(worker.bot.name, resp))
+        tasks = [asyncio.ensure_future(receiver.consume(worker, executor)) for worker in workers]
+        if check_for_restart:
+            tasks.append(asyncio.ensure_future(watch_for_restart(check_for_restart)))
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()  # Raising exceptions of the consumers
+    finally:
+        await app_runner.cleanup()  # Not accepting new updates
+        executor.shutdown(wait=True)  # Letting the already started handlers to finish
+        for worker in workers:
+            updates = receiver.take_batch(worker)
+            while updates:  # The acknowledged updates won't be sent again
+                handle_updates_batch(worker, updates)
+                updates = receiver.take_batch(worker)
+            worker.shutdown()
+
+
+def run(bots, *, check_for_restart=None):
+    """ Will run the event loop """
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET have to be set in program_settings for the webhook mode")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run_bots(bots, check_for_restart=check_for_restart))
+    finally:
+        loop.close()
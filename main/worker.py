@@ -4,18 +4,26 @@ from main.dynamic_telegraph_page_creator import DynamicTelegraphPageCreator
 from django.utils import timezone
 import logging
 from .source_manager import SourceManager
+from . import update_context, instrumentation
+from .data_managers.offset_checkpointer import OffsetCheckpointer
+from .data_managers import leaderboard_ranks, message_instance_recorder
 from .commands_mapping import COMMANDS_MAPPING
 from .message_handlers import message_handler
 from .message_handlers.user_pg_message_bindings_handler import AVAILABLE_MESSAGE_BINDINGS
 from collections import Counter
 import re
-from .events import inactive_group
+import threading
+from .chat_dispatcher import ChatDispatcher
+from .event_scheduler import EventScheduler, EVENTS_MAPPING
+from .outbound_scheduler import PRIORITY_DEFAULT, PRIORITY_NOTICE, PRIORITY_LOG
+from .program_settings import CHAT_DISPATCH_WORKERS
 
 """
 Will contain some function relations and arguments to run them after a command is processed
 {bot_object_id: [{func: f, args: [], kwargs: {}}]}
 """
 POST_PROCESSING_STACK = {}
+POST_PROCESSING_LOCK = threading.Lock()  # The updates of one bot can be handled in several threads
 
 
 # configure_logging()
@@ -76,14 +84,21 @@ class Worker:
     def __init__(self, bot: Bot):
         self.source = SourceManager(bot.id)  # Don't adding layer yet
         self.bot = bot
+        self.checkpointer = OffsetCheckpointer(bot)
+        self.scheduler = EventScheduler()
+        self.events_armed = False
+        self.dispatcher = ChatDispatcher() if CHAT_DISPATCH_WORKERS > 1 else None
 
     def __getitem__(self, item):
+        if item in self.__dict__:
+            return self.__dict__[item]
         return self.__getattr__(item)
 
     def __getattr__(self, item):
-        if item == 'source' or item in self.__dict__:
-            return self.__dict__[item]
-        return self.__dict__['source'][item]
+        # Is called only for the names which are not own attributes - reading the handled update's context
+        if item == 'source':
+            raise AttributeError(item)
+        return update_context.get_required()[item]
 
     def __setitem__(self, key, value):
         self.__setattr__(key, value)
@@ -105,30 +120,31 @@ class Worker:
                     timeout  # Setting timeout to delay empty updates handling
             })
         if update_last_updated:
-            self.bot.last_updated = timezone.now()
-            self.bot.save()
+            self.checkpointer.touch()
         return updates
 
     def adm_log(self, message):
         """ Will log to the administrator page if available """
         if not self.is_administrator_page:
             if self.pg_adm_page:
-                self.bot.send_message(self.pg_adm_page, message)
+                self.bot.send_message(self.pg_adm_page, message, priority=PRIORITY_LOG, wait=False)
         elif isinstance(self.participant_group,
                         AdministratorPage) or self.administrator_page:
             self.bot.send_message(
                 self.participant_group or self.administrator_page,
                 message,
-                reply_to_message_id=self.message['message_id'])
+                reply_to_message_id=self.message['message_id'],
+                priority=PRIORITY_LOG,
+                wait=False)
         else:
             print("Unknown in adm_log!!!")
 
     def run_post_processing_functions(self):
         # Can't be sourced, because this has to be called after the bot's offset is changed
-        if self.bot.id not in POST_PROCESSING_STACK:
+        with POST_PROCESSING_LOCK:
+            funcs = POST_PROCESSING_STACK.pop(self.bot.id, None)
+        if not funcs:
             return
-        funcs = POST_PROCESSING_STACK[self.bot.id]
-        del POST_PROCESSING_STACK[self.bot.id]
         for func_data in funcs:
             func_data['func'](*(func_data.get('args') or []),
                               **(func_data.get('kwargs') or {}))
@@ -136,7 +152,8 @@ class Worker:
     def run_command(self, command: TelegramCommand = None):
         if not command:
             command = self.command_model
-        COMMANDS_MAPPING[command.command_handler](self)
+        with instrumentation.command(command.command_handler):
+            COMMANDS_MAPPING[command.command_handler](self)
 
     def handle_update(self, update, *, catch_exceptions=False) -> bool:
         """ Handling Update
@@ -154,7 +171,8 @@ class Worker:
         self.source.message = message
         if message:
             try:
-                message_handler.handle_message(self)
+                with instrumentation.update_scope():
+                    message_handler.handle_message(self)
             except Exception as exception:
                 if catch_exceptions:
                     catched_exception = True
@@ -175,7 +193,7 @@ class Worker:
         else:
             pr_m = '⭐' * max(
                 self['groupspecificparticipantdata'].
-                    highest_standard_role_binding.role.priority_level, 0)
+                    highest_standard_role.priority_level, 0)
 
         if pr_m:
             pr_m += ' '
@@ -236,16 +254,20 @@ class Worker:
             self.bot.send_message(
                 self.participant_group,
                 log,
-                reply_to_message_id=self.message['message_id'])
+                reply_to_message_id=self.message['message_id'],
+                priority=PRIORITY_NOTICE,
+                wait=False)
 
-    def answer_to_the_message(self, text: str):
+    def answer_to_the_message(self, text: str, *, priority=PRIORITY_DEFAULT):
         """
-        Will answer to the message
+        Will answer to the message - without waiting for the delivery
         """
         self.bot.send_message(
             self.message['chat']['id'],
             text,
-            reply_to_message_id=self.message['message_id'])
+            reply_to_message_id=self.message['message_id'],
+            priority=priority,
+            wait=False)
 
     @property
     def active_pg(self):
@@ -257,11 +279,39 @@ class Worker:
     def update_bot(self, *, timeout=60):
         """ Will get bot updates """
         updates = self.get_updates(timeout=timeout)
-        for update in updates:
+        self.process_updates(updates)
+
+    def handle_update_once(self, update):
+        if not self.checkpointer.is_handled(update["update_id"]):  # Can be replayed after a crash
             self.handle_update(update)
-            self.bot.offset = update["update_id"] + 1
-            self.bot.save()
+            self.checkpointer.mark_handled(update["update_id"])
+
+    def process_updates(self, updates):
+        """ Will handle already received updates and move the bot's offset
+        - with the dispatcher the chats are handled concurrently, the post-processing functions
+          are called after the whole batch
+        """
+        if self.dispatcher is not None:
+            self.dispatcher.dispatch(
+                updates, self.handle_update_once,
+                lambda update: self.checkpointer.advance(update["update_id"] + 1))
+            if self.bot.id in POST_PROCESSING_STACK:
+                self.checkpointer.flush()  # The post-processing functions can restart the program
             self.run_post_processing_functions()
+            return
+        for update in updates:
+            self.handle_update_once(update)
+            self.checkpointer.advance(update["update_id"] + 1)
+            if self.bot.id in POST_PROCESSING_STACK:
+                self.checkpointer.flush()  # The post-processing functions can restart the program
+            self.run_post_processing_functions()
+
+    def shutdown(self):
+        """ Will flush the write-behind data - call before stopping the worker """
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown()
+        self.checkpointer.flush()
+        message_instance_recorder.flush()
 
     def add_to_post_processing_stack(self, func, *args, **kwargs):
         """
@@ -271,39 +321,43 @@ class Worker:
         :param kwargs: has to be used when the func is function
         :return:
         """
-        if self.source.bot.id not in POST_PROCESSING_STACK:
-            POST_PROCESSING_STACK[self.source.bot.id] = []
-        if isinstance(func, dict):
-            POST_PROCESSING_STACK[self.source.bot.id].append(func)
-        else:
-            POST_PROCESSING_STACK[self.source.bot.id].append({
-                'func': func,
-                'args': args,
-                'kwargs': kwargs
-            })
+        with POST_PROCESSING_LOCK:
+            if self.source.bot.id not in POST_PROCESSING_STACK:
+                POST_PROCESSING_STACK[self.source.bot.id] = []
+            if isinstance(func, dict):
+                POST_PROCESSING_STACK[self.source.bot.id].append(func)
+            else:
+                POST_PROCESSING_STACK[self.source.bot.id].append({
+                    'func': func,
+                    'args': args,
+                    'kwargs': kwargs
+                })
 
     def createGroupLeaderBoard(self):
         """ Will process and present the data for group leaderboards """
+        participant_group = self.source.participant_group or self.source.administrator_page.participant_group
+        ranking = [
+            (gspd_id, score, percentage)
+            for gspd_id, score, percentage in leaderboard_ranks.get_ranking(participant_group.id).ordered()
+            if score
+        ]  # In the beginning higher score, higher percentage and lower id
+        gss_by_id = GroupSpecificParticipantData.objects.select_related('participant').in_bulk(
+            [gspd_id for gspd_id, _, _ in ranking])
         gss = [
             {
                 "participant":
-                    gs.participant,
+                    gss_by_id[gspd_id].participant,
                 "score":
-                    gs.score,
+                    score,
                 "percentage":
-                    gs.percentage,
+                    percentage,
                 "standard_role":
-                    safe_getter(gs.highest_standard_role_binding, "role"),
+                    gss_by_id[gspd_id].highest_standard_role,
                 "non_standard_role":
-                    safe_getter(gs.highest_non_standard_role_binding, "role"),
+                    gss_by_id[gspd_id].highest_non_standard_role,
                 "position_change":
-                    self.source.position_change.get(gs.id, 0)
-            } for gs in sorted(
-                (gs for gs in (self.source.participant_group or self.source.administrator_page.participant_group).
-                    groupspecificparticipantdata_set.all() if gs.score),
-                key=lambda gs: (-(gs.score or 0), -(gs.percentage or 0), gs.id),
-                # In the beginning higher score, higher percentage and lower id
-            )
+                    self.source.position_change.get(gspd_id, 0)
+            } for gspd_id, score, percentage in ranking if gspd_id in gss_by_id
         ]
         return gss
 
@@ -313,13 +367,12 @@ class Worker:
             "participant":
                 gs.participant,
             "non_standard_role":
-                gs.highest_non_standard_role_binding.role,
+                gs.highest_non_standard_role,
         } for gs in sorted(
-            (gs for gs in (self.source.participant_group or self.source.administrator_page.participant_group).
-                groupspecificparticipantdata_set.all()
-             if gs.highest_non_standard_role_binding),
+            (self.source.participant_group or self.source.administrator_page.participant_group).
+                groupspecificparticipantdata_set.filter(non_standard_role__isnull=False),
             key=lambda gs:
-            [gs.highest_non_standard_role_binding.role.priority_level],
+            [gs.highest_non_standard_role.priority_level],
         )[::-1]]
         return admin_gss
 
@@ -436,7 +489,14 @@ class Worker:
 
     def do_checks(self):
         """
-        Will do all post-checks
+        Will fire the due events (see main/events)
         - notification in inactive groups
         """
-        inactive_group.check(self)
+        if not self.events_armed:
+            for event in EVENTS_MAPPING.values():
+                event.arm(self, self.scheduler)
+            self.events_armed = True
+        self.scheduler.run_due(self)
+
+
+update_context.install_field_properties(Worker, exclude=('bot',))  # The bot is an own attribute